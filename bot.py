@@ -3,7 +3,6 @@
 import os
 import logging
 import sqlite3
-import asyncio
 from datetime import datetime
 from telegram import Update, BotCommand
 from telegram.ext import (
@@ -14,10 +13,13 @@ from telegram.ext import (
     filters,
     ContextTypes
 )
-from db import create_tables, add_points, get_user_stats, get_top10
+from db import (
+    create_tables, close_connections,
+    start_points_writer, warm_leaderboard
+)
 from juegos import (
     initialize_games_system,
-    cleanup_games_periodically,
+    start_game_expiry,
     cmd_cinematrivia,
     cmd_adivinapelicula,
     cmd_emojipelicula,
@@ -25,24 +27,26 @@ from juegos import (
     cmd_rendirse,
     cmd_estadisticasjuegos,
     cmd_top_jugadores,
-    handle_trivia_callback,
-    handle_game_message
+    handle_trivia_callback
 )
 from sistema_autorizacion import (
     create_auth_tables, is_chat_authorized, authorize_chat,
-    auth_required, cmd_solicitar_autorizacion, cmd_aprobar_grupo, cmd_ver_solicitudes
+    auth_required, cmd_solicitar_autorizacion, cmd_aprobar_grupo, cmd_ver_solicitudes,
+    cmd_reconciliar_puntos, cmd_recalcular_logros, cmd_spam, warm_auth_cache
 )
 from comandos_basicos import (
     cmd_start, cmd_help, cmd_ranking, cmd_miperfil, cmd_reto
 )
-# IMPORTACIÓN CORREGIDA: Importar handle_hashtags desde hashtags.py
-from hashtags import handle_hashtags
+from migrations import run_migrations, check_query_plans
+from log_config import setup_logging
+from outbox import outbox
+# Importarlo registra el oyente de logros sobre los eventos de puntos
+import handlers.achievements
+# Hashtags, retos y respuestas de juegos en un solo handler
+from text_pipeline import handle_text_message
 
-# Configurar logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Configurar logging (niveles y formato en log_config.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 async def post_init(application):
@@ -63,35 +67,52 @@ async def post_init(application):
         BotCommand("topjugadores", "Ranking global de juegos")
     ]
     await application.bot.set_my_commands(commands)
-    print("[INFO] ✅ Comandos del bot configurados")
+    logger.info("✅ Comandos del bot configurados")
     
-    # Crear la tarea de limpieza aquí, dentro del loop de eventos
-    asyncio.create_task(cleanup_games_periodically())
-    print("[INFO] ✅ Tarea de limpieza de juegos iniciada")
+    # El vencimiento de juegos necesita el loop de eventos
+    start_game_expiry(application)
+    logger.info("✅ Vencimiento de juegos iniciado")
+
+    outbox.start()
+    logger.info("✅ Cola de mensajes salientes iniciada")
+
+async def post_stop(application):
+    """Enviar lo que quede en la cola mientras el bot sigue disponible"""
+    await outbox.stop()
+
+async def post_shutdown(application):
+    """Liberar recursos al detener la aplicación"""
+    close_connections()
+    logger.info("✅ Conexiones a la base de datos cerradas")
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Manejar errores del bot"""
     import traceback
     tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
     tb_string = "".join(tb_list)
-    logger.error(f"Exception while handling an update: {tb_string}")
+    logger.error("Exception while handling an update: %s", tb_string)
 
 def main():
     token = os.environ.get("BOT_TOKEN")
     if not token:
-        print("[ERROR] BOT_TOKEN no encontrado en variables de entorno")
+        logger.error("BOT_TOKEN no encontrado en variables de entorno")
         return
 
-    print(f"[INFO] 🤖 Iniciando bot...")
-    print(f"[INFO] 🔑 Token configurado: {token[:10]}...")
+    logger.info("🤖 Iniciando bot...")
+    logger.info("🔑 Token configurado: %s...", token[:10])
 
     # Inicializar base de datos y sistemas
     create_tables()
     create_auth_tables()
     initialize_games_system()
+    run_migrations()
+    check_query_plans()
+    warm_auth_cache()
+    start_points_writer()
+    warm_leaderboard()
 
     # Crear aplicación
-    app = ApplicationBuilder().token(token).post_init(post_init).build()
+    app = ApplicationBuilder().token(token).post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown).build()
 
     # Agregar manejador de errores
     app.add_error_handler(error_handler)
@@ -100,6 +121,9 @@ def main():
     app.add_handler(CommandHandler("solicitar", cmd_solicitar_autorizacion))
     app.add_handler(CommandHandler("aprobar", cmd_aprobar_grupo))
     app.add_handler(CommandHandler("solicitudes", cmd_ver_solicitudes))
+    app.add_handler(CommandHandler("reconciliar", cmd_reconciliar_puntos))
+    app.add_handler(CommandHandler("recalcularlogros", cmd_recalcular_logros))
+    app.add_handler(CommandHandler("spam", cmd_spam))
     
     # Comandos básicos (requieren autorización)
     app.add_handler(CommandHandler("start", auth_required(cmd_start)))
@@ -117,24 +141,20 @@ def main():
     app.add_handler(CommandHandler("estadisticasjuegos", auth_required(cmd_estadisticasjuegos)))
     app.add_handler(CommandHandler("topjugadores", auth_required(cmd_top_jugadores)))
     
-    # MANEJADOR DE HASHTAGS - DEBE IR ANTES que handle_game_message
-    # para que tenga prioridad en el procesamiento
-    hashtag_filter = filters.TEXT & ~filters.COMMAND & filters.Regex(r'#\w+')
-    app.add_handler(MessageHandler(hashtag_filter, auth_required(handle_hashtags)))
-    print("[INFO] ✅ Manejador de hashtags configurado")
-    
-    # Manejadores de callbacks y mensajes (van después)
+    # Callbacks de trivia y mensajes de texto (hashtags, retos y juegos;
+    # la autorización se comprueba dentro, una vez por mensaje)
     app.add_handler(CallbackQueryHandler(handle_trivia_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, auth_required(handle_game_message)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+    logger.info("✅ Pipeline de mensajes de texto configurado")
 
-    print("[INFO] ✅ Todos los handlers configurados")
+    logger.info("✅ Todos los handlers configurados")
 
     # Ejecutar en modo desarrollo o producción
     if os.environ.get("DEVELOPMENT"):
-        print("[INFO] 🔄 Modo desarrollo - usando polling")
+        logger.info("🔄 Modo desarrollo - usando polling")
         app.run_polling(drop_pending_updates=True)
     else:
-        print("[INFO] 🌐 Modo producción - usando webhook")
+        logger.info("🌐 Modo producción - usando webhook")
         webhook_url = f"{os.environ.get('RENDER_EXTERNAL_URL', '')}/webhook"
         
         try:
@@ -146,8 +166,8 @@ def main():
                 drop_pending_updates=True
             )
         except Exception as e:
-            logger.error(f"Error configurando webhook: {e}")
-            print("[INFO] 🔄 Fallback a polling debido a error en webhook")
+            logger.error("Error configurando webhook: %s", e)
+            logger.info("🔄 Fallback a polling debido a error en webhook")
             app.run_polling(drop_pending_updates=True)
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+# catalogue.py - Catálogo de películas y preguntas de trivia (data/)
+#
+# data/movies.jsonl  una película por línea (JSON)
+# data/trivia.json   lista de preguntas
+#
+# Las películas se parsean al usarlas: cargar el catálogo solo lee el fichero
+# y lo parte en líneas. Los índices (dificultad, género, con emojis) se
+# construyen en un hilo aparte justo después de cargar, sin guardar las
+# películas parseadas.
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+from title_index import TitleIndex
+from decks import ShuffledDecks
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_DIR = os.getenv("CATALOGUE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+MOVIES_FILE = "movies.jsonl"
+TRIVIA_FILE = "trivia.json"
+
+# Cada cuánto se mira el mtime de los ficheros (recarga sin reiniciar)
+CATALOGUE_CHECK_INTERVAL = 5.0
+
+class CatalogueSnapshot:
+    """Contenido de una carga del catálogo. No se modifica: una recarga crea
+    otro y lo sustituye de una sola asignación."""
+
+    def __init__(self, movie_lines: List[bytes], trivia: List[Dict], mtimes):
+        self._lines = movie_lines
+        self._movies = {}   # posición -> película ya parseada
+        self.trivia = trivia
+        self.mtimes = mtimes
+        # Las variantes de cada título se calculan la primera vez que se juega
+        self.title_index = TitleIndex()
+
+        self.by_difficulty = defaultdict(list)
+        self.by_genre = defaultdict(list)
+        self.with_emojis = []
+        self._filtered = {}   # filtros -> posiciones, para combinaciones
+        self._indexed = threading.Event()
+
+    def __len__(self):
+        return len(self._lines)
+
+    def movie(self, position: int) -> Dict:
+        movie = self._movies.get(position)
+        if movie is None:
+            movie = self._movies[position] = json.loads(self._lines[position])
+        return movie
+
+    def build_indexes(self):
+        try:
+            # Se parsea cada línea solo para indexarla: en _movies quedan
+            # únicamente las películas que se llegan a jugar
+            for position, line in enumerate(self._lines):
+                try:
+                    movie = json.loads(line)
+                except ValueError as e:
+                    logger.error("Película %s del catálogo inválida: %s", position + 1, e)
+                    continue
+                self.by_difficulty[movie.get("difficulty")].append(position)
+                self.by_genre[movie.get("genre", "").lower()].append(position)
+                if movie.get("emojis"):
+                    self.with_emojis.append(position)
+        finally:
+            self._indexed.set()
+
+    def movie_positions(self, difficulty: Optional[int] = None, genre: Optional[str] = None,
+                        with_emojis: bool = False):
+        """Posiciones de las películas que cumplen todos los filtros.
+
+        Con filtros espera a que terminen los índices: desde el event loop
+        se llama con run_db (como draw_movie desde juegos.py).
+        """
+        key = (difficulty, genre.lower() if genre is not None else None, with_emojis)
+        if key == (None, None, False):
+            return range(len(self._lines))
+
+        positions = self._filtered.get(key)
+        if positions is None:
+            self._indexed.wait()
+            candidates = []
+            if difficulty is not None:
+                candidates.append(self.by_difficulty.get(difficulty, []))
+            if genre is not None:
+                candidates.append(self.by_genre.get(key[1], []))
+            if with_emojis:
+                candidates.append(self.with_emojis)
+            candidates.sort(key=len)
+            others = [set(c) for c in candidates[1:]]
+            positions = [p for p in candidates[0] if all(p in other for other in others)]
+            self._filtered[key] = positions
+        return positions
+
+class Catalogue:
+    """Carga perezosa del catálogo y recarga cuando cambian los ficheros"""
+
+    def __init__(self, directory: str = CATALOGUE_DIR, check_interval: float = CATALOGUE_CHECK_INTERVAL):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.decks = ShuffledDecks()
+
+    def _paths(self):
+        return os.path.join(self.directory, MOVIES_FILE), os.path.join(self.directory, TRIVIA_FILE)
+
+    def _mtimes(self):
+        return tuple(os.stat(path).st_mtime_ns for path in self._paths())
+
+    def load(self) -> CatalogueSnapshot:
+        """Leer los ficheros y sustituir el catálogo en uso"""
+        with self._lock:
+            mtimes = self._mtimes()
+            movies_path, trivia_path = self._paths()
+            with open(movies_path, "rb") as f:
+                movie_lines = [line for line in f.read().split(b"\n") if line.strip()]
+            with open(trivia_path, encoding="utf-8") as f:
+                trivia = json.load(f)
+            snapshot = CatalogueSnapshot(movie_lines, trivia, mtimes)
+            threading.Thread(target=snapshot.build_indexes, name="catalogue-index", daemon=True).start()
+            self._snapshot = snapshot
+            self._next_check = time.monotonic() + self.check_interval
+        logger.info("Catálogo cargado: %s películas, %s preguntas", len(movie_lines), len(trivia))
+        return snapshot
+
+    def snapshot(self) -> CatalogueSnapshot:
+        """Catálogo en uso, recargado si cambiaron los ficheros.
+
+        Puede hacer stat y leer los ficheros: desde el event loop se llama
+        con run_db (draw_movie/draw_trivia desde juegos.py).
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.load()
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            try:
+                if self._mtimes() != snapshot.mtimes:
+                    return self.load()
+            except (OSError, ValueError) as e:
+                # Fichero a medio escribir o borrado: seguir con el catálogo anterior
+                logger.error("No se pudo recargar el catálogo: %s", e)
+        return snapshot
+
+    def draw_movie(self, chat_id: int, with_emojis: bool = False) -> Optional[Dict]:
+        """Siguiente película del mazo del chat (sin repetir hasta agotarlo)"""
+        snapshot = self.snapshot()
+        positions = snapshot.movie_positions(with_emojis=with_emojis)
+        if not positions:
+            return None
+        deck = "emoji_movies" if with_emojis else "movies"
+        return snapshot.movie(positions[self.decks.draw(chat_id, deck, len(positions))])
+
+    def draw_trivia(self, chat_id: int) -> Optional[Dict]:
+        """Siguiente pregunta del mazo del chat (sin repetir hasta agotarlo)"""
+        trivia = self.snapshot().trivia
+        if not trivia:
+            return None
+        return trivia[self.decks.draw(chat_id, "trivia", len(trivia))]
+
+    def is_correct_guess(self, movie: Dict, guess: str, normalized: Optional[str] = None) -> bool:
+        """Se llama en el loop con cada mensaje de un chat con juego: sin comprobar
+        recargas. El catálogo ya está cargado (initialize_games_system)."""
+        return self._snapshot.title_index.is_correct_guess(movie, guess, normalized)
+
+catalogue = Catalogue()
@@ -1,14 +1,12 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from db import get_user_stats, get_top10, add_points
+from db import get_user_stats_async, get_top10_async, add_points_async, get_chat_top_async, get_window_top_async
+from handlers.spam import is_hashtag_spam
 import random
 import datetime
 import logging
 import re
-import time
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # HASHTAGS UNIFICADOS - SIN REPETICIONES Y CON DETECCIÓN FLEXIBLE
@@ -45,9 +43,6 @@ VALID_HASHTAGS = {
     'spoiler': 1
 }
 
-# Cache para control de spam
-user_hashtag_cache = {}
-
 def normalize_text(text):
     """Normaliza texto removiendo tildes y caracteres especiales"""
     import unicodedata
@@ -68,16 +63,16 @@ def find_hashtags_in_message(text):
     hashtag_pattern = r'#(\w+)'
     hashtags_in_text = re.findall(hashtag_pattern, text_normalized)
     
-    print(f"[DEBUG] Hashtags extraídos del texto: {hashtags_in_text}")
+    logger.debug("Hashtags extraídos del texto: %s", hashtags_in_text)
     
     # Verificar cada hashtag extraído contra nuestra lista válida
     for hashtag_word in hashtags_in_text:
         if hashtag_word in VALID_HASHTAGS:
             points = VALID_HASHTAGS[hashtag_word]
             found_hashtags.append((f"#{hashtag_word}", points))
-            print(f"[DEBUG] ✅ Hashtag válido encontrado: #{hashtag_word} = {points} puntos")
+            logger.debug("✅ Hashtag válido encontrado: #%s = %s puntos", hashtag_word, points)
         else:
-            print(f"[DEBUG] ❌ Hashtag NO válido: #{hashtag_word}")
+            logger.debug("❌ Hashtag NO válido: #%s", hashtag_word)
     
     # Eliminar duplicados manteniendo el orden
     unique_hashtags = []
@@ -87,32 +82,12 @@ def find_hashtags_in_message(text):
             unique_hashtags.append((hashtag, points))
             seen.add(hashtag)
     
-    print(f"[DEBUG] Hashtags únicos finales: {unique_hashtags}")
+    logger.debug("Hashtags únicos finales: %s", unique_hashtags)
     return unique_hashtags
 
 def is_spam(user_id, hashtag):
-    """Detecta spam basado en frecuencia de hashtags por usuario"""
-    current_time = time.time()
-    
-    if user_id not in user_hashtag_cache:
-        user_hashtag_cache[user_id] = {}
-    
-    user_data = user_hashtag_cache[user_id]
-    
-    # Limpiar datos antiguos (más de 5 minutos)
-    if "last_time" in user_data and current_time - user_data["last_time"] > 300:
-        user_data.clear()
-    
-    # Contar uso del hashtag
-    if hashtag in user_data:
-        user_data[hashtag] = user_data.get(hashtag, 0) + 1
-        if user_data[hashtag] > 3:  # Máximo 3 veces en 5 minutos
-            return True
-    else:
-        user_data[hashtag] = 1
-    
-    user_data["last_time"] = current_time
-    return False
+    """Detecta spam basado en frecuencia de hashtags por usuario (máx. 3 usos en 5 minutos)"""
+    return is_hashtag_spam(user_id, normalize_text(hashtag))
 
 def count_words(text):
     """Cuenta palabras sin incluir hashtags"""
@@ -172,7 +147,7 @@ Estás en un {chat_type} dedicado al séptimo arte.
 
 <b>📋 Comandos principales:</b>
 • /help - Guía completa del bot
-• /ranking - Ver top 10 usuarios
+• /ranking - Ver top 10 usuarios (/ranking hoy|semana|mes)
 • /miperfil - Tus estadísticas personales
 • /reto - Reto diario actual
 
@@ -193,9 +168,9 @@ Comienza usando hashtags como <b>#cinefilo #pelicula #critica</b>
             parse_mode='HTML',
             disable_web_page_preview=True
         )
-        logger.info(f"Usuario {user.id} inició el bot en {chat_type}")
+        logger.info("Usuario %s inició el bot en %s", user.id, chat_type)
     except Exception as e:
-        logger.error(f"Error en cmd_start: {e}")
+        logger.error("Error en cmd_start: %s", e)
         await update.message.reply_text("¡Bienvenido al Bot Cinéfilo! Usa /help para más información.")
 
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -231,6 +206,7 @@ Gana puntos usando hashtags en tus mensajes:
 • /start - Iniciar y conocer el bot
 • /help - Esta guía completa
 • /ranking - Top 10 usuarios del grupo
+• /ranking semana - Top de la semana (también hoy, mes)
 • /miperfil - Tus estadísticas personales
 • /reto - Ver reto diario actual
 
@@ -272,9 +248,9 @@ Gana puntos usando hashtags en tus mensajes:
     
     try:
         await update.message.reply_text(help_text, parse_mode='HTML')
-        logger.info(f"Usuario {update.effective_user.id} solicitó ayuda")
+        logger.info("Usuario %s solicitó ayuda", update.effective_user.id)
     except Exception as e:
-        logger.error(f"Error en cmd_help: {e}")
+        logger.error("Error en cmd_help: %s", e)
         # Fallback sin formato
         simple_help = """🎬 GUÍA DEL BOT CINÉFILO
 
@@ -294,10 +270,30 @@ Gana puntos usando hashtags en tus mensajes:
 ¡Usa hashtags en tus mensajes para ganar puntos! 🍿"""
         await update.message.reply_text(simple_help)
 
+# Títulos de /ranking por periodo
+RANKING_WINDOW_TITLES = {
+    "hoy": " DE HOY",
+    "semana": " DE LA SEMANA",
+    "mes": " DE LOS ÚLTIMOS 30 DÍAS",
+}
+
 async def cmd_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Mostrar ranking de usuarios con formato simplificado"""
+    """Mostrar ranking de usuarios con formato simplificado (/ranking [hoy|semana|mes])"""
     try:
-        top_users = get_top10()
+        window = context.args[0].lower() if context.args else None
+        if window and window not in RANKING_WINDOW_TITLES:
+            await update.message.reply_text("Uso: /ranking [hoy|semana|mes]")
+            return
+
+        # En grupos, el ranking del propio chat; en privado, el global
+        chat = update.effective_chat
+        chat_id = None if chat.type == "private" else chat.id
+        if window:
+            top_users = await get_window_top_async(window, chat_id)
+        elif chat_id is None:
+            top_users = await get_top10_async()
+        else:
+            top_users = await get_chat_top_async(chat_id)
         
         if not top_users:
             await update.message.reply_text(
@@ -306,7 +302,7 @@ async def cmd_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        ranking_text = "🏆 <b>TOP 10 CINÉFILOS</b> 🎬\n\n"
+        ranking_text = f"🏆 <b>TOP 10 CINÉFILOS{RANKING_WINDOW_TITLES.get(window, '')}</b> 🎬\n\n"
         
         for i, user_data in enumerate(top_users, 1):
             # Manejar diferentes formatos de datos
@@ -330,10 +326,10 @@ async def cmd_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ranking_text += f"{position_icon} {username} - {points} pts (Nivel {level})\n"
         
         await update.message.reply_text(ranking_text, parse_mode='HTML')
-        logger.info(f"Usuario {update.effective_user.id} consultó ranking")
+        logger.info("Usuario %s consultó ranking", update.effective_user.id)
         
     except Exception as e:
-        logger.error(f"Error en cmd_ranking: {e}")
+        logger.error("Error en cmd_ranking: %s", e)
         await update.message.reply_text("❌ Error al obtener el ranking. Intenta más tarde.")
 
 def calculate_level(points):
@@ -348,7 +344,7 @@ async def cmd_miperfil(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     try:
-        stats = get_user_stats(user.id)
+        stats = await get_user_stats_async(user.id)
         
         if not stats:
             await update.message.reply_text(
@@ -404,10 +400,10 @@ async def cmd_miperfil(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     profile_text += f"\n   • {hashtag}: {count} veces"
         
         await update.message.reply_text(profile_text, parse_mode='HTML')
-        logger.info(f"Usuario {user.id} consultó su perfil")
+        logger.info("Usuario %s consultó su perfil", user.id)
         
     except Exception as e:
-        logger.error(f"Error en cmd_miperfil: {e}")
+        logger.error("Error en cmd_miperfil: %s", e)
         await update.message.reply_text("❌ Error al obtener tu perfil. Intenta más tarde.")
 
 async def cmd_reto(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -447,9 +443,9 @@ async def cmd_reto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         await update.message.reply_text(reto_text, parse_mode='HTML')
-        logger.info(f"Usuario {update.effective_user.id} consultó reto diario")
+        logger.info("Usuario %s consultó reto diario", update.effective_user.id)
     except Exception as e:
-        logger.error(f"Error en cmd_reto: {e}")
+        logger.error("Error en cmd_reto: %s", e)
         # Fallback simple
         simple_text = f"🎯 RETO DIARIO - {today.strftime('%d/%m/%Y')}\n\n{daily_challenge}\n\n¡Responde usando hashtags cinéfilos para ganar puntos! 🍿"
         await update.message.reply_text(simple_text)
@@ -463,18 +459,18 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
     
-    print(f"[DEBUG] 🔍 Procesando mensaje de {user.username or user.first_name}")
-    print(f"[DEBUG] 📝 Texto completo: {message_text}")
-    print(f"[DEBUG] 🏷️ Chat ID: {chat.id}")
+    logger.debug("🔍 Procesando mensaje de %s", user.username or user.first_name)
+    logger.debug("📝 Texto completo: %s", message_text)
+    logger.debug("🏷️ Chat ID: %s", chat.id)
     
     # 🎯 NUEVA DETECCIÓN MEJORADA
     found_hashtags = find_hashtags_in_message(message_text)
     
     if not found_hashtags:
-        print(f"[DEBUG] ❌ No se encontraron hashtags válidos en: {message_text}")
+        logger.debug("❌ No se encontraron hashtags válidos en: %s", message_text)
         return
     
-    print(f"[DEBUG] ✅ Hashtags encontrados: {found_hashtags}")
+    logger.debug("✅ Hashtags encontrados: %s", found_hashtags)
     
     # Verificar spam y calcular puntos
     valid_hashtags = []
@@ -487,7 +483,7 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Verificar spam
         if is_spam(user.id, hashtag):
             warnings.append(f"⚠️ {hashtag}: Detectado spam. Usa hashtags con moderación.")
-            print(f"[DEBUG] 🚫 Spam detectado para {hashtag}")
+            logger.debug("🚫 Spam detectado para %s", hashtag)
             continue
         
         # Validaciones especiales
@@ -502,10 +498,10 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         valid_hashtags.append((hashtag, points))
         total_points += points
-        print(f"[DEBUG] ✅ {hashtag} = {points} puntos")
+        logger.debug("✅ %s = %s puntos", hashtag, points)
     
     if total_points <= 0:
-        print(f"[DEBUG] ❌ Total de puntos = 0, no se procesará")
+        logger.debug("❌ Total de puntos = 0, no se procesará")
         return
     
     # Bonus por mensaje detallado
@@ -514,12 +510,12 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
         total_points += 2
         bonus_text = " (+2 bonus detalle)"
     
-    print(f"[DEBUG] 💎 Total de puntos a otorgar: {total_points}")
+    logger.debug("💎 Total de puntos a otorgar: %s", total_points)
     
     try:
         # Guardar en base de datos
         primary_hashtag = valid_hashtags[0][0] if valid_hashtags else "#aporte"
-        add_points(
+        await add_points_async(
             user_id=user.id,
             username=user.username or user.first_name,
             points=total_points,
@@ -530,7 +526,7 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context=context
         )
         
-        print(f"[DEBUG] ✅ Puntos guardados en BD exitosamente")
+        logger.debug("✅ Puntos guardados en BD exitosamente")
         
         # Crear respuesta
         hashtags_list = ", ".join([h[0] for h, p in valid_hashtags])
@@ -564,18 +560,16 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_to_message_id=update.message.message_id
         )
         
-        print(f"[DEBUG] ✅ Respuesta enviada correctamente")
-        logger.info(f"Usuario {user.id} ganó {total_points} puntos con: {hashtags_list}")
+        logger.debug("✅ Respuesta enviada correctamente")
+        logger.info("Usuario %s ganó %s puntos con: %s", user.id, total_points, hashtags_list)
         
     except Exception as e:
-        logger.error(f"❌ ERROR en handle_hashtags: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ ERROR en handle_hashtags: %s", e)
         
         # Respuesta de emergencia
         try:
             await update.message.reply_text(f"✅ ¡Puntos ganados! +{total_points} pts 🎬")
         except:
-            print(f"[DEBUG] ❌ No se pudo enviar ni la respuesta de emergencia")
+            logger.debug("❌ No se pudo enviar ni la respuesta de emergencia")
 
-    print(f"[DEBUG] 🏁 handle_hashtags terminado para {user.username or user.first_name}")
+    logger.debug("🏁 handle_hashtags terminado para %s", user.username or user.first_name)
@@ -1,86 +1,1035 @@
+import os
+import json
+import logging
+import uuid
 import sqlite3
-from datetime import datetime
+import queue
+import asyncio
+import threading
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from leaderboard import Leaderboard
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = "puntum.db"
 
+# Pool de conexiones: un escritor y varios lectores de larga duración
+READER_POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 256
+
+# Pragmas aplicados a cada conexión nueva del pool
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+)
+
+class PooledConnection:
+    """Conexión prestada por el pool.
+
+    Expone la misma interfaz que sqlite3.Connection, pero close() la devuelve
+    al pool en lugar de cerrarla, así que el código existente que hace
+    get_connection() ... conn.close() sigue funcionando sin cambios.
+    """
+
+    _conn = None
+    _released = True
+
+    def __init__(self, pool, conn, readonly):
+        self._pool = pool
+        self._conn = conn
+        self._readonly = readonly
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        if self._readonly:
+            self._pool.release_reader(self._conn)
+        else:
+            self._pool.release_writer(self._conn)
+
+    def __del__(self):
+        # Conexiones olvidadas (p. ej. tras una excepción) vuelven al pool
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class WriterLock:
+    """Lock reentrante para el escritor que se puede soltar desde otro hilo.
+
+    Un RLock solo lo puede soltar su dueño: una conexión olvidada cuyo
+    __del__ corre en otro hilo (p. ej. el traceback de una excepción en un
+    hilo de run_db liberado en el event loop) lo dejaría tomado para siempre.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._owner = None
+        self.depth = 0
+
+    def acquire(self, timeout: float = None) -> bool:
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner != me:
+                if not self._cond.wait_for(lambda: self._owner is None, timeout):
+                    return False
+                self._owner = me
+            self.depth += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            if self.depth <= 0:
+                raise RuntimeError("WriterLock liberado sin tomar")
+            self.depth -= 1
+            if self.depth == 0:
+                self._owner = None
+                self._cond.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class ConnectionPool:
+    """Pool con una conexión de escritura y N de lectura, en modo WAL.
+
+    El escritor se protege con un WriterLock para que las llamadas anidadas
+    del mismo hilo (p. ej. authorize_chat dentro de cmd_aprobar_grupo)
+    reutilicen la misma conexión. Los lectores se sirven desde una cola; si se agotan se
+    abre una conexión extra que se cierra al devolverla.
+    """
+
+    def __init__(self, path, readers=READER_POOL_SIZE):
+        self.path = path
+        self._readers = queue.LifoQueue(maxsize=readers)
+        self._writer = None
+        self._writer_lock = WriterLock()
+        self._init_lock = threading.Lock()
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=5.0,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def acquire_writer(self):
+        self._writer_lock.acquire()
+        try:
+            if self._writer is None:
+                with self._init_lock:
+                    if self._writer is None:
+                        self._writer = self._connect()
+        except Exception:
+            self._writer_lock.release()
+            raise
+        return PooledConnection(self, self._writer, readonly=False)
+
+    def release_writer(self, conn):
+        try:
+            # Lo que no se confirmó se descarta, igual que al cerrar una conexión
+            if self._writer_lock.depth == 1 and conn.in_transaction:
+                conn.rollback()
+        finally:
+            self._writer_lock.release()
+
+    def acquire_reader(self):
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect(readonly=True)
+        return PooledConnection(self, conn, readonly=True)
+
+    def release_reader(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._readers.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        """Cerrar todas las conexiones del pool"""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Obtener el pool para DB_PATH, recreándolo si la ruta cambió"""
+    global _pool
+    pool = _pool
+    if pool is None or pool.path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.path != DB_PATH:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(DB_PATH)
+            pool = _pool
+    return pool
+
 def get_connection():
-    return sqlite3.connect(DB_PATH)
+    """Conexión de escritura compartida (devolver con conn.close())"""
+    return get_pool().acquire_writer()
+
+def get_read_connection():
+    """Conexión de solo lectura del pool (devolver con conn.close())"""
+    return get_pool().acquire_reader()
+
+# Hilos dedicados a la base de datos: el event loop nunca espera al disco
+DB_EXECUTOR_WORKERS = READER_POOL_SIZE
+_db_executor = None
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """Executor con los hilos dedicados a SQLite"""
+    global _db_executor
+    if _db_executor is None:
+        with _pool_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(
+                    max_workers=DB_EXECUTOR_WORKERS,
+                    thread_name_prefix="puntum-db"
+                )
+    return _db_executor
+
+async def run_db(func, *args, **kwargs):
+    """Ejecutar una función síncrona de base de datos fuera del event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(func, *args, **kwargs))
+
+def close_connections():
+    """Detener los hilos de base de datos y cerrar el pool (al apagar el bot)"""
+    global _pool, _db_executor
+    executor = _db_executor
+    _db_executor = None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    stop_points_writer()
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
 
 def create_tables():
     conn = get_connection()
-    cursor = conn.cursor()
+    try:
+        cursor = conn.cursor()
 
-    cursor.execute(
-        """CREATE TABLE IF NOT EXISTS points (
-            user_id INTEGER,
-            username TEXT,
-            points INTEGER,
-            hashtag TEXT,
-            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-            chat_id INTEGER,
-            message_id INTEGER,
-            is_challenge_bonus INTEGER DEFAULT 0
-        )"""
-    )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS points (
+                user_id INTEGER,
+                username TEXT,
+                points INTEGER,
+                hashtag TEXT,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                chat_id INTEGER,
+                message_id INTEGER,
+                is_challenge_bonus INTEGER DEFAULT 0
+            )"""
+        )
 
-    cursor.execute(
-        """CREATE TABLE IF NOT EXISTS user_achievements (
-            user_id INTEGER,
-            achievement_id INTEGER,
-            date TEXT DEFAULT CURRENT_DATE,
-            PRIMARY KEY (user_id, achievement_id)
-        )"""
-    )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS user_achievements (
+                user_id INTEGER,
+                achievement_id INTEGER,
+                date TEXT DEFAULT CURRENT_DATE,
+                PRIMARY KEY (user_id, achievement_id)
+            )"""
+        )
 
-    # Create users table if it doesn't exist (for better user management)
-    cursor.execute(
-        """CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            username TEXT,
-            points INTEGER DEFAULT 0,
-            count INTEGER DEFAULT 0,
-            level INTEGER DEFAULT 1,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )"""
+        # Create users table if it doesn't exist (for better user management)
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                username TEXT,
+                points INTEGER DEFAULT 0,
+                count INTEGER DEFAULT 0,
+                level INTEGER DEFAULT 1,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )"""
+        )
+
+        # Create chat_config table for chat management
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS chat_config (
+                chat_id INTEGER PRIMARY KEY,
+                chat_name TEXT,
+                rankings_enabled BOOLEAN DEFAULT 1,
+                challenges_enabled BOOLEAN DEFAULT 1,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )"""
+        )
+
+        # Lotes de puntos ya confirmados (para no duplicar al reproducir el journal)
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS points_batches (
+                batch_id TEXT PRIMARY KEY,
+                committed_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )"""
+        )
+
+        # Acumulado por chat y usuario (rankings de grupo)
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS chat_users (
+                chat_id INTEGER,
+                user_id INTEGER,
+                username TEXT,
+                points INTEGER DEFAULT 0,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (chat_id, user_id)
+            )"""
+        )
+
+        # Puntos por chat, usuario y día (UTC) para los rankings por periodo.
+        # Los puntos sin chat se guardan con chat_id 0.
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS points_daily (
+                chat_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                username TEXT,
+                points INTEGER DEFAULT 0,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (chat_id, day, user_id)
+            )"""
+        )
+
+        conn.commit()
+    finally:
+        conn.close()
+
+# ESCRITURA DIFERIDA DE PUNTOS
+# Los eventos de puntos se acumulan en memoria y se confirman en una sola
+# transacción cada POINTS_FLUSH_INTERVAL_MS o cada POINTS_FLUSH_MAX_EVENTS.
+POINTS_FLUSH_INTERVAL_MS = 200
+POINTS_FLUSH_MAX_EVENTS = 100
+# Journal en disco para no perder eventos si el proceso cae antes del flush
+POINTS_JOURNAL_ENABLED = True
+# fsync por evento: sobrevive también a cortes de luz, pero es más lento
+POINTS_JOURNAL_FSYNC = False
+
+def _utc_timestamp() -> str:
+    """Mismo formato que CURRENT_TIMESTAMP de SQLite"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def _level_sql(points_expr: str) -> str:
+    """Expresión SQL equivalente a calculate_level()"""
+    return (
+        f"CASE WHEN {points_expr} >= 1000 THEN 5 "
+        f"WHEN {points_expr} >= 500 THEN 4 "
+        f"WHEN {points_expr} >= 250 THEN 3 "
+        f"WHEN {points_expr} >= 100 THEN 2 "
+        f"ELSE 1 END"
     )
 
-    # Create chat_config table for chat management
-    cursor.execute(
-        """CREATE TABLE IF NOT EXISTS chat_config (
-            chat_id INTEGER PRIMARY KEY,
-            chat_name TEXT,
-            rankings_enabled BOOLEAN DEFAULT 1,
-            challenges_enabled BOOLEAN DEFAULT 1,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )"""
+def _apply_point_events(cursor, events):
+    """Aplicar un lote de eventos de puntos dentro de una transacción abierta"""
+    cursor.executemany(
+        """INSERT INTO points (user_id, username, points, hashtag, timestamp, chat_id, message_id, is_challenge_bonus)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        [
+            (e["user_id"], e["username"], e["points"], e["hashtag"], e["timestamp"],
+             e["chat_id"], e["message_id"], int(e["is_challenge_bonus"]))
+            for e in events
+        ]
     )
 
-    conn.commit()
-    conn.close()
+    # Un solo registro por usuario y lote
+    per_user = {}
+    for e in events:
+        entry = per_user.setdefault(e["user_id"], {"username": e["username"], "points": 0, "count": 0})
+        entry["username"] = e["username"]
+        entry["points"] += e["points"]
+        entry["count"] += 1
 
-def add_points(user_id, username, points, hashtag=None, message_text=None, chat_id=None, message_id=None, is_challenge_bonus=False, context=None):
-    conn = get_connection()
-    cursor = conn.cursor()
+    # UPSERT atómico: users es el acumulado autoritativo, sin re-sumar points
+    cursor.executemany(
+        f"""INSERT INTO users (id, username, points, count, level)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                username = excluded.username,
+                points = users.points + excluded.points,
+                count = users.count + excluded.count,
+                level = {_level_sql("users.points + excluded.points")}""",
+        [
+            (user_id, entry["username"], entry["points"], entry["count"], calculate_level(entry["points"]))
+            for user_id, entry in per_user.items()
+        ]
+    )
 
-    cursor.execute(
-        """INSERT INTO points (user_id, username, points, hashtag, chat_id, message_id, is_challenge_bonus)
-           VALUES (?, ?, ?, ?, ?, ?, ?)""",
-        (user_id, username, points, hashtag, chat_id, message_id, int(is_challenge_bonus))
+    # Acumulado por chat (chat_users), con el mismo UPSERT
+    per_chat_user = {}
+    for e in events:
+        if e["chat_id"] is None:
+            continue
+        entry = per_chat_user.setdefault((e["chat_id"], e["user_id"]), {"username": e["username"], "points": 0, "count": 0})
+        entry["username"] = e["username"]
+        entry["points"] += e["points"]
+        entry["count"] += 1
+
+    cursor.executemany(
+        """INSERT INTO chat_users (chat_id, user_id, username, points, count)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(chat_id, user_id) DO UPDATE SET
+               username = excluded.username,
+               points = chat_users.points + excluded.points,
+               count = chat_users.count + excluded.count""",
+        [
+            (chat_id, user_id, entry["username"], entry["points"], entry["count"])
+            for (chat_id, user_id), entry in per_chat_user.items()
+        ]
     )
 
-    # Update or create user record
-    cursor.execute(
-        """INSERT OR REPLACE INTO users (id, username, points, count, level, created_at)
-           VALUES (?, ?, 
-                   COALESCE((SELECT points FROM users WHERE id = ?), 0) + ?,
-                   COALESCE((SELECT count FROM users WHERE id = ?), 0) + 1,
-                   ?, 
-                   COALESCE((SELECT created_at FROM users WHERE id = ?), CURRENT_TIMESTAMP))""",
-        (user_id, username, user_id, points, user_id, calculate_level(get_user_total_points(user_id) + points), user_id)
+    # Cubetas diarias (points_daily)
+    per_day = {}
+    for e in events:
+        key = (e["chat_id"] or 0, e["timestamp"][:10], e["user_id"])
+        entry = per_day.setdefault(key, {"username": e["username"], "points": 0, "count": 0})
+        entry["username"] = e["username"]
+        entry["points"] += e["points"]
+        entry["count"] += 1
+
+    cursor.executemany(
+        """INSERT INTO points_daily (chat_id, day, user_id, username, points, count)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT(chat_id, day, user_id) DO UPDATE SET
+               username = excluded.username,
+               points = points_daily.points + excluded.points,
+               count = points_daily.count + excluded.count""",
+        [
+            (chat_id, day, user_id, entry["username"], entry["points"], entry["count"])
+            for (chat_id, day, user_id), entry in per_day.items()
+        ]
     )
 
-    conn.commit()
-    conn.close()
+# Funciones llamadas con (evento, total_usuario) por cada evento encolado.
+# Se ejecutan en orden y bajo el lock de commit, así que deben ser rápidas.
+_points_listeners = []
+
+def register_points_listener(listener):
+    """Suscribirse a los eventos de puntos (estructuras en memoria)"""
+    if listener not in _points_listeners:
+        _points_listeners.append(listener)
+
+# Otros buffers que se confirman en la misma transacción que los puntos
+_batch_buffers = []
+
+# Elementos recuperados del journal para buffers que aún no se han creado
+_recovered_items = {}
+
+class BatchBuffer:
+    """Filas de otra tabla que viajan con el lote de puntos.
+
+    add() solo encola; el hilo de escritura llama a apply(cursor, items) dentro
+    de la transacción de cada flush, en el orden en que se encolaron. Si el
+    commit falla, los elementos vuelven a la cola.
+
+    journaled=True escribe cada elemento en el journal de puntos: tras una
+    caída se reproduce con los eventos de su mismo lote. Los elementos deben
+    poder pasar por JSON (las tuplas vuelven como tuplas).
+    """
+
+    def __init__(self, name, apply, journaled=False):
+        self.name = name
+        self.apply = apply
+        self.journaled = journaled
+        self._items = _recovered_items.pop(name, [])
+        self._lock = threading.Lock()
+        if self not in _batch_buffers:
+            _batch_buffers.append(self)
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        writer = get_points_writer()
+        if self.journaled:
+            full = writer.add_buffered(self, item)
+        else:
+            full = self._append(item)
+        if full:
+            writer.wake()
+
+    def _append(self, item) -> bool:
+        with self._lock:
+            self._items.append(item)
+            return len(self._items) >= POINTS_FLUSH_MAX_EVENTS
+
+    def pending(self):
+        """Copia de lo encolado (con el lock de commit tomado: lo que falta por escribir)"""
+        with self._lock:
+            return list(self._items)
+
+    def drain(self):
+        with self._lock:
+            items, self._items = self._items, []
+        return items
+
+    def restore(self, items):
+        with self._lock:
+            self._items = items + self._items
+
+class PointsWriteBehind:
+    """Cola de escritura diferida para los eventos de puntos.
+
+    add() deja el evento en memoria (y en el journal) y devuelve el total
+    actualizado del usuario sin esperar al commit. Un hilo de fondo vuelca
+    los eventos en una única transacción por lote. Al arrancar se reproducen
+    los journals que quedaron sin confirmar.
+    """
+
+    def __init__(self, flush_interval_ms=POINTS_FLUSH_INTERVAL_MS, max_events=POINTS_FLUSH_MAX_EVENTS,
+                 journal_path=None, journal_fsync=POINTS_JOURNAL_FSYNC):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_events = max_events
+        self.journal_path = journal_path
+        self.journal_fsync = journal_fsync
+        self._lock = threading.Lock()          # buffer, pendientes y journal
+        self._commit_lock = threading.RLock()  # un lote confirmándose a la vez
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._events = []
+        self._pending = {}                     # user_id -> puntos aún sin confirmar
+        self._pending_chat = {}                # (chat_id, user_id) -> puntos aún sin confirmar
+        self._journal = None
+        self._unflushed_journals = []          # [(batch_id, path)] rotados y sin confirmar
+        self._done_batches = []                # batch_ids cuyo journal ya se borró
+        self._thread = None
+
+    # Ciclo de vida
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.journal_path:
+            self._recover_journals()
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="puntum-points-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Escritura diferida de puntos: %s", e)
+
+    # Journal
+
+    def _write_journal(self, event):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        if self.journal_fsync:
+            os.fsync(self._journal.fileno())
+
+    def _rotate_journal(self):
+        """Aparta el journal actual para el lote que se va a confirmar"""
+        if self._journal is None:
+            return
+        batch_id = uuid.uuid4().hex
+        path = f"{self.journal_path}.{batch_id}"
+        self._journal.close()
+        os.replace(self.journal_path, path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._unflushed_journals.append((batch_id, path))
+
+    def _read_journal(self, path):
+        events = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    break  # Última línea truncada por la caída
+        return events
+
+    def _recover_journals(self):
+        directory = os.path.dirname(os.path.abspath(self.journal_path))
+        prefix = os.path.basename(self.journal_path) + "."
+        rotated = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith(prefix)
+        )
+
+        conn = get_read_connection()
+        try:
+            recovered = []
+            for path in rotated:
+                batch_id = path.rsplit(".", 1)[1]
+                row = conn.execute(
+                    "SELECT 1 FROM points_batches WHERE batch_id = ?", (batch_id,)
+                ).fetchone()
+                if row:
+                    os.remove(path)  # Ya estaba confirmado
+                    self._done_batches.append(batch_id)
+                else:
+                    recovered.extend(self._read_journal(path))
+                    self._unflushed_journals.append((batch_id, path))
+        finally:
+            conn.close()
+
+        if os.path.exists(self.journal_path):
+            # Se aparta como un lote más para no escribir tras una línea truncada
+            recovered.extend(self._read_journal(self.journal_path))
+            batch_id = uuid.uuid4().hex
+            path = f"{self.journal_path}.{batch_id}"
+            os.replace(self.journal_path, path)
+            self._unflushed_journals.append((batch_id, path))
+
+        buffers = {buffer.name: buffer for buffer in _batch_buffers}
+        events = 0
+        for event in recovered:
+            if "buffer" in event:
+                # Línea de un BatchBuffer: JSON convierte las tuplas en listas
+                item = event["item"]
+                if isinstance(item, list):
+                    item = tuple(item)
+                buffer = buffers.get(event["buffer"])
+                if buffer is not None:
+                    buffer._append(item)
+                else:
+                    _recovered_items.setdefault(event["buffer"], []).append(item)
+                continue
+            self._events.append(event)
+            self._track_pending(event, 1)
+            events += 1
+
+        if recovered:
+            logger.info("Journal de puntos: %s eventos y %s filas de otros buffers recuperados",
+                        events, len(recovered) - events)
+
+    # Operaciones
+
+    def _track_pending(self, event, sign):
+        """Sumar (sign=1) o descontar (sign=-1) un evento de los pendientes; requiere _lock"""
+        delta = sign * event["points"]
+        keys = [(self._pending, event["user_id"])]
+        if event.get("chat_id") is not None:
+            keys.append((self._pending_chat, (event["chat_id"], event["user_id"])))
+        for pending, key in keys:
+            remaining = pending.get(key, 0) + delta
+            if remaining:
+                pending[key] = remaining
+            else:
+                pending.pop(key, None)
+
+    def locked(self):
+        """Lock de commit: mientras se tiene, lo confirmado y lo pendiente no cambian de lado"""
+        return self._commit_lock
+
+    def pending_events(self):
+        """Copia de los eventos aún sin confirmar"""
+        with self._lock:
+            return list(self._events)
+
+    def pending_chat_user_points(self, chat_id: int, user_id: int) -> int:
+        with self._lock:
+            return self._pending_chat.get((chat_id, user_id), 0)
+
+    def add(self, event) -> int:
+        """Encolar un evento y devolver el total actualizado del usuario"""
+        user_id = event["user_id"]
+        with self._lock:
+            self._write_journal(event)
+            self._events.append(event)
+            self._track_pending(event, 1)
+            full = len(self._events) >= self.max_events
+        if full:
+            self._wakeup.set()
+
+        with self._commit_lock:
+            committed = _read_user_total_points(user_id)
+            with self._lock:
+                total = committed + self._pending.get(user_id, 0)
+            # Cada total ve todos los eventos previos: los oyentes reciben totales en orden
+            for listener in _points_listeners:
+                try:
+                    listener(event, total)
+                except Exception as e:
+                    logger.error("Oyente de puntos %s: %s", listener.__name__, e)
+        return total
+
+    def add_buffered(self, buffer, item) -> bool:
+        """Encolar en un BatchBuffer con journal; True si el buffer ya pide un flush"""
+        with self._lock:
+            # Bajo el mismo lock que la rotación: la línea del journal y el
+            # elemento caen siempre en el mismo lote
+            self._write_journal({"buffer": buffer.name, "item": item})
+            return buffer._append(item)
+
+    def wake(self):
+        """Pedir un flush sin esperar al intervalo"""
+        self._wakeup.set()
+
+    def has_pending(self, user_id: int) -> bool:
+        return user_id in self._pending
+
+    def total_points(self, user_id: int) -> int:
+        """Total confirmado más lo pendiente, sin contar dos veces un lote en curso"""
+        with self._commit_lock:
+            committed = _read_user_total_points(user_id)
+            with self._lock:
+                return committed + self._pending.get(user_id, 0)
+
+    def flush(self):
+        """Confirmar todos los eventos pendientes en una sola transacción"""
+        with self._commit_lock:
+            journals = []
+            with self._lock:
+                events = self._events
+                self._events = []
+                batches = [(buffer, buffer.drain()) for buffer in _batch_buffers]
+                batches = [(buffer, items) for buffer, items in batches if items]
+                if events or any(buffer.journaled for buffer, _ in batches):
+                    self._rotate_journal()
+                    journals = list(self._unflushed_journals)
+            if not events and not batches:
+                return
+
+            conn = get_connection()
+            try:
+                cursor = conn.cursor()
+                if events:
+                    _apply_point_events(cursor, events)
+                if journals:
+                    cursor.executemany(
+                        "INSERT OR IGNORE INTO points_batches (batch_id) VALUES (?)",
+                        [(batch_id,) for batch_id, _ in journals]
+                    )
+                    cursor.executemany(
+                        "DELETE FROM points_batches WHERE batch_id = ?",
+                        [(batch_id,) for batch_id in self._done_batches]
+                    )
+                for buffer, items in batches:
+                    buffer.apply(cursor, items)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                with self._lock:
+                    self._events = events + self._events
+                for buffer, items in batches:
+                    buffer.restore(items)
+                raise
+            finally:
+                conn.close()
+
+            with self._lock:
+                for e in events:
+                    self._track_pending(e, -1)
+                self._unflushed_journals = [j for j in self._unflushed_journals if j not in journals]
+            if not journals:
+                return
+
+            self._done_batches = []
+            for batch_id, path in journals:
+                try:
+                    os.remove(path)
+                    self._done_batches.append(batch_id)
+                except OSError as e:
+                    logger.error("No se pudo borrar el journal %s: %s", path, e)
+
+_points_writer = None
+_points_writer_lock = threading.Lock()
+
+def get_points_writer() -> PointsWriteBehind:
+    """Cola de escritura de puntos, iniciada al primer uso"""
+    global _points_writer
+    if _points_writer is None:
+        with _points_writer_lock:
+            if _points_writer is None:
+                journal_path = f"{DB_PATH}-points.journal" if POINTS_JOURNAL_ENABLED else None
+                writer = PointsWriteBehind(journal_path=journal_path)
+                writer.start()
+                _points_writer = writer
+    return _points_writer
+
+def start_points_writer():
+    """Arrancar la cola (y recuperar el journal) al iniciar el bot"""
+    get_points_writer()
+
+def flush_points():
+    """Forzar la confirmación de los puntos pendientes"""
+    if _points_writer is not None:
+        _points_writer.flush()
+
+def stop_points_writer():
+    global _points_writer
+    with _points_writer_lock:
+        writer = _points_writer
+        _points_writer = None
+    if writer is not None:
+        writer.stop()
+
+# RANKING EN MEMORIA
+global_leaderboard = Leaderboard()
+
+def _update_global_leaderboard(event, total):
+    if global_leaderboard.warmed:
+        global_leaderboard.update(event["user_id"], event["username"], total)
+
+register_points_listener(_update_global_leaderboard)
+
+def _load_committed(load):
+    """Ejecutar load() con todo lo pendiente ya confirmado.
+
+    Con el lock de commit tomado, los eventos que entren mientras tanto todavía
+    no han pasado por los oyentes, que fijarán su total absoluto después.
+    """
+    writer = _points_writer
+    if writer is None:
+        return load()
+    with writer.locked():
+        writer.flush()
+        return load()
+
+def read_committed(load):
+    """(load(), eventos de puntos aún sin confirmar), sin forzar un flush.
+
+    Con el lock de commit tomado ningún lote cambia de lado mientras se lee:
+    load() ve lo confirmado y la lista devuelta es exactamente lo que le
+    falta. Quien llama suma esos eventos a lo leído.
+    """
+    writer = _points_writer
+    if writer is None:
+        return load(), []
+    with writer.locked():
+        return load(), writer.pending_events()
+
+def warm_leaderboard():
+    """Cargar el ranking global desde users (al iniciar el bot)"""
+    def load():
+        conn = get_read_connection()
+        try:
+            rows = conn.execute(
+                "SELECT id, username, points FROM users WHERE points > 0"
+            ).fetchall()
+        finally:
+            conn.close()
+        global_leaderboard.load(rows)
+
+    _load_committed(load)  # Incluye lo recuperado del journal
+    logger.info("✅ Ranking en memoria cargado (%s usuarios)", len(global_leaderboard))
+
+def get_user_rank(user_id: int, neighbors: int = 2):
+    """Posición del usuario en el ranking global y sus vecinos"""
+    if not global_leaderboard.warmed:
+        warm_leaderboard()
+    position = global_leaderboard.rank(user_id)
+    if position is None:
+        return None
+    return {
+        "rank": position,
+        "points": global_leaderboard.points(user_id),
+        "total_users": len(global_leaderboard),
+        "neighbors": global_leaderboard.neighbors(user_id, neighbors)
+    }
+
+# RANKINGS POR CHAT
+# Cada chat tiene su Leaderboard, cargado de chat_users la primera vez que se
+# consulta y mantenido por el oyente de puntos. Solo se guardan los más recientes.
+CHAT_LEADERBOARD_CACHE_SIZE = 5000
+_chat_leaderboards = OrderedDict()   # chat_id -> Leaderboard (LRU)
+_chat_leaderboards_lock = threading.Lock()
+
+# Consultas calientes: migrations.check_query_plans comprueba que usen índices
+CHAT_USER_POINTS_SQL = "SELECT points FROM chat_users WHERE chat_id = ? AND user_id = ?"
+CHAT_RANKING_SQL = "SELECT user_id, username, points FROM chat_users WHERE chat_id = ? AND points > 0"
+
+def _read_chat_user_points(chat_id: int, user_id: int) -> int:
+    """Total ya confirmado de un usuario en un chat"""
+    conn = get_read_connection()
+    try:
+        row = conn.execute(CHAT_USER_POINTS_SQL, (chat_id, user_id)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
+def _update_chat_leaderboard(event, total):
+    chat_id = event["chat_id"]
+    if chat_id is None:
+        return
+    with _chat_leaderboards_lock:
+        board = _chat_leaderboards.get(chat_id)
+    if board is None:
+        return  # Se cargará completo cuando alguien lo consulte
+
+    chat_total = _read_chat_user_points(chat_id, event["user_id"])
+    if _points_writer is not None:
+        chat_total += _points_writer.pending_chat_user_points(chat_id, event["user_id"])
+    board.update(event["user_id"], event["username"], chat_total)
+
+register_points_listener(_update_chat_leaderboard)
+
+def get_chat_leaderboard(chat_id: int) -> Leaderboard:
+    """Ranking en memoria de un chat, cargándolo si no está en caché"""
+    with _chat_leaderboards_lock:
+        board = _chat_leaderboards.get(chat_id)
+        if board is not None:
+            _chat_leaderboards.move_to_end(chat_id)
+            return board
+
+    def load():
+        conn = get_read_connection()
+        try:
+            rows = conn.execute(CHAT_RANKING_SQL, (chat_id,)).fetchall()
+        finally:
+            conn.close()
+        board = Leaderboard()
+        board.load(rows)
+        # Se publica con el lock de commit aún tomado: ningún evento queda sin aplicar
+        with _chat_leaderboards_lock:
+            _chat_leaderboards[chat_id] = board
+            while len(_chat_leaderboards) > CHAT_LEADERBOARD_CACHE_SIZE:
+                _chat_leaderboards.popitem(last=False)
+        return board
+
+    return _load_committed(load)
+
+def clear_chat_leaderboards():
+    with _chat_leaderboards_lock:
+        _chat_leaderboards.clear()
+
+def get_chat_top(chat_id: int, k: int = 10):
+    """Top k de un chat como (username, puntos, nivel)"""
+    return [
+        (username, points, calculate_level(points))
+        for _, username, points in get_chat_leaderboard(chat_id).top(k)
+    ]
+
+def get_chat_user_rank(chat_id: int, user_id: int, neighbors: int = 2):
+    """Posición del usuario en el ranking de un chat y sus vecinos"""
+    board = get_chat_leaderboard(chat_id)
+    position = board.rank(user_id)
+    if position is None:
+        return None
+    return {
+        "rank": position,
+        "points": board.points(user_id),
+        "total_users": len(board),
+        "neighbors": board.neighbors(user_id, neighbors)
+    }
+
+def get_chat_totals(chat_id: int) -> dict:
+    """Puntos y participantes acumulados de un chat"""
+    board = get_chat_leaderboard(chat_id)
+    return {"points": board.total, "users": len(board)}
+
+# RANKINGS POR PERIODO (sobre las cubetas diarias de points_daily)
+RANKING_WINDOWS = ("hoy", "semana", "mes")
+
+def get_window_range(window: str, today=None):
+    """(primer_día, último_día) del periodo en UTC, ambos incluidos.
+
+    hoy: el día actual; semana: la semana ISO (lunes a domingo);
+    mes: los últimos 30 días.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    if window == "hoy":
+        start, end = today, today
+    elif window == "semana":
+        start = today - timedelta(days=today.weekday())
+        end = start + timedelta(days=6)
+    elif window == "mes":
+        start, end = today - timedelta(days=29), today
+    else:
+        raise ValueError(f"Periodo desconocido: {window}")
+    return start.isoformat(), end.isoformat()
+
+def window_top_sql(by_chat: bool) -> str:
+    """Top del periodo desde points_daily; con by_chat el primer parámetro es el chat"""
+    chat_filter = "chat_id = ? AND " if by_chat else ""
+    return f"""SELECT COALESCE(u.username, d.username), d.window_points, COALESCE(u.level, 1)
+               FROM (SELECT user_id, MAX(username) AS username, SUM(points) AS window_points
+                     FROM points_daily
+                     WHERE {chat_filter}day BETWEEN ? AND ?
+                     GROUP BY user_id) d
+               LEFT JOIN users u ON u.id = d.user_id
+               WHERE d.window_points > 0
+               ORDER BY d.window_points DESC
+               LIMIT ?"""
+
+def get_window_top(window: str, chat_id: int = None, k: int = 10, today=None):
+    """Top k del periodo como (username, puntos del periodo, nivel), global o de un chat.
+
+    Los puntos aún en la cola de escritura aparecen en el siguiente volcado.
+    """
+    start, end = get_window_range(window, today)
+    params = ((chat_id,) if chat_id is not None else ()) + (start, end, k)
+
+    conn = get_read_connection()
+    try:
+        rows = conn.execute(window_top_sql(chat_id is not None), params).fetchall()
+    finally:
+        conn.close()
+    return [tuple(row) for row in rows]
+
+def add_points(user_id, username, points, hashtag=None, message_text=None, chat_id=None, message_id=None, is_challenge_bonus=False, context=None):
+    event = {
+        "user_id": user_id,
+        "username": username,
+        "points": points,
+        "hashtag": hashtag,
+        "timestamp": _utc_timestamp(),
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "is_challenge_bonus": bool(is_challenge_bonus)
+    }
+    total_points = get_points_writer().add(event)
 
     if context and chat_id:
         try:
@@ -89,31 +1038,38 @@ def add_points(user_id, username, points, hashtag=None, message_text=None, chat_
         except ImportError:
             pass  # Achievements module is optional
 
-    return {"ok": True}
+    return {"ok": True, "total_points": total_points, "level": calculate_level(total_points)}
 
 def add_achievement(user_id: int, achievement_id: int):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """INSERT OR IGNORE INTO user_achievements (user_id, achievement_id)
-           VALUES (?, ?)""",
-        (user_id, achievement_id)
-    )
-    conn.commit()
-    conn.close()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """INSERT OR IGNORE INTO user_achievements (user_id, achievement_id)
+               VALUES (?, ?)""",
+            (user_id, achievement_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
 
-def get_user_total_points(user_id: int) -> int:
-    """Get total points for a user"""
-    conn = get_connection()
+USER_TOTAL_SQL = "SELECT points FROM users WHERE id = ?"
+
+def _read_user_total_points(user_id: int) -> int:
+    """Total ya confirmado en la base de datos"""
+    conn = get_read_connection()
     cursor = conn.cursor()
-    cursor.execute(
-        """SELECT COALESCE(SUM(points), 0) FROM points WHERE user_id = ?""",
-        (user_id,)
-    )
+    cursor.execute(USER_TOTAL_SQL, (user_id,))
     result = cursor.fetchone()
     conn.close()
     return result[0] if result else 0
 
+def get_user_total_points(user_id: int) -> int:
+    """Get total points for a user (including points not yet flushed)"""
+    if _points_writer is not None:
+        return _points_writer.total_points(user_id)
+    return _read_user_total_points(user_id)
+
 def calculate_level(points: int) -> int:
     """Calculate user level based on points"""
     if points >= 1000:
@@ -139,21 +1095,48 @@ def get_level_info(level: int) -> dict:
     
     return level_data.get(level, level_data[1])
 
+# Consultas de get_user_stats (todas con user_id como único parámetro)
+USER_STATS_SQL = {
+    "básicos": """SELECT points as total_points,
+                         count as total_contributions,
+                         username,
+                         created_at as member_since
+                  FROM users
+                  WHERE id = ?""",
+    "recientes": """SELECT hashtag, points, timestamp
+                    FROM points
+                    WHERE user_id = ?
+                    ORDER BY timestamp DESC
+                    LIMIT 5""",
+    "hashtags": """SELECT hashtag, COUNT(*) FROM points
+                   WHERE user_id = ?
+                   GROUP BY hashtag
+                   ORDER BY COUNT(*) DESC""",
+    "días activos": """SELECT DISTINCT DATE(timestamp) FROM points
+                       WHERE user_id = ?""",
+    "retos diarios": """SELECT COUNT(*) FROM points
+                        WHERE user_id = ? AND is_challenge_bonus = 1
+                        AND hashtag = '(reto_diario)'
+                        AND strftime('%W', timestamp) = strftime('%W', 'now')""",
+    "reto semanal": """SELECT 1 FROM points
+                       WHERE user_id = ? AND is_challenge_bonus = 1
+                       AND hashtag LIKE '#%' AND strftime('%W', timestamp) = strftime('%W', 'now')
+                       LIMIT 1""",
+    "logros": """SELECT achievement_id FROM user_achievements
+                 WHERE user_id = ?""",
+}
+
 def get_user_stats(user_id: int):
     """Get comprehensive user statistics"""
-    conn = get_connection()
+    # Leer lo propio: confirmar antes los puntos pendientes de este usuario
+    if _points_writer is not None and _points_writer.has_pending(user_id):
+        _points_writer.flush()
+
+    conn = get_read_connection()
     cursor = conn.cursor()
 
-    # Get basic user info and totals
-    cursor.execute(
-        """SELECT COALESCE(SUM(points), 0) as total_points, 
-                  COUNT(*) as total_contributions,
-                  username,
-                  MIN(timestamp) as member_since
-           FROM points 
-           WHERE user_id = ?""",
-        (user_id,)
-    )
+    # Get basic user info and totals (acumulados en users)
+    cursor.execute(USER_STATS_SQL["básicos"], (user_id,))
     basic_stats = cursor.fetchone()
     
     if not basic_stats or basic_stats[0] == 0:
@@ -170,60 +1153,27 @@ def get_user_stats(user_id: int):
         points_to_next = level_info["next_points"] - total_points
     
     # Get recent contributions
-    cursor.execute(
-        """SELECT hashtag, points, timestamp
-           FROM points 
-           WHERE user_id = ? 
-           ORDER BY timestamp DESC 
-           LIMIT 5""",
-        (user_id,)
-    )
+    cursor.execute(USER_STATS_SQL["recientes"], (user_id,))
     recent_contributions = cursor.fetchall()
 
     # Get hashtag counts
-    cursor.execute(
-        """SELECT hashtag, COUNT(*) FROM points
-           WHERE user_id = ?
-           GROUP BY hashtag
-           ORDER BY COUNT(*) DESC""",
-        (user_id,)
-    )
+    cursor.execute(USER_STATS_SQL["hashtags"], (user_id,))
     hashtag_counts = {row[0]: row[1] for row in cursor.fetchall()}
 
     # Get active days
-    cursor.execute(
-        """SELECT DISTINCT DATE(timestamp) FROM points
-           WHERE user_id = ?""",
-        (user_id,)
-    )
+    cursor.execute(USER_STATS_SQL["días activos"], (user_id,))
     active_days = {row[0] for row in cursor.fetchall()}
 
     # Get daily challenges this week
-    cursor.execute(
-        """SELECT COUNT(*) FROM points
-           WHERE user_id = ? AND is_challenge_bonus = 1
-           AND hashtag = '(reto_diario)'
-           AND strftime('%W', timestamp) = strftime('%W', 'now')""",
-        (user_id,)
-    )
+    cursor.execute(USER_STATS_SQL["retos diarios"], (user_id,))
     daily_challenges_week = cursor.fetchone()[0]
 
     # Check if weekly challenge is done
-    cursor.execute(
-        """SELECT 1 FROM points
-           WHERE user_id = ? AND is_challenge_bonus = 1
-           AND hashtag LIKE '#%' AND strftime('%W', timestamp) = strftime('%W', 'now')
-           LIMIT 1""",
-        (user_id,)
-    )
+    cursor.execute(USER_STATS_SQL["reto semanal"], (user_id,))
     weekly_done = bool(cursor.fetchone())
 
     # Get achievements
-    cursor.execute(
-        """SELECT achievement_id FROM user_achievements
-           WHERE user_id = ?""",
-        (user_id,)
-    )
+    cursor.execute(USER_STATS_SQL["logros"], (user_id,))
     achievements = [row[0] for row in cursor.fetchall()]
 
     conn.close()
@@ -241,58 +1191,108 @@ def get_user_stats(user_id: int):
         "active_days": active_days,
         "daily_challenges_week": daily_challenges_week,
         "weekly_challenge_done": weekly_done,
-        "achievements": achievements
+        "achievements": achievements,
+        "rank": global_leaderboard.rank(user_id) if global_leaderboard.warmed else None
     }
 
+TOP10_SQL = "SELECT username, points, level FROM users WHERE points > 0 ORDER BY points DESC LIMIT 10"
+
 def get_top10():
     """Get top 10 users by points including their level"""
-    conn = get_connection()
+    if global_leaderboard.warmed:
+        return [
+            (username, points, calculate_level(points))
+            for _, username, points in global_leaderboard.top(10)
+        ]
+
+    conn = get_read_connection()
     cursor = conn.cursor()
     
     try:
-        # Obtener usuarios con sus puntos totales y calcular nivel
-        cursor.execute("""
-            SELECT 
-                username, 
-                SUM(points) as total_points,
-                user_id
-            FROM points
-            GROUP BY user_id, username
-            ORDER BY total_points DESC
-            LIMIT 10
-        """)
-        
-        results = cursor.fetchall()
+        # Totales y nivel ya mantenidos en users
+        cursor.execute(TOP10_SQL)
         
-        # Agregar nivel calculado a cada usuario
-        top_users = []
-        for username, total_points, user_id in results:
-            level = calculate_level(total_points)
-            top_users.append((username, total_points, level))
-        
-        return top_users
+        return [tuple(row) for row in cursor.fetchall()]
         
     except Exception as e:
-        print(f"[ERROR] get_top10: {e}")
+        logger.error("get_top10: %s", e)
         return []
     finally:
         conn.close()
 
+def reconcile_user_totals(apply: bool = True) -> dict:
+    """Recalcular users desde el registro points e informar de las diferencias"""
+    flush_points()
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """SELECT p.user_id,
+                      (SELECT username FROM points WHERE user_id = p.user_id ORDER BY rowid DESC LIMIT 1),
+                      p.total_points, p.total_count, p.first_seen,
+                      u.points, u.count
+               FROM (SELECT user_id, SUM(points) as total_points, COUNT(*) as total_count,
+                            MIN(timestamp) as first_seen
+                     FROM points GROUP BY user_id) p
+               LEFT JOIN users u ON u.id = p.user_id
+               UNION ALL
+               SELECT u.id, u.username, 0, 0, NULL, u.points, u.count
+               FROM users u
+               WHERE NOT EXISTS (SELECT 1 FROM points WHERE user_id = u.id)"""
+        )
+        rows = cursor.fetchall()
+
+        drift = []
+        for user_id, username, actual_points, actual_count, first_seen, stored_points, stored_count in rows:
+            if stored_points != actual_points or stored_count != actual_count:
+                drift.append({
+                    "user_id": user_id,
+                    "username": username,
+                    "stored_points": stored_points,
+                    "actual_points": actual_points,
+                    "stored_count": stored_count,
+                    "actual_count": actual_count
+                })
+                if apply:
+                    cursor.execute(
+                        """INSERT INTO users (id, username, points, count, level, created_at)
+                           VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                           ON CONFLICT(id) DO UPDATE SET
+                               points = excluded.points,
+                               count = excluded.count,
+                               level = excluded.level""",
+                        (user_id, username, actual_points, actual_count,
+                         calculate_level(actual_points), first_seen)
+                    )
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    if apply and drift:
+        clear_chat_leaderboards()
+        if global_leaderboard.warmed:
+            warm_leaderboard()
+    return {"checked": len(rows), "drift": drift, "applied": apply}
+
 def set_chat_config(chat_id: int, chat_name: str, rankings_enabled: bool = True, challenges_enabled: bool = True):
     """Configure chat settings"""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """INSERT OR REPLACE INTO chat_config (chat_id, chat_name, rankings_enabled, challenges_enabled)
-           VALUES (?, ?, ?, ?)""",
-        (chat_id, chat_name, rankings_enabled, challenges_enabled)
-    )
-    conn.commit()
-    conn.close()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """INSERT OR REPLACE INTO chat_config (chat_id, chat_name, rankings_enabled, challenges_enabled)
+               VALUES (?, ?, ?, ?)""",
+            (chat_id, chat_name, rankings_enabled, challenges_enabled)
+        )
+        conn.commit()
+    finally:
+        conn.close()
 
 def get_chat_config(chat_id: int):
     """Get chat configuration"""
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute(
         """SELECT chat_name, rankings_enabled, challenges_enabled
@@ -313,7 +1313,7 @@ def get_chat_config(chat_id: int):
 
 def get_configured_chats():
     """Get all configured chats"""
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute(
         """SELECT chat_id, chat_name, rankings_enabled, challenges_enabled
@@ -332,3 +1332,77 @@ def get_configured_chats():
         }
         for row in results
     ]
+
+# VERSIONES ASÍNCRONAS (para handlers dentro del event loop)
+
+async def add_points_async(user_id, username, points, hashtag=None, message_text=None, chat_id=None, message_id=None, is_challenge_bonus=False, context=None):
+    """Versión awaitable de add_points; los logros se revisan ya en el event loop"""
+    result = await run_db(
+        add_points, user_id, username, points,
+        hashtag=hashtag, message_text=message_text, chat_id=chat_id,
+        message_id=message_id, is_challenge_bonus=is_challenge_bonus
+    )
+
+    if context and chat_id:
+        try:
+            from handlers.achievements import check_achievements_async
+            await check_achievements_async(user_id, username, context, chat_id)
+        except ImportError:
+            pass  # Achievements module is optional
+
+    return result
+
+async def add_achievement_async(user_id: int, achievement_id: int):
+    return await run_db(add_achievement, user_id, achievement_id)
+
+async def get_user_total_points_async(user_id: int) -> int:
+    return await run_db(get_user_total_points, user_id)
+
+async def get_user_stats_async(user_id: int):
+    return await run_db(get_user_stats, user_id)
+
+async def get_top10_async():
+    # Con el ranking en memoria no hace falta pasar por los hilos de base de datos
+    if global_leaderboard.warmed:
+        return get_top10()
+    return await run_db(get_top10)
+
+def _chat_leaderboard_cached(chat_id: int) -> bool:
+    with _chat_leaderboards_lock:
+        return chat_id in _chat_leaderboards
+
+async def get_chat_top_async(chat_id: int, k: int = 10):
+    # En caché se sirve desde memoria sin pasar por los hilos de base de datos
+    if _chat_leaderboard_cached(chat_id):
+        return get_chat_top(chat_id, k)
+    return await run_db(get_chat_top, chat_id, k)
+
+async def get_chat_user_rank_async(chat_id: int, user_id: int, neighbors: int = 2):
+    if _chat_leaderboard_cached(chat_id):
+        return get_chat_user_rank(chat_id, user_id, neighbors)
+    return await run_db(get_chat_user_rank, chat_id, user_id, neighbors)
+
+async def get_chat_totals_async(chat_id: int) -> dict:
+    if _chat_leaderboard_cached(chat_id):
+        return get_chat_totals(chat_id)
+    return await run_db(get_chat_totals, chat_id)
+
+async def get_window_top_async(window: str, chat_id: int = None, k: int = 10):
+    return await run_db(get_window_top, window, chat_id, k)
+
+async def get_user_rank_async(user_id: int, neighbors: int = 2):
+    if global_leaderboard.warmed:
+        return get_user_rank(user_id, neighbors)
+    return await run_db(get_user_rank, user_id, neighbors)
+
+async def reconcile_user_totals_async(apply: bool = True) -> dict:
+    return await run_db(reconcile_user_totals, apply)
+
+async def set_chat_config_async(chat_id: int, chat_name: str, rankings_enabled: bool = True, challenges_enabled: bool = True):
+    return await run_db(set_chat_config, chat_id, chat_name, rankings_enabled, challenges_enabled)
+
+async def get_chat_config_async(chat_id: int):
+    return await run_db(get_chat_config, chat_id)
+
+async def get_configured_chats_async():
+    return await run_db(get_configured_chats)
@@ -0,0 +1,98 @@
+# decks.py - Mazos barajados por chat: sin repetir hasta agotar el mazo
+import random
+import functools
+import threading
+from db import get_connection
+
+def create_decks_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS game_decks (
+            chat_id INTEGER,
+            deck TEXT,
+            size INTEGER NOT NULL,
+            seed INTEGER NOT NULL,
+            cursor INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, deck)
+        )
+    """)
+
+# Órdenes recientes por (tamaño, semilla): barajar es O(size) y un mismo
+# mazo se consulta en cada carta
+DECK_ORDER_CACHE_SIZE = 256
+
+@functools.lru_cache(maxsize=DECK_ORDER_CACHE_SIZE)
+def deck_order(size: int, seed: int) -> tuple:
+    """Permutación de 0..size-1 (Fisher–Yates con la semilla del mazo)"""
+    order = list(range(size))
+    random.Random(seed).shuffle(order)
+    return tuple(order)
+
+def _new_seed(size: int, avoid_first=None) -> int:
+    """Semilla para una pasada nueva cuya primera carta no sea avoid_first"""
+    while True:
+        seed = random.getrandbits(63)
+        if size <= 1 or deck_order(size, seed)[0] != avoid_first:
+            return seed
+
+class ShuffledDecks:
+    """Un mazo barajado por (chat, tipo de juego), guardado en SQLite.
+
+    Cada pasada guarda solo una semilla y un cursor: el orden es
+    random.Random(seed).shuffle del rango del mazo, así que cualquiera de
+    los size! órdenes es posible y no se repite ninguna carta hasta
+    recorrer el mazo entero. Al agotarse, o si cambia el tamaño del mazo
+    (catálogo recargado), se baraja con otra semilla, evitando que la
+    primera carta de la pasada nueva repita la última de la anterior.
+
+    El cursor avanza con un único UPDATE ... RETURNING, así que dos procesos
+    que sirven el mismo chat nunca sacan la misma carta. draw() escribe en
+    SQLite: desde el event loop se llama con run_db.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def draw(self, chat_id: int, deck: str, size: int) -> int:
+        """Siguiente posición (0..size-1) del mazo de este chat"""
+        if size <= 0:
+            raise ValueError("mazo vacío")
+        with self._lock:
+            conn = get_connection()
+            try:
+                while True:
+                    row = conn.execute(
+                        """UPDATE game_decks SET cursor = cursor + 1
+                           WHERE chat_id = ? AND deck = ? AND size = ? AND cursor < size
+                           RETURNING seed, cursor - 1""",
+                        (chat_id, deck, size)
+                    ).fetchone()
+                    if row is not None:
+                        break
+
+                    # Pasada agotada (o mazo de otro tamaño): barajar de nuevo
+                    previous = conn.execute(
+                        "SELECT size, seed, cursor FROM game_decks WHERE chat_id = ? AND deck = ?",
+                        (chat_id, deck)
+                    ).fetchone()
+                    last = None
+                    if previous is not None and previous[2] > 0:
+                        last = deck_order(previous[0], previous[1])[previous[2] - 1]
+                    seed = _new_seed(size, last)
+                    # Si otro proceso ya barajó, no se pisa: se vuelve al UPDATE
+                    inserted = conn.execute(
+                        """INSERT INTO game_decks (chat_id, deck, size, seed, cursor)
+                           VALUES (?, ?, ?, ?, 1)
+                           ON CONFLICT(chat_id, deck) DO UPDATE SET
+                               size = excluded.size, seed = excluded.seed, cursor = 1
+                           WHERE game_decks.size != excluded.size OR game_decks.cursor >= game_decks.size
+                           RETURNING seed""",
+                        (chat_id, deck, size, seed)
+                    ).fetchone()
+                    if inserted is not None:
+                        row = (seed, 0)
+                        break
+                conn.commit()
+            finally:
+                conn.close()
+        seed, cursor = row
+        return deck_order(size, seed)[cursor]
@@ -0,0 +1,309 @@
+# game_store.py - Juegos activos por chat, en memoria y persistidos en SQLite
+import os
+import json
+import time
+import heapq
+import asyncio
+import logging
+import threading
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from db import get_connection, get_read_connection, run_db
+
+logger = logging.getLogger(__name__)
+
+# Con varios procesos sirviendo el mismo bot, leer siempre de SQLite
+GAME_STORE_SHARED = os.getenv("GAME_STORE_SHARED", "0") == "1"
+
+def create_game_store_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS active_games (
+            chat_id INTEGER PRIMARY KEY,
+            game TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _encode(game: dict):
+    data = dict(game)
+    started_at = data.pop('started_at', None) or datetime.now()
+    return json.dumps(data, ensure_ascii=False), started_at.isoformat()
+
+def _decode(game_json: str, started_at: str) -> dict:
+    game = json.loads(game_json)
+    game['started_at'] = datetime.fromisoformat(started_at)
+    return game
+
+_UPSERT_GAME = """INSERT INTO active_games (chat_id, game, started_at, updated_at)
+                  VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                  ON CONFLICT(chat_id) DO UPDATE SET
+                      game = excluded.game,
+                      started_at = excluded.started_at,
+                      updated_at = CURRENT_TIMESTAMP"""
+
+class GameStore(MutableMapping):
+    """chat_id -> juego activo, con escritura inmediata (write-through) a SQLite.
+
+    En modo local (por defecto) la memoria es la fuente de lectura y SQLite
+    solo sirve para sobrevivir a reinicios. En modo compartido cada lectura va
+    a SQLite, y pop() borra con DELETE ... RETURNING, así que solo un proceso
+    se queda con el juego.
+
+    Desde handlers se usan las variantes async (get_async, contains_async,
+    set_async, pop_async). Las lecturas locales no salen del loop; las
+    escrituras se confirman en el executor con run_db antes de volver, así
+    que un juego que el handler ya anunció sobrevive a una caída. En modo
+    local la memoria cambia antes del await (nadie ve un hueco en el que
+    empezar otro juego) y las escrituras se serializan en ese mismo orden.
+
+    Los juegos son dicts: tras modificar uno hay que volver a asignarlo
+    (store[chat_id] = game) para que se guarde.
+    """
+
+    def __init__(self, shared: bool = GAME_STORE_SHARED):
+        self.shared = shared
+        self.expiry = None   # GameExpiryScheduler, si se usa
+        self._games = {}
+        self._lock = threading.Lock()
+        self._write_lock = asyncio.Lock()   # escrituras locales en orden de llegada
+
+    def restore(self, max_age_minutes: int = 30) -> int:
+        """Cargar los juegos guardados, descartando los más viejos que max_age_minutes"""
+        # started_at se guarda con isoformat(): el límite se compara en el mismo formato
+        cutoff = (datetime.now() - timedelta(minutes=max_age_minutes)).isoformat()
+        conn = get_connection()
+        try:
+            conn.execute("DELETE FROM active_games WHERE started_at < ?", (cutoff,))
+            rows = conn.execute("SELECT chat_id, game, started_at FROM active_games").fetchall()
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._games = {chat_id: _decode(game, started_at) for chat_id, game, started_at in rows}
+        return len(rows)
+
+    def __getitem__(self, chat_id):
+        if not self.shared:
+            return self._games[chat_id]
+
+        conn = get_read_connection()
+        try:
+            row = conn.execute(
+                "SELECT game, started_at FROM active_games WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise KeyError(chat_id)
+        return _decode(*row)
+
+    def __contains__(self, chat_id):
+        if not self.shared:
+            return chat_id in self._games
+        try:
+            self[chat_id]
+            return True
+        except KeyError:
+            return False
+
+    def __setitem__(self, chat_id, game):
+        game_json, started_at = _encode(game)
+        self._upsert(chat_id, game_json, started_at)
+        self._remember(chat_id, game)
+
+    def _upsert(self, chat_id, game_json, started_at):
+        conn = get_connection()
+        try:
+            conn.execute(_UPSERT_GAME, (chat_id, game_json, started_at))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _remember(self, chat_id, game):
+        with self._lock:
+            self._games[chat_id] = game
+        if self.expiry is not None:
+            self.expiry.schedule(chat_id, game)
+
+    def __delitem__(self, chat_id):
+        if self._delete(chat_id) is None:
+            raise KeyError(chat_id)
+
+    def pop(self, chat_id, *default):
+        """Quitar el juego y devolverlo; atómico entre procesos en modo compartido"""
+        game = self._delete(chat_id)
+        if game is None:
+            if default:
+                return default[0]
+            raise KeyError(chat_id)
+        return game
+
+    def _delete(self, chat_id):
+        row = self._delete_row(chat_id)
+        with self._lock:
+            game = self._games.pop(chat_id, None)
+        if self.shared:
+            return _decode(*row) if row else None
+        return game
+
+    def _delete_row(self, chat_id):
+        conn = get_connection()
+        try:
+            row = conn.execute(
+                "DELETE FROM active_games WHERE chat_id = ? RETURNING game, started_at", (chat_id,)
+            ).fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+        return row
+
+    # Variantes para el event loop
+
+    async def get_async(self, chat_id, default=None):
+        if not self.shared:
+            return self._games.get(chat_id, default)
+        return await run_db(self.get, chat_id, default)
+
+    async def contains_async(self, chat_id) -> bool:
+        if not self.shared:
+            return chat_id in self._games
+        return await run_db(self.__contains__, chat_id)
+
+    async def set_async(self, chat_id, game):
+        game_json, started_at = _encode(game)
+        if self.shared:
+            await run_db(self._upsert, chat_id, game_json, started_at)
+            self._remember(chat_id, game)
+            return
+        self._remember(chat_id, game)
+        async with self._write_lock:
+            await run_db(self._upsert, chat_id, game_json, started_at)
+
+    async def pop_async(self, chat_id, default=None):
+        if self.shared:
+            game = await run_db(self._delete, chat_id)
+            return default if game is None else game
+        # Quitarlo de memoria antes del await: solo un handler se queda con el juego
+        with self._lock:
+            game = self._games.pop(chat_id, None)
+        if game is None:
+            return default
+        async with self._write_lock:
+            await run_db(self._delete_row, chat_id)
+        return game
+
+    def __iter__(self):
+        if not self.shared:
+            return iter(list(self._games))
+        conn = get_read_connection()
+        try:
+            rows = conn.execute("SELECT chat_id FROM active_games").fetchall()
+        finally:
+            conn.close()
+        return iter([chat_id for (chat_id,) in rows])
+
+    def __len__(self):
+        if not self.shared:
+            return len(self._games)
+        conn = get_read_connection()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM active_games").fetchone()[0]
+        finally:
+            conn.close()
+
+class GameExpiryScheduler:
+    """Vencimiento de juegos por plazo, con un min-heap de (deadline, chat_id).
+
+    Cada juego vence exactamente timeout segundos después de started_at:
+    programar y vencer cuestan O(log n) y la tarea solo despierta cuando
+    toca el siguiente plazo. Las entradas no se borran al terminar un juego;
+    al vencer se comprueba que el juego del chat siga siendo el mismo (mismo
+    started_at) y si no, se ignoran.
+    """
+
+    def __init__(self, store: GameStore, timeout: float):
+        self.store = store
+        self.timeout = timeout
+        self._heap = []
+        self._scheduled = {}   # chat_id -> started_at ya programado
+        self._on_expire = None
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        store.expiry = self
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, chat_id, game):
+        started_at = game['started_at']
+        if self._scheduled.get(chat_id) == started_at:
+            return   # el mismo juego reasignado (p. ej. tras una pista)
+        self._scheduled[chat_id] = started_at
+        deadline = started_at.timestamp() + self.timeout
+        heapq.heappush(self._heap, (deadline, chat_id, started_at))
+        if self._heap[0][0] == deadline:
+            self._wake()
+
+    def _wake(self):
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self, on_expire=None):
+        """Arrancar la tarea en el loop actual. on_expire(chat_id, game) es async."""
+        if self._task is not None:
+            return
+        self._on_expire = on_expire
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        for chat_id in list(self.store):
+            game = self.store.get(chat_id)
+            if game is not None:
+                self.schedule(chat_id, game)
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, chat_id, started_at = heapq.heappop(self._heap)
+                try:
+                    await self._expire(chat_id, started_at)
+                except Exception:
+                    logger.exception("Error al vencer el juego del chat %s", chat_id)
+
+            self._wakeup.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire(self, chat_id, started_at):
+        if self._scheduled.get(chat_id) == started_at:
+            del self._scheduled[chat_id]
+
+        game = await self.store.get_async(chat_id)
+        if game is None or game['started_at'] != started_at:
+            return   # ya terminó, o es un juego nuevo
+        # pop() decide quién se queda con el juego si alguien acierta a la vez
+        if await self.store.pop_async(chat_id) is None:
+            return
+        logger.info("Juego vencido en el chat %s (%s)", chat_id, game.get('type'))
+        if self._on_expire is not None:
+            await self._on_expire(chat_id, game)
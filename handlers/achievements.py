@@ -1,58 +1,354 @@
 # handlers/achievements.py
-import datetime
-from db import add_achievement, get_user_stats
+#
+# Logros declarativos: cada regla es (métrica, umbral, ventana) y se compila
+# a contadores por usuario que se actualizan con cada evento de puntos.
+#
+# Métricas:
+#   hashtag            eventos con ese hashtag (parámetro "hashtag")
+#   days               días distintos con actividad
+#   daily_challenges   retos diarios completados
+#   weekly_challenges  retos semanales completados
+# Ventanas: "all" (por defecto) o "week" (semana ISO en curso, de lunes a domingo)
+import asyncio
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from outbox import outbox, HIGH
+from db import (BatchBuffer, get_read_connection, get_points_writer, register_points_listener, run_db,
+                read_committed, flush_points)
 
-# Lista de logros predefinidos
+logger = logging.getLogger(__name__)
+
+# Lista de logros predefinidos: se desbloquean cuando se cumplen todas sus reglas
 ACHIEVEMENTS = [
     {
         "id": 1,
         "name": "🥇 Primer aporte",
         "description": "Tu primer mensaje con #aporte",
-        "trigger": lambda stats: stats.get("hashtag_counts", {}).get("#aporte", 0) >= 1
+        "rules": [{"metric": "hashtag", "hashtag": "#aporte", "min": 1}]
     },
     {
         "id": 2,
         "name": "✍️ Crítico en camino",
         "description": "Has publicado 3 críticas",
-        "trigger": lambda stats: stats.get("hashtag_counts", {}).get("#crítica", 0) >= 3
+        "rules": [{"metric": "hashtag", "hashtag": "#crítica", "min": 3}]
     },
     {
         "id": 3,
         "name": "📚 Cinéfilo activo",
         "description": "Participaste 5 días diferentes",
-        "trigger": lambda stats: len(stats.get("active_days", set())) >= 5
+        "rules": [{"metric": "days", "min": 5}]
     },
     {
         "id": 4,
         "name": "🔥 Retador constante",
         "description": "Completaste 3 retos diarios en una semana",
-        "trigger": lambda stats: stats.get("daily_challenges_week", 0) >= 3
+        "rules": [{"metric": "daily_challenges", "window": "week", "min": 3}]
     },
     {
         "id": 5,
         "name": "🏆 Desafío maestro",
         "description": "Completaste el reto semanal y 3 diarios en una semana",
-        "trigger": lambda stats: stats.get("weekly_challenge_done", False) and stats.get("daily_challenges_week", 0) >= 3
+        "rules": [
+            {"metric": "weekly_challenges", "window": "week", "min": 1},
+            {"metric": "daily_challenges", "window": "week", "min": 3}
+        ]
     }
 ]
 
-def check_achievements(user_id: int, username: str, context, chat_id: int):
-    """Verifica si un usuario ha desbloqueado nuevos logros"""
-    stats = get_user_stats(user_id)
+# Métricas de conteo: (condición sobre el evento, condición SQL sobre points)
+COUNT_METRICS = {
+    "hashtag": (
+        lambda event, rule: event["hashtag"] == rule["hashtag"],
+        "hashtag = ?",
+    ),
+    "daily_challenges": (
+        lambda event, rule: event["is_challenge_bonus"] and event["hashtag"] == "(reto_diario)",
+        "is_challenge_bonus = 1 AND hashtag = '(reto_diario)'",
+    ),
+    "weekly_challenges": (
+        lambda event, rule: bool(event["is_challenge_bonus"] and event["hashtag"] and event["hashtag"].startswith("#")),
+        "is_challenge_bonus = 1 AND hashtag LIKE '#%'",
+    ),
+}
+
+# Inicio (lunes) de la semana ISO de points.timestamp
+WEEK_START_SQL = "date(timestamp, '-6 days', 'weekday 1')"
+
+@functools.lru_cache(maxsize=64)
+def _week_start(day: str) -> str:
+    """Lunes de la semana de 'YYYY-MM-DD'"""
+    date = datetime.strptime(day, "%Y-%m-%d").date()
+    return (date - timedelta(days=date.weekday())).isoformat()
+
+def _current_week() -> str:
+    return _week_start(datetime.now(timezone.utc).strftime("%Y-%m-%d"))
+
+class Counter:
+    """Un contador por usuario, compartido por todas las reglas que lo usan"""
+
+    def __init__(self, rule):
+        self.metric = rule["metric"]
+        self.window = rule.get("window", "all")
+        self.rule = rule
+        if self.metric == "hashtag":
+            self.key = (self.metric, rule["hashtag"], self.window)
+        else:
+            self.key = (self.metric, self.window)
+        if self.metric != "days" and self.metric not in COUNT_METRICS:
+            raise ValueError(f"Métrica de logro desconocida: {self.metric}")
+        if self.window not in ("all", "week") or (self.metric == "days" and self.window != "all"):
+            raise ValueError(f"Ventana de logro no válida para {self.metric}: {self.window}")
+        # Valor de sql() para un usuario sin eventos
+        self.empty = "0," if self.metric == "days" else 0
+
+    def sql(self, week: str):
+        """(expresión agregada por usuario, parámetros)"""
+        if self.metric == "days":
+            return "COUNT(DISTINCT DATE(timestamp)) || ',' || COALESCE(MAX(DATE(timestamp)), '')", ()
+        condition, params = COUNT_METRICS[self.metric][1], ()
+        if self.metric == "hashtag":
+            params = (self.rule["hashtag"],)
+        if self.window == "week":
+            condition = f"({condition}) AND {WEEK_START_SQL} = ?"
+            params += (week,)
+        return f"COALESCE(SUM({condition}), 0)", params
+
+    def parse(self, value, week: str):
+        """Valor leído con sql() -> estado en memoria"""
+        if self.metric == "days":
+            count, _, last_day = value.partition(",")
+            return [int(count), last_day]
+        if self.window == "week":
+            return [value, week]
+        return [value]
+
+    def count(self, state, event) -> bool:
+        """Sumar el evento; True si el valor cambió"""
+        if self.metric == "days":
+            day = event["timestamp"][:10]
+            if day <= state[1]:
+                return False
+            state[0] += 1
+            state[1] = day
+            return True
+
+        if self.window == "week":
+            week = _week_start(event["timestamp"][:10])
+            if week != state[1]:
+                state[0], state[1] = 0, week
+        if COUNT_METRICS[self.metric][0](event, self.rule):
+            state[0] += 1
+            return True
+        return False
+
+def compile_achievements(achievements):
+    """Reglas -> (contadores únicos, contador -> logros que dependen de él,
+    logro -> [(contador, mínimo)])"""
+    counters = {}
+    dependents = {}
+    checks = {}
+    for logro in achievements:
+        checks[logro["id"]] = []
+        for rule in logro["rules"]:
+            counter = Counter(rule)
+            counter = counters.setdefault(counter.key, counter)
+            checks[logro["id"]].append((counter.key, rule["min"]))
+            dependents.setdefault(counter.key, [])
+            if logro not in dependents[counter.key]:
+                dependents[counter.key].append(logro)
+    return list(counters.values()), dependents, checks
+
+COUNTERS, DEPENDENTS, CHECKS = compile_achievements(ACHIEVEMENTS)
+ALL_ACHIEVEMENT_IDS = frozenset(logro["id"] for logro in ACHIEVEMENTS)
+
+def is_unlocked(logro, values) -> bool:
+    """values: clave de contador -> estado ([valor, ...])"""
+    return all(values[key][0] >= minimum for key, minimum in CHECKS[logro["id"]])
+
+# Contadores en memoria para los usuarios activos (LRU); los expulsados se
+# vuelven a cargar de la base de datos en su siguiente evento
+ACHIEVEMENT_STATE_CACHE_SIZE = 50_000
+
+# Usuario con todos los logros: no hace falta contar nada más
+_COMPLETE = object()
+
+_states = OrderedDict()   # user_id -> {"achievements": set, "counters": {clave: estado}} (o _COMPLETE)
+_unlocked = {}            # user_id -> logros aún sin notificar
+_unlocked_lock = threading.Lock()
+
+def _apply_achievements(cursor, rows):
+    cursor.executemany(
+        "INSERT OR IGNORE INTO user_achievements (user_id, achievement_id) VALUES (?, ?)",
+        rows
+    )
+
+# Los logros nuevos se guardan con el siguiente lote de puntos
+achievements_buffer = BatchBuffer("user_achievements", _apply_achievements)
+
+def _counters_query(week: str, where: str = ""):
+    columns, params = [], []
+    for counter in COUNTERS:
+        expression, expression_params = counter.sql(week)
+        columns.append(expression)
+        params.extend(expression_params)
+    return f"SELECT user_id, {', '.join(columns)} FROM points {where} GROUP BY user_id", params
+
+def _load_state(user_id: int):
+    """Contadores del usuario desde la base de datos (una vez por usuario)"""
+    week = _current_week()
+    conn = get_read_connection()
+    try:
+        held = {row[0] for row in conn.execute(
+            "SELECT achievement_id FROM user_achievements WHERE user_id = ?", (user_id,)
+        )}
+        if held >= ALL_ACHIEVEMENT_IDS:
+            return _COMPLETE
+        query, params = _counters_query(week, "WHERE user_id = ?")
+        row = conn.execute(query, params + [user_id]).fetchone()
+    finally:
+        conn.close()
+
+    values = row[1:] if row else [counter.empty for counter in COUNTERS]
+    return {
+        "achievements": held,
+        "counters": {counter.key: counter.parse(value, week) for counter, value in zip(COUNTERS, values)},
+    }
+
+def _load_state_with_pending(user_id: int):
+    """_load_state más lo que la cola de puntos aún no escribió (este evento incluido)"""
+    state, pending = read_committed(lambda: _load_state(user_id))
+    if state is _COMPLETE:
+        return state
+    held = state["achievements"]
+    held.update(achievement_id for uid, achievement_id in achievements_buffer.pending() if uid == user_id)
+    if held >= ALL_ACHIEVEMENT_IDS:
+        return _COMPLETE
+    for pending_event in pending:
+        if pending_event["user_id"] == user_id:
+            for counter in COUNTERS:
+                counter.count(state["counters"][counter.key], pending_event)
+    return state
+
+def _on_points_event(event, total):
+    """Oyente de puntos: actualiza contadores y evalúa solo los logros afectados.
+
+    Corre bajo el lock de commit de la cola de puntos, en orden de llegada.
+    """
+    user_id = event["user_id"]
+    state = _states.get(user_id)
+    if state is _COMPLETE:
+        _states.move_to_end(user_id)
+        return
+
+    if state is None:
+        state = _load_state_with_pending(user_id)
+        _states[user_id] = state
+        while len(_states) > ACHIEVEMENT_STATE_CACHE_SIZE:
+            _states.popitem(last=False)
+        if state is _COMPLETE:
+            return
+        candidates = ACHIEVEMENTS   # primera vez: evaluar todo
+    else:
+        _states.move_to_end(user_id)
+        counters = state["counters"]
+        candidates = []
+        for counter in COUNTERS:
+            if counter.count(counters[counter.key], event):
+                candidates.extend(DEPENDENTS[counter.key])
+
+    held = state["achievements"]
     nuevos_logros = []
+    for logro in candidates:
+        if logro["id"] not in held and is_unlocked(logro, state["counters"]):
+            held.add(logro["id"])
+            nuevos_logros.append(logro)
+    if not nuevos_logros:
+        return
+
+    for logro in nuevos_logros:
+        achievements_buffer.add((user_id, logro["id"]))
+    with _unlocked_lock:
+        _unlocked.setdefault(user_id, []).extend(nuevos_logros)
+    if held >= ALL_ACHIEVEMENT_IDS:
+        _states[user_id] = _COMPLETE
 
-    for logro in ACHIEVEMENTS:
-        if logro["id"] not in stats.get("achievements", []):
-            if logro["trigger"](stats):
-                nuevos_logros.append(logro)
-                add_achievement(user_id, logro["id"])
+register_points_listener(_on_points_event)
 
+def backfill_achievements() -> dict:
+    """Evaluar todas las reglas para todos los usuarios en una pasada agregada.
+
+    Para reglas nuevas o cambiadas: otorga (sin notificar) los logros que ya
+    se cumplen y descarta los contadores en memoria para que se recarguen.
+    """
+    flush_points()
+    week = _current_week()
+    query, params = _counters_query(week)
+
+    conn = get_read_connection()
+    try:
+        held = {}
+        for user_id, achievement_id in conn.execute("SELECT user_id, achievement_id FROM user_achievements"):
+            held.setdefault(user_id, set()).add(achievement_id)
+
+        checked = 0
+        granted = []
+        for row in conn.execute(query, params):
+            checked += 1
+            user_id = row[0]
+            user_held = held.get(user_id, set())
+            if user_held >= ALL_ACHIEVEMENT_IDS:
+                continue
+            values = {counter.key: counter.parse(value, week) for counter, value in zip(COUNTERS, row[1:])}
+            granted.extend(
+                (user_id, logro["id"]) for logro in ACHIEVEMENTS
+                if logro["id"] not in user_held and is_unlocked(logro, values)
+            )
+    finally:
+        conn.close()
+
+    # Con el lock de commit ningún lote se confirma (ni avisa a los oyentes)
+    # entre otorgar los logros y descartar los contadores en memoria
+    with get_points_writer().locked():
+        for row in granted:
+            achievements_buffer.add(row)
+        flush_points()
+        _states.clear()
+    logger.info("Backfill de logros: %s usuarios, %s logros otorgados", checked, len(granted))
+    return {"checked": checked, "granted": len(granted)}
+
+async def backfill_achievements_async() -> dict:
+    return await run_db(backfill_achievements)
+
+def take_unlocked_achievements(user_id: int):
+    """Logros desbloqueados por los últimos eventos del usuario y aún sin notificar"""
+    with _unlocked_lock:
+        return _unlocked.pop(user_id, [])
+
+def format_achievement_message(logro) -> str:
+    return (
+        f"🎉 *¡Nuevo logro desbloqueado!*\n\n"
+        f"{logro['name']}\n{logro['description']}"
+    )
+
+def check_achievements(user_id: int, username: str, context, chat_id: int):
+    """Notifica los logros recién desbloqueados (desde código síncrono)"""
+    nuevos_logros = take_unlocked_achievements(user_id)
+    if not nuevos_logros:
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        logger.warning("Logros de %s sin notificar: no hay event loop", user_id)
+        return
     for logro in nuevos_logros:
-        context.bot.send_message(
-            chat_id=chat_id,
-            text=(
-                f"🎉 *¡Nuevo logro desbloqueado!*\n\n"
-                f"{logro['name']}\n{logro['description']}"
-            ),
-            parse_mode="Markdown"
-        )
+        outbox.send_message(context.bot, chat_id, format_achievement_message(logro),
+                            priority=HIGH, parse_mode="Markdown")
+
+async def check_achievements_async(user_id: int, username: str, context, chat_id: int):
+    """Notifica los logros recién desbloqueados"""
+    for logro in take_unlocked_achievements(user_id):
+        outbox.send_message(context.bot, chat_id, format_achievement_message(logro),
+                            priority=HIGH, parse_mode="Markdown")
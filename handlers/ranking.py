@@ -1,8 +1,12 @@
-from db import get_top10
+from db import get_top10_async, get_chat_top_async, get_window_top_async, get_window_range
 from telegram import Update
+from outbox import outbox, LOW
 import datetime
+import logging
 import random
 
+logger = logging.getLogger(__name__)
+
 # Frases cinematográficas para el ranking
 RANKING_PHRASES = [
     "🥇 {winner} se lleva la Palma de Oro esta semana",
@@ -22,28 +26,32 @@ CLOSING_PHRASES = [
 
 async def cmd_ranking(update: Update, context):
     """Comando manual para mostrar ranking actual"""
-    print(f"[DEBUG] Comando /ranking ejecutado por {update.effective_user.first_name}")
-    print(f"[DEBUG] Chat ID: {update.effective_chat.id}")
+    logger.debug("Comando /ranking ejecutado por %s", update.effective_user.first_name)
+    logger.debug("Chat ID: %s", update.effective_chat.id)
     
     try:
         # Debug de la función get_top10
-        print("[DEBUG] Llamando a get_top10()...")
-        top = get_top10()
-        print(f"[DEBUG] Resultado de get_top10(): {top}")
-        print(f"[DEBUG] Tipo de dato: {type(top)}")
-        print(f"[DEBUG] Longitud: {len(top) if top else 'None'}")
+        logger.debug("Llamando a get_top10()...")
+        # En grupos, el ranking del propio chat; en privado, el global
+        if update.effective_chat.type == "private":
+            top = await get_top10_async()
+        else:
+            top = await get_chat_top_async(update.effective_chat.id)
+        logger.debug("Resultado de get_top10(): %s", top)
+        logger.debug("Tipo de dato: %s", type(top))
+        logger.debug("Longitud: %s", len(top) if top else 'None')
         
         if not top:
-            print("[DEBUG] No hay datos - enviando mensaje de no participantes")
+            logger.debug("No hay datos - enviando mensaje de no participantes")
             await update.message.reply_text("📝 Aún no hay participantes. ¡Sé el primero en usar hashtags!")
             return
         
-        print("[DEBUG] Construyendo mensaje del ranking...")
+        logger.debug("Construyendo mensaje del ranking...")
         msg = "🎬 *TOP 10 CINÉFILOS ACTUALES*\n\n"
         
         # Iterar sobre los datos correctamente
         for i, (username, points, level) in enumerate(top, 1):
-            print(f"[DEBUG] Procesando posición {i}: {username} - {points} pts - nivel {level}")
+            logger.debug("Procesando posición %s: %s - %s pts - nivel %s", i, username, points, level)
             
             # Emojis según posición
             if i == 1:
@@ -60,17 +68,14 @@ async def cmd_ranking(update: Update, context):
         
         msg += f"\n📅 Próximo ranking oficial: {get_next_sunday()}"
         
-        print(f"[DEBUG] Mensaje construido: {msg[:200]}...")  # Solo primeros 200 chars
-        print("[DEBUG] Enviando mensaje...")
+        logger.debug("Mensaje construido: %s...", msg[:200])
+        logger.debug("Enviando mensaje...")
         
         await update.message.reply_text(msg, parse_mode='Markdown')
-        print("[DEBUG] Mensaje enviado exitosamente")
+        logger.debug("Mensaje enviado exitosamente")
         
     except Exception as e:
-        print(f"[ERROR] Error en cmd_ranking: {e}")
-        print(f"[ERROR] Tipo de error: {type(e)}")
-        import traceback
-        print(f"[ERROR] Traceback: {traceback.format_exc()}")
+        logger.exception("Error en cmd_ranking: %s", e)
         
         # Enviar mensaje de error al usuario
         await update.message.reply_text(
@@ -81,20 +86,22 @@ async def cmd_ranking(update: Update, context):
 async def ranking_job(context):
     """Job que se ejecuta automáticamente cada domingo a las 20:00"""
     try:
-        print("[INFO] Ejecutando ranking_job semanal")
+        logger.info("Ejecutando ranking_job semanal")
         
         # Obtener chat_id desde job_data
         chat_id = context.job.data if hasattr(context.job, 'data') and context.job.data else None
         
         if not chat_id:
-            print("[ERROR] No hay chat_id configurado para ranking automático")
+            logger.error("No hay chat_id configurado para ranking automático")
             return
         
-        top = get_top10()
+        # Solo los puntos de la semana ISO en curso (el job corre el domingo)
+        top = await get_window_top_async("semana", chat_id if chat_id < 0 else None)
         if not top:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text="📝 Esta semana no hubo participación. ¡Anímense con los hashtags!"
+            outbox.send_message(
+                context.bot, chat_id,
+                "📝 Esta semana no hubo participación. ¡Anímense con los hashtags!",
+                priority=LOW
             )
             return
         
@@ -110,7 +117,7 @@ async def ranking_job(context):
         )
         
         msg = f"🎬 *RANKING SEMANAL OFICIAL*\n"
-        msg += f"📅 Semana del {get_last_week_range()}\n\n"
+        msg += f"📅 Semana del {get_week_range()}\n\n"
         msg += f"{winner_phrase}\n\n"
         msg += "🏆 *TOP 10 DE LA SEMANA:*\n\n"
         
@@ -128,16 +135,11 @@ async def ranking_job(context):
         
         msg += f"\n{random.choice(CLOSING_PHRASES)}"
         
-        await context.bot.send_message(chat_id=chat_id, text=msg, parse_mode='Markdown')
-        print(f"[INFO] Ranking semanal enviado a chat {chat_id}")
-        
-        # Opcional: Reset de puntos semanales (descomentar si quieres ranking semanal real)
-        # reset_weekly_points()
+        outbox.send_message(context.bot, chat_id, msg, priority=LOW, parse_mode='Markdown')
+        logger.info("Ranking semanal encolado para el chat %s", chat_id)
         
     except Exception as e:
-        print(f"[ERROR] en ranking_job: {e}")
-        import traceback
-        print(f"[ERROR] Traceback: {traceback.format_exc()}")
+        logger.exception("en ranking_job: %s", e)
 
 def get_next_sunday():
     """Obtiene la fecha del próximo domingo"""
@@ -148,22 +150,9 @@ def get_next_sunday():
     next_sunday = today + datetime.timedelta(days_ahead)
     return next_sunday.strftime("%d/%m/%Y")
 
-def get_last_week_range():
-    """Obtiene el rango de la semana pasada"""
-    today = datetime.date.today()
-    last_sunday = today - datetime.timedelta(days=today.weekday() + 1)
-    last_saturday = last_sunday + datetime.timedelta(days=6)
-    return f"{last_sunday.strftime('%d/%m')} - {last_saturday.strftime('%d/%m')}"
-
-def reset_weekly_points():
-    """Reinicia puntos semanales (opcional - usar solo si quieres ranking semanal real)"""
-    from db import get_connection
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET points = 0")
-        conn.commit()
-        conn.close()
-        print("[INFO] Puntos semanales reiniciados")
-    except Exception as e:
-        print(f"[ERROR] al reiniciar puntos: {e}")
+def get_week_range():
+    """Obtiene el rango (lunes - domingo) de la semana en curso"""
+    start, end = get_window_range("semana")
+    start = datetime.date.fromisoformat(start)
+    end = datetime.date.fromisoformat(end)
+    return f"{start.strftime('%d/%m')} - {end.strftime('%d/%m')}"
@@ -0,0 +1,168 @@
+# handlers/rate_limiter.py - Limitador GCRA con backends intercambiables
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")   # memory | sqlite
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB", "ratelimit.db")
+RATE_LIMIT_MAX_KEYS = 500_000
+
+class MemoryBackend:
+    """Estado GCRA en el proceso: un float (TAT) por clave.
+
+    Las claves se ordenan por última actualización; cada EVICT_EVERY usos se
+    descartan desde el principio las que ya volvieron a su estado inicial
+    (TAT en el pasado), y max_keys acota el total.
+    """
+
+    EVICT_EVERY = 64
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._tat = OrderedDict()   # clave -> theoretical arrival time
+        self._calls = 0
+
+    def __len__(self):
+        return len(self._tat)
+
+    def acquire(self, key, now: float, interval: float, tolerance: float) -> Tuple[bool, float]:
+        with self._lock:
+            tat = self._tat.get(key, now)
+            if tat < now:
+                tat = now
+            allow_at = tat - tolerance
+            if now < allow_at:
+                return False, allow_at - now
+
+            self._tat[key] = tat + interval
+            self._tat.move_to_end(key)
+            self._calls += 1
+            if self._calls % self.EVICT_EVERY == 0:
+                self._evict(now)
+            return True, 0.0
+
+    def peek(self, key, now: float, interval: float, tolerance: float) -> Tuple[bool, float]:
+        """Como acquire() pero sin consumir: ¿se permitiría ahora?"""
+        with self._lock:
+            allow_at = max(self._tat.get(key, now), now) - tolerance
+            if now < allow_at:
+                return False, allow_at - now
+            return True, 0.0
+
+    def _evict(self, now: float):
+        # Hasta EVICT_EVERY claves: el ritmo de borrado acompaña al de altas
+        tats = self._tat
+        for key, tat in list(islice(tats.items(), self.EVICT_EVERY)):
+            if tat > now and len(tats) <= self.max_keys:
+                return
+            del tats[key]
+
+    def sweep(self, now: float) -> int:
+        """Eliminar todas las claves inactivas (recorrido completo)"""
+        with self._lock:
+            expired = [key for key, tat in self._tat.items() if tat <= now]
+            for key in expired:
+                del self._tat[key]
+        return len(expired)
+
+class SQLiteBackend:
+    """Estado GCRA en una base SQLite local, compartida entre procesos.
+
+    Usa un fichero propio (no puntum.db): el estado es efímero y no debe
+    competir con el escritor de puntos.
+    """
+
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                tat REAL NOT NULL
+            ) WITHOUT ROWID"""
+        )
+        self._last_sweep = 0.0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+    def acquire(self, key, now: float, interval: float, tolerance: float) -> Tuple[bool, float]:
+        key = repr(key)
+        with self._lock:
+            # Una sola sentencia: atómica también entre procesos.
+            # El TAT solo avanza si max(tat, now) - tolerance <= now.
+            row = self._conn.execute(
+                """INSERT INTO rate_limits (key, tat) VALUES (?1, ?2 + ?3)
+                   ON CONFLICT(key) DO UPDATE SET tat = MAX(tat, ?2) + ?3
+                   WHERE MAX(tat, ?2) - ?4 <= ?2
+                   RETURNING tat""",
+                (key, now, interval, tolerance)
+            ).fetchone()
+            if row is None:
+                tat = self._conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()[0]
+                return False, tat - tolerance - now
+
+            if now - self._last_sweep > self.SWEEP_INTERVAL:
+                self._last_sweep = now
+                self._conn.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,))
+            return True, 0.0
+
+    def sweep(self, now: float) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,)).rowcount
+
+def create_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "sqlite":
+        return SQLiteBackend()
+    return MemoryBackend()
+
+class RateLimiter:
+    """Limitador GCRA (equivalente a un token bucket) por (acción, usuario).
+
+    Cada acción define (max_count, window_seconds): se permiten ráfagas de
+    max_count y, en régimen, un uso cada window/max_count segundos. El
+    estado por clave es un único número, el TAT.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]], backend=None,
+                 default_limit: Tuple[int, float] = (10, 60)):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.backend = backend if backend is not None else create_backend()
+        self._param_cache = {}
+
+    def _params(self, action: str) -> Tuple[float, float]:
+        """(intervalo de emisión, tolerancia de ráfaga) de una acción"""
+        params = self._param_cache.get(action)
+        if params is None:
+            max_count, window = self.limits.get(action, self.default_limit)
+            interval = window / max_count
+            params = self._param_cache[action] = (interval, window - interval)
+        return params
+
+    def acquire(self, user_id: int, action: str, now: Optional[float] = None) -> Tuple[bool, float]:
+        """(permitido, segundos hasta el siguiente uso permitido)"""
+        interval, tolerance = self._params(action)
+        now = time.time() if now is None else now
+        return self.backend.acquire((action, user_id), now, interval, tolerance)
+
+    def is_limited(self, user_id: int, action: str, now: Optional[float] = None) -> bool:
+        allowed, _ = self.acquire(user_id, action, now)
+        return not allowed
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        return self.backend.sweep(time.time() if now is None else now)
@@ -1,6 +1,14 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from typing import List
+import logging
+from db import add_points_async, get_read_connection, run_db, read_committed
+from hashtags import normalize_text
+from handlers.retos_diarios import get_today_challenge
+from handlers.security import check_daily_completion
+
+logger = logging.getLogger(__name__)
 
 # Retos predefinidos con validaciones string-based
 WEEKLY_CHALLENGES = [
@@ -50,7 +58,7 @@ def set_challenge_safe(challenge_text):
         from db import set_challenge
         return set_challenge(challenge_text)
     except (ImportError, AttributeError, Exception) as e:
-        print(f"[WARNING] set_challenge no disponible: {e}")
+        logger.warning("set_challenge no disponible: %s", e)
         return False
 
 def clear_challenge_safe():
@@ -59,7 +67,7 @@ def clear_challenge_safe():
         from db import clear_challenge
         return clear_challenge()
     except (ImportError, AttributeError, Exception) as e:
-        print(f"[WARNING] clear_challenge no disponible: {e}")
+        logger.warning("clear_challenge no disponible: %s", e)
         return False
 
 def validate_challenge_submission(challenge, message_text):
@@ -71,13 +79,110 @@ def validate_challenge_submission(challenge, message_text):
         return any(keyword in message_text for keyword in challenge["validation_keywords"])
     return False
 
+# Bonos ya dados desde este proceso: (user_id, hashtag del bono, inicio del periodo)
+_awarded_bonuses = set()
+AWARDED_BONUSES_MAX = 100_000
+
+def _period_start(daily: bool) -> str:
+    """Inicio (UTC, como los timestamps de points) del día o de la semana en curso"""
+    today = datetime.now(timezone.utc).date()
+    return (today if daily else today - timedelta(days=today.weekday())).isoformat()
+
+def _bonus_already_awarded(user_id: int, hashtag: str, since: str) -> bool:
+    def load():
+        conn = get_read_connection()
+        try:
+            return conn.execute(
+                """SELECT 1 FROM points
+                   WHERE user_id = ? AND is_challenge_bonus = 1 AND hashtag = ? AND timestamp >= ?
+                   LIMIT 1""",
+                (user_id, hashtag, since)
+            ).fetchone() is not None
+        finally:
+            conn.close()
+    # Incluir los puntos que el escritor todavía no confirmó
+    found, pending = read_committed(load)
+    return found or any(
+        event["user_id"] == user_id and event["is_challenge_bonus"]
+        and event["hashtag"] == hashtag and event["timestamp"] >= since
+        for event in pending
+    )
+
+async def _claim_bonus(user_id: int, hashtag: str, daily: bool) -> bool:
+    """True si el usuario todavía no cobró este bono en el periodo en curso"""
+    since = _period_start(daily)
+    key = (user_id, hashtag, since)
+    if key in _awarded_bonuses:
+        return False
+    if len(_awarded_bonuses) >= AWARDED_BONUSES_MAX:
+        current = {_period_start(True), _period_start(False)}
+        _awarded_bonuses.intersection_update({k for k in _awarded_bonuses if k[2] in current})
+    # Reservar antes de esperar a la BD: dos mensajes seguidos no cobran dos veces
+    _awarded_bonuses.add(key)
+    try:
+        return not await run_db(_bonus_already_awarded, user_id, hashtag, since)
+    except Exception:
+        _awarded_bonuses.discard(key)
+        raise
+
+def _release_bonus(user_id: int, hashtag: str, daily: bool):
+    """Deshacer _claim_bonus si el bono no llegó a darse"""
+    _awarded_bonuses.discard((user_id, hashtag, _period_start(daily)))
+
+async def check_challenges_async(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 text: str, folded: str) -> List[str]:
+    """Dar los bonos de reto semanal y diario (una vez por periodo). Devuelve los avisos.
+
+    folded: el texto con normalize_text (sin tildes y en minúsculas)
+    """
+    user = update.effective_user
+    username = user.username or user.first_name
+    chat_id = update.effective_chat.id
+    notices = []
+
+    async def award(points: int, hashtag: str, daily: bool):
+        try:
+            await add_points_async(
+                user_id=user.id,
+                username=username,
+                points=points,
+                hashtag=hashtag,
+                message_text=text[:200],
+                chat_id=chat_id,
+                message_id=update.message.message_id,
+                is_challenge_bonus=True,
+                context=context
+            )
+        except Exception:
+            # Sin puntos no hay bono: el siguiente mensaje puede volver a cobrarlo
+            _release_bonus(user.id, hashtag, daily)
+            raise
+
+    challenge = get_current_challenge()
+    hashtag = challenge.get("hashtag") if challenge else None
+    # "#recomendacion" sin tilde también cuenta para "#recomendación"
+    if hashtag and normalize_text(hashtag) in folded and validate_challenge_submission(challenge, text):
+        if await _claim_bonus(user.id, hashtag, daily=False):
+            bonus = challenge.get("bonus_points", 10)
+            await award(bonus, hashtag, daily=False)
+            notices.append(f"🎯 ¡Reto semanal completado! Bonus: +{bonus} puntos 🎉")
+
+    daily = get_today_challenge()
+    if daily and check_daily_completion(daily, text):
+        if await _claim_bonus(user.id, "(reto_diario)", daily=True):
+            bonus = daily.get("bonus_points", 5)
+            await award(bonus, "(reto_diario)", daily=True)
+            notices.append(f"🎯 ¡Reto diario completado! Bonus: +{bonus} puntos 🎉")
+
+    return notices
+
 async def reto_job(context: ContextTypes.DEFAULT_TYPE):
     """Job automático para publicar el reto semanal"""
     try:
         # Obtener chat_id desde job.data
         chat_id = context.job.data if context.job else None
         if not chat_id:
-            print("[ERROR] reto_job: No se encontró chat_id en job.data")
+            logger.error("reto_job: No se encontró chat_id en job.data")
             return
 
         reto = get_weekly_challenge()
@@ -94,10 +199,10 @@ async def reto_job(context: ContextTypes.DEFAULT_TYPE):
             text=text,
             parse_mode="Markdown"
         )
-        print(f"[INFO] Reto semanal enviado al chat {chat_id}")
+        logger.info("Reto semanal enviado al chat %s", chat_id)
         
     except Exception as e:
-        print(f"[ERROR] Error en reto_job: {e}")
+        logger.error("Error en reto_job: %s", e)
 
 async def cmd_reto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando para mostrar el reto actual"""
@@ -120,7 +225,7 @@ async def cmd_nuevo_reto(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await update.message.reply_text("⚠️ Función de retos personalizados no disponible. Usando reto automático.")
     except Exception as e:
-        print(f"[ERROR] Error en cmd_nuevo_reto: {e}")
+        logger.error("Error en cmd_nuevo_reto: %s", e)
         await update.message.reply_text("❌ Error al limpiar el reto personalizado.")
 
 async def cmd_borrar_reto(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -132,5 +237,5 @@ async def cmd_borrar_reto(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await update.message.reply_text("⚠️ Función de retos personalizados no disponible.")
     except Exception as e:
-        print(f"[ERROR] Error en cmd_borrar_reto: {e}")
+        logger.error("Error en cmd_borrar_reto: %s", e)
         await update.message.reply_text("❌ Error al borrar el reto personalizado.")
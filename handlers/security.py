@@ -1,79 +1,190 @@
 # handlers/security.py - Sistema de seguridad y manejo de hashtags
 import time
 import re
+import threading
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse, sre_constants
 from functools import wraps
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import logging
 from telegram import Update
+from handlers.rate_limiter import RateLimiter
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cada cuánto se purgan las entradas caducadas de la blacklist
+BLACKLIST_PRUNE_INTERVAL = 60
+
+# Patrones de spam: nombre -> (regex, severo). Los severos bloquean y mandan a blacklist.
+DEFAULT_SPAM_PATTERNS = {
+    'descarga_gratis': (r'(?i:(descarga|download)\s+(gratis|free))', True),
+    'promocion': (r'(?i:(oferta|promocion|descuento)\s*[0-9]+%)', True),
+    'gana_dinero': (r'(?i:(gana|earn)\s+(dinero|money))', True),
+    'url_sospechosa': (r'https?://(?!t\.me|youtube\.com|imdb\.com)', False),
+    'otro_canal': (r'(?i:telegram\s*@\w+)', False),  # Promoción de otros canales
+}
+DEFAULT_CAPS_RATIO = 0.7
+CAPS_MIN_LENGTH = 20
+REPEATED_CHARS_PATTERN = re.compile(r'(.)\1{4,}')
+SPAM_PATTERN_NAME = re.compile(r'[a-z_][a-z0-9_]*')
+
+def _build_uppercase_pattern():
+    """Clase de caracteres con todas las mayúsculas del BMP, en rangos"""
+    ranges = []
+    for code in range(0x10000):
+        if chr(code).isupper():
+            if ranges and ranges[-1][1] == code - 1:
+                ranges[-1][1] = code
+            else:
+                ranges.append([code, code])
+    parts = "".join(
+        re.escape(chr(start)) if start == end else f"{re.escape(chr(start))}-{re.escape(chr(end))}"
+        for start, end in ranges
+    )
+    return re.compile(f"[{parts}]")
+
+# Contar mayúsculas con findall (en C) en lugar de un bucle por carácter
+UPPERCASE_PATTERN = _build_uppercase_pattern()
+
+def _first_chars(items, ignorecase):
+    """Caracteres con los que puede empezar una coincidencia, o None si no se sabe"""
+    C = sre_constants
+    for op, av in items:
+        if op is C.LITERAL:
+            chars = {chr(av)}
+        elif op is C.IN:
+            chars = set()
+            for in_op, in_av in av:
+                if in_op is C.LITERAL:
+                    chars.add(chr(in_av))
+                elif in_op is C.RANGE and in_av[1] - in_av[0] < 256:
+                    chars.update(chr(c) for c in range(in_av[0], in_av[1] + 1))
+                else:
+                    return None
+        elif op is C.BRANCH:
+            chars = set()
+            for branch in av[1]:
+                branch_chars = _first_chars(branch, ignorecase)
+                if branch_chars is None:
+                    return None
+                chars |= branch_chars
+            return chars
+        elif op is C.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            sub_ignorecase = (ignorecase or add_flags & C.SRE_FLAG_IGNORECASE) and not del_flags & C.SRE_FLAG_IGNORECASE
+            return _first_chars(sub, sub_ignorecase)
+        elif op in (C.MAX_REPEAT, C.MIN_REPEAT) and av[0] > 0:
+            return _first_chars(av[2], ignorecase)
+        elif op in (C.AT, C.ASSERT, C.ASSERT_NOT):
+            continue  # No consumen caracteres
+        else:
+            return None
+        if ignorecase:
+            chars |= {c.swapcase() for c in chars}
+        return chars
+    return None
+
+def compile_spam_patterns(patterns: Dict[str, Tuple[str, bool]]):
+    """Unir los patrones en una sola alternancia con un grupo con nombre por patrón.
+
+    Si se puede deducir con qué caracteres empieza cada patrón, se antepone
+    un lookahead con esa clase: el motor descarta casi todas las posiciones
+    sin probar cada alternativa.
+    """
+    first = set()
+    for name, (regex, _) in patterns.items():
+        if not SPAM_PATTERN_NAME.fullmatch(name):
+            raise ValueError(f"Nombre de patrón inválido: {name}")
+        re.compile(regex)  # Error claro si un patrón suelto no compila
+        if first is not None:
+            try:
+                chars = _first_chars(sre_parse.parse(regex), False)
+            except Exception:
+                chars = None
+            first = first | chars if chars is not None else None
+    if not patterns:
+        return None
+
+    combined = "|".join(f"(?P<{name}>{regex})" for name, (regex, _) in patterns.items())
+    if first:
+        prefix = "".join(re.escape(c) for c in sorted(first))
+        # Sin distinguir mayúsculas: un superconjunto nunca descarta una coincidencia
+        combined = f"(?=(?i:[{prefix}]))(?:{combined})"
+    return re.compile(combined)
+
 class SecurityManager:
-    def __init__(self):
-        # Rate limiting: usuario_id -> {acción: [timestamps]}
-        self.rate_limits = {}
+    def __init__(self, rate_limit_backend=None):
         # Blacklist temporal para usuarios problemáticos
         self.temp_blacklist = {}
-        # Patrones de spam más sofisticados
-        self.spam_patterns = [
-            r'(?i)(descarga|download)\s+(gratis|free)',
-            r'(?i)(oferta|promocion|descuento)\s*[0-9]+%',
-            r'(?i)(gana|earn)\s+(dinero|money)',
-            r'https?://(?!t\.me|youtube\.com|imdb\.com)',  # URLs sospechosas
-            r'(?i)telegram\s*@\w+',  # Promoción de otros canales
-        ]
+        self._last_blacklist_prune = 0.0
+        # Patrones de spam, compilados juntos; se reemplazan en caliente
+        self._spam_lock = threading.Lock()
+        self.spam_patterns = dict(DEFAULT_SPAM_PATTERNS)
+        self.caps_ratio = DEFAULT_CAPS_RATIO
+        self._spam_regex = compile_spam_patterns(self.spam_patterns)
         # Límites por acción (acción: (max_count, window_seconds))
         self.action_limits = {
             'hashtag_usage': (5, 300),      # 5 hashtags por 5 min
             'message_send': (10, 60),       # 10 mensajes por minuto
             'command_usage': (3, 30),       # 3 comandos por 30 seg
         }
+        # Rate limiting GCRA: estado constante por (acción, usuario)
+        self.rate_limiter = RateLimiter(self.action_limits, backend=rate_limit_backend)
     
     def is_rate_limited(self, user_id: int, action: str) -> bool:
         """Verifica si un usuario excede los límites de rate"""
-        current_time = time.time()
-        
-        if user_id not in self.rate_limits:
-            self.rate_limits[user_id] = {}
-        
-        if action not in self.rate_limits[user_id]:
-            self.rate_limits[user_id][action] = []
-        
-        user_actions = self.rate_limits[user_id][action]
-        max_count, window = self.action_limits.get(action, (10, 60))
-        
-        # Limpiar timestamps antiguos
-        cutoff = current_time - window
-        user_actions[:] = [t for t in user_actions if t > cutoff]
-        
-        if len(user_actions) >= max_count:
-            logger.warning(f"Rate limit exceeded for user {user_id} on action {action}")
+        if self.rate_limiter.is_limited(user_id, action):
+            logger.warning("Rate limit exceeded for user %s on action %s", user_id, action)
             return True
-        
-        # Registrar nueva acción
-        user_actions.append(current_time)
         return False
     
-    def is_spam_content(self, text: str, user_id: int) -> Optional[str]:
-        """Detecta contenido spam y retorna razón si lo encuentra"""
-        # Verificar patrones de spam
-        for pattern in self.spam_patterns:
-            if re.search(pattern, text):
-                return f"Patrón spam detectado"
-        
+    def set_spam_pattern(self, name: str, regex: str, severe: bool = False):
+        """Añadir o reemplazar un patrón (ValueError/re.error si no es válido)"""
+        with self._spam_lock:
+            patterns = dict(self.spam_patterns)
+            patterns[name] = (regex, severe)
+            compiled = compile_spam_patterns(patterns)
+            self.spam_patterns, self._spam_regex = patterns, compiled
+        logger.info("Patrón de spam %s actualizado: %s (severo=%s)", name, regex, severe)
+
+    def remove_spam_pattern(self, name: str) -> bool:
+        with self._spam_lock:
+            if name not in self.spam_patterns:
+                return False
+            patterns = dict(self.spam_patterns)
+            del patterns[name]
+            compiled = compile_spam_patterns(patterns)
+            self.spam_patterns, self._spam_regex = patterns, compiled
+        logger.info("Patrón de spam %s eliminado", name)
+        return True
+
+    def classify_spam(self, text: str) -> Optional[Tuple[str, bool]]:
+        """(razón, severo) del primer indicio de spam, o None"""
+        # Una sola búsqueda para todos los patrones; el grupo indica cuál
+        regex = self._spam_regex
+        if regex is not None:
+            match = regex.search(text)
+            if match:
+                name = match.lastgroup
+                return f"Patrón spam detectado ({name})", self.spam_patterns[name][1]
+
         # Verificar exceso de mayúsculas
-        if len(text) > 20:
-            caps_ratio = sum(1 for c in text if c.isupper()) / len(text)
-            if caps_ratio > 0.7:
-                return "Exceso de mayúsculas"
-        
+        if len(text) > CAPS_MIN_LENGTH:
+            if len(UPPERCASE_PATTERN.findall(text)) / len(text) > self.caps_ratio:
+                return "Exceso de mayúsculas", False
+
         # Verificar repetición excesiva de caracteres
-        if re.search(r'(.)\1{4,}', text):
-            return "Repetición excesiva de caracteres"
-        
+        if REPEATED_CHARS_PATTERN.search(text):
+            return "Repetición excesiva de caracteres", False
+
         return None
+
+    def is_spam_content(self, text: str, user_id: int) -> Optional[str]:
+        """Detecta contenido spam y retorna razón si lo encuentra"""
+        spam = self.classify_spam(text)
+        return spam[0] if spam else None
     
     def add_to_blacklist(self, user_id: int, reason: str, duration: int = 3600):
         """Añade usuario a blacklist temporal"""
@@ -81,10 +192,23 @@ class SecurityManager:
             'reason': reason,
             'until': time.time() + duration
         }
-        logger.info(f"User {user_id} blacklisted for {duration}s: {reason}")
+        logger.info("User %s blacklisted for %ss: %s", user_id, duration, reason)
     
+    def prune_blacklist(self, now: float = None) -> int:
+        """Eliminar las entradas de blacklist ya caducadas"""
+        now = time.time() if now is None else now
+        expired = [uid for uid, info in self.temp_blacklist.items() if now > info['until']]
+        for uid in expired:
+            del self.temp_blacklist[uid]
+        return len(expired)
+
     def is_blacklisted(self, user_id: int) -> Optional[str]:
         """Verifica si usuario está en blacklist"""
+        now = time.time()
+        if now - self._last_blacklist_prune > BLACKLIST_PRUNE_INTERVAL:
+            self._last_blacklist_prune = now
+            self.prune_blacklist(now)
+
         if user_id not in self.temp_blacklist:
             return None
         
@@ -118,13 +242,14 @@ class SecurityManager:
             return result
         
         # Verificar spam
-        spam_reason = self.is_spam_content(text, user_id)
-        if spam_reason:
+        spam = self.classify_spam(text)
+        if spam:
+            spam_reason, severe = spam
             result['spam_score'] = 10
             result['warnings'].append(f"Contenido sospechoso: {spam_reason}")
             
             # Si es spam severo, bloquear
-            if any(severe in spam_reason.lower() for severe in ['descarga', 'promocion', 'gana dinero']):
+            if severe:
                 result['is_valid'] = False
                 result['blocks'].append("Contenido promocional no permitido")
                 self.add_to_blacklist(user_id, spam_reason, 1800)  # 30 min
@@ -243,7 +368,7 @@ async def handle_hashtags_improved(update: Update, context):
     user_id = user.id
     username = user.username or f"user_{user_id}"
     
-    logger.info(f"Processing message from {username} (ID: {user_id}): {text[:50]}...")
+    logger.info("Processing message from %s (ID: %s): %s...", username, user_id, text[:50])
     
     # Verificar si hay hashtags válidos
     found_hashtags = [tag for tag in POINTS.keys() if tag in text.lower()]
@@ -267,7 +392,7 @@ async def handle_hashtags_improved(update: Update, context):
                 return
         
     except Exception as e:
-        logger.error(f"Security validation error: {e}")
+        logger.error("Security validation error: %s", e)
         # Continuar sin validación de seguridad en caso de error
     
     # Procesar hashtags
@@ -301,7 +426,7 @@ async def handle_hashtags_improved(update: Update, context):
             warnings.extend(validation_result['warnings'])
             
         except Exception as e:
-            logger.error(f"Error validating hashtag {hashtag}: {e}")
+            logger.error("Error validating hashtag %s: %s", hashtag, e)
             # Usar puntos base sin validación
             total_points += base_points
             found_tags.append(f"{hashtag} (+{base_points})")
@@ -326,9 +451,9 @@ async def handle_hashtags_improved(update: Update, context):
             is_challenge_bonus=False,
             context=context
         )
-        logger.info(f"Added {total_points} points for user {username}")
+        logger.info("Added %s points for user %s", total_points, username)
     except Exception as e:
-        logger.error(f"Error adding points: {e}")
+        logger.error("Error adding points: %s", e)
         await update.message.reply_text("❌ Error interno. Inténtalo más tarde.")
         return
     
@@ -352,7 +477,7 @@ async def handle_hashtags_improved(update: Update, context):
     try:
         await check_challenges(update, context, text, user_id, username, response_parts)
     except Exception as e:
-        logger.error(f"Error checking challenges: {e}")
+        logger.error("Error checking challenges: %s", e)
     
     # Enviar respuesta
     if response_parts:
@@ -362,10 +487,10 @@ async def handle_hashtags_improved(update: Update, context):
                 response_text = response_text[:4000] + "..."
             
             await update.message.reply_text(response_text)
-            logger.info(f"Sent response to {username}: {total_points} points")
+            logger.info("Sent response to %s: %s points", username, total_points)
             
         except Exception as e:
-            logger.error(f"Error sending response: {e}")
+            logger.error("Error sending response: %s", e)
             # Respuesta de emergencia
             try:
                 await update.message.reply_text(f"✅ +{total_points} puntos!")
@@ -424,7 +549,7 @@ async def check_challenges(update, context, text, user_id, username, response_pa
             logger.debug("Daily challenges module not available")
             
     except Exception as e:
-        logger.error(f"Error checking challenges: {e}")
+        logger.error("Error checking challenges: %s", e)
 
 def check_daily_completion(daily_challenge, text):
     """Verifica si se completó el reto diario"""
@@ -444,5 +569,5 @@ def check_daily_completion(daily_challenge, text):
         
         return False
     except Exception as e:
-        logger.error(f"Error checking daily completion: {e}")
+        logger.error("Error checking daily completion: %s", e)
         return False
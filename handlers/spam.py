@@ -1,5 +1,101 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
 from telegram import Update
 
+logger = logging.getLogger(__name__)
+
+# Uso de un mismo hashtag: máximo 3 veces en 5 minutos por usuario
+HASHTAG_SPAM_LIMIT = 3
+HASHTAG_SPAM_WINDOW = 300
+SPAM_TRACKER_MAX_KEYS = 200_000
+SPAM_TRACKER_SWEEP_INTERVAL = 60
+
+class SlidingWindowCounter:
+    """Contador de ventana deslizante por clave con memoria acotada.
+
+    Cada clave guarda en un ring buffer (deque con maxlen=limit) los instantes
+    de sus últimos usos, así que hit() es O(1). Las claves se ordenan por último
+    uso: las que llevan más de una ventana sin actividad las borra un hilo de
+    barrido, y si se supera max_keys se descartan las menos recientes.
+    """
+
+    def __init__(self, limit, window, max_keys=SPAM_TRACKER_MAX_KEYS,
+                 sweep_interval=SPAM_TRACKER_SWEEP_INTERVAL):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._hits = OrderedDict()   # clave -> deque de instantes (monotonic)
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self._hits)
+
+    def hit(self, key, now=None) -> bool:
+        """Registrar un uso si cabe en la ventana. False si excede el límite."""
+        now = time.monotonic() if now is None else now
+        if self._sweeper is None:
+            self.start()
+
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque(maxlen=self.limit)
+                while len(self._hits) > self.max_keys:
+                    self._hits.popitem(last=False)
+            else:
+                self._hits.move_to_end(key)
+
+            # Buffer lleno y el uso más antiguo aún dentro de la ventana
+            if len(hits) == self.limit and now - hits[0] < self.window:
+                return False
+            hits.append(now)
+            return True
+
+    def sweep(self, now=None) -> int:
+        """Borrar las claves sin usos dentro de la ventana"""
+        now = time.monotonic() if now is None else now
+        removed = 0
+        with self._lock:
+            # Orden por último uso: basta con recorrer desde el principio
+            while self._hits:
+                key, hits = next(iter(self._hits.items()))
+                if now - hits[-1] < self.window:
+                    break
+                del self._hits[key]
+                removed += 1
+        return removed
+
+    def start(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._run, name="spam-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug("Barrido antispam: %s claves expiradas, %s activas", removed, len(self))
+            except Exception as e:
+                logger.error("Error en barrido antispam: %s", e)
+
+# Compartido por hashtags.py y comandos_basicos.py
+hashtag_spam_tracker = SlidingWindowCounter(HASHTAG_SPAM_LIMIT, HASHTAG_SPAM_WINDOW)
+
+def is_hashtag_spam(user_id: int, hashtag_key: str) -> bool:
+    """True si el usuario ya usó ese hashtag el máximo de veces en la ventana"""
+    return not hashtag_spam_tracker.hit((user_id, hashtag_key))
+
 async def spam_handler(update: Update, context):
     if "gratis" in update.message.text.lower():
         await update.message.reply_text("🛑 ¡Cuidado con el spam!")
@@ -2,16 +2,16 @@
 
 from telegram import Update
 from telegram.ext import ContextTypes
-from db import get_user_stats, get_top10, add_points
+from db import add_points_async
+from handlers.spam import is_hashtag_spam
+from outbox import outbox, ReplyCoalescer
+from text_norm import ACCENT_FOLD_TABLE
+import os
 import random
 import datetime
 import logging
 import re
-import time
-import unicodedata
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # HASHTAGS UNIFICADOS - SIN REPETICIONES Y CON DETECCIÓN FLEXIBLE
@@ -48,107 +48,59 @@ VALID_HASHTAGS = {
     'spoiler': 1
 }
 
-# Cache para control de spam
-user_hashtag_cache = {}
+# Un único patrón: "#palabra" y "# palabra" en cualquier posición
+HASHTAG_PATTERN = re.compile(r'#\s*(\w+)')
+
+# Sugerencias de hashtags parecidos (solo para depuración), por prefijo de 3 letras
+_SIMILAR_BY_PREFIX = {}
+for _tag in VALID_HASHTAGS:
+    _SIMILAR_BY_PREFIX.setdefault(_tag[:3], []).append(_tag)
 
 def normalize_text(text):
     """Normaliza texto removiendo tildes y caracteres especiales"""
     if not text:
         return ""
-    
-    # Remover tildes y normalizar
-    normalized = unicodedata.normalize('NFD', text)
-    normalized = ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
-    
-    # Convertir a minúsculas
-    return normalized.lower()
+    return text.translate(ACCENT_FOLD_TABLE).lower()
 
 def find_hashtags_in_message(text):
-    """FUNCIÓN CORREGIDA - Encuentra TODOS los hashtags válidos con detección mejorada"""
+    """Encuentra TODOS los hashtags válidos en una sola pasada, en orden de aparición"""
     if not text:
         return []
-    
-    print(f"[DEBUG] 🔍 Texto original: '{text}'")
-    
-    found_hashtags = []
-    
-    # ✅ PATRONES MEJORADOS - Detecta hashtags en CUALQUIER posición
-    hashtag_patterns = [
-        # Patrón principal: # seguido de palabra (Unicode completo)
-        r'#([\w\u00C0-\u024F\u1E00-\u1EFF]+)',
-        # Patrón con espacio después del #
-        r'#\s+([\w\u00C0-\u024F\u1E00-\u1EFF]+)',
-        # Patrón al final de línea o antes de puntuación
-        r'#([\w\u00C0-\u024F\u1E00-\u1EFF]+)(?=\s|$|[.,;:!?])',
-    ]
-    
-    for i, pattern in enumerate(hashtag_patterns):
-        hashtags_found = re.findall(pattern, text, re.IGNORECASE | re.UNICODE)
-        
-        for hashtag_word in hashtags_found:
-            # Limpiar la palabra (remover espacios extra)
-            hashtag_word = hashtag_word.strip()
-            if not hashtag_word:
-                continue
-                
-            # Normalizar la palabra encontrada
-            normalized_hashtag = normalize_text(hashtag_word)
-            
-            print(f"[DEBUG] 🏷️ Hashtag encontrado (patrón {i+1}): '{hashtag_word}' -> normalizado: '{normalized_hashtag}'")
-            
-            # Verificar si está en la lista de hashtags válidos
-            if normalized_hashtag in VALID_HASHTAGS:
-                points = VALID_HASHTAGS[normalized_hashtag]
-                found_hashtags.append((f"#{hashtag_word}", points))
-                print(f"[DEBUG] ✅ VÁLIDO: #{hashtag_word} = {points} puntos")
-            else:
-                print(f"[DEBUG] ❌ NO VÁLIDO: #{hashtag_word} (normalizado: {normalized_hashtag})")
-                # DEBUG ADICIONAL: Mostrar hashtags válidos similares
-                similar = [h for h in VALID_HASHTAGS.keys() if h.startswith(normalized_hashtag[:3])]
-                if similar:
-                    print(f"[DEBUG] 💡 Hashtags similares disponibles: {similar}")
-    
-    # Eliminar duplicados manteniendo el orden
+
     unique_hashtags = []
     seen = set()
-    for hashtag, points in found_hashtags:
-        hashtag_lower = normalize_text(hashtag)
-        if hashtag_lower not in seen:
-            unique_hashtags.append((hashtag, points))
-            seen.add(hashtag_lower)
-    
-    print(f"[DEBUG] 🎯 Hashtags únicos finales: {unique_hashtags}")
+    for match in HASHTAG_PATTERN.finditer(text):
+        hashtag_word = match.group(1)
+        normalized_hashtag = hashtag_word.translate(ACCENT_FOLD_TABLE).lower()
+
+        points = VALID_HASHTAGS.get(normalized_hashtag)
+        if points is None:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Hashtag no válido: #%s (normalizado: %s), similares: %s",
+                    hashtag_word, normalized_hashtag, _SIMILAR_BY_PREFIX.get(normalized_hashtag[:3], [])
+                )
+            continue
+
+        # Eliminar duplicados manteniendo el orden
+        if normalized_hashtag not in seen:
+            seen.add(normalized_hashtag)
+            unique_hashtags.append((f"#{hashtag_word}", points))
+
+    logger.debug("Hashtags únicos finales: %s", unique_hashtags)
     return unique_hashtags
 
 def is_spam(user_id, hashtag):
-    """Detecta spam basado en frecuencia de hashtags por usuario"""
-    current_time = time.time()
-    
-    if user_id not in user_hashtag_cache:
-        user_hashtag_cache[user_id] = {}
-    
-    user_data = user_hashtag_cache[user_id]
-    
-    # Limpiar datos antiguos (más de 5 minutos)
-    if "last_time" in user_data and current_time - user_data["last_time"] > 300:
-        user_data.clear()
-    
-    # Contar uso del hashtag
-    if hashtag in user_data:
-        user_data[hashtag] = user_data.get(hashtag, 0) + 1
-        if user_data[hashtag] > 3:  # Máximo 3 veces en 5 minutos
-            return True
-    else:
-        user_data[hashtag] = 1
-    
-    user_data["last_time"] = current_time
-    return False
+    """Detecta spam basado en frecuencia de hashtags por usuario (máx. 3 usos en 5 minutos)"""
+    return is_hashtag_spam(user_id, normalize_text(hashtag))
+
+HASHTAG_WORD_PATTERN = re.compile(r'#\w+')
 
 def count_words(text):
     """Cuenta palabras sin incluir hashtags"""
     if not text:
         return 0
-    text_without_hashtags = re.sub(r'#\w+', '', text)
+    text_without_hashtags = HASHTAG_WORD_PATTERN.sub('', text)
     return len(text_without_hashtags.split())
 
 # Niveles del sistema
@@ -167,47 +119,73 @@ def calculate_level(points):
             return level
     return 1
 
+# Confirmaciones agrupadas: en un chat con ráfagas de hashtags, las que llegan
+# dentro de esta ventana (segundos) salen en un solo resumen. 0 = desactivado
+HASHTAG_COALESCE_SECONDS = float(os.getenv("HASHTAG_COALESCE_SECONDS", "0"))
+
+def _merge_confirmation(previous, entry):
+    """Acumula por usuario los puntos, hashtags y notas de la ventana"""
+    if previous is None:
+        return entry
+    previous["points"] += entry["points"]
+    previous["messages"] += 1
+    previous["hashtags"].extend(h for h in entry["hashtags"] if h not in previous["hashtags"])
+    previous["warnings"].extend(entry["warnings"])
+    return previous
+
+def _render_confirmations(entries):
+    lines = ["✅ <b>¡Puntos ganados!</b> 🎬\n"]
+    for entry in entries:
+        messages = f" en {entry['messages']} mensajes" if entry["messages"] > 1 else ""
+        lines.append(f"👤 {entry['mention']}: <b>+{entry['points']}</b>{messages} · {', '.join(entry['hashtags'])}")
+        lines.extend(f"   {warning}" for warning in entry["warnings"][:3])
+    lines.append("\n🎭 ¡Sigue compartiendo tu pasión por el cine! 🍿")
+    return "\n".join(lines)
+
+hashtag_confirmations = ReplyCoalescer(HASHTAG_COALESCE_SECONDS, _merge_confirmation, _render_confirmations)
+
 async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """FUNCIÓN PRINCIPAL MEJORADA - Detecta TODOS los hashtags válidos"""
     if not update.message or not update.message.text:
         return
     
+    message_text = update.message.text
+    await score_hashtags(update, context, find_hashtags_in_message(message_text), count_words(message_text))
+
+async def score_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE, found_hashtags, word_count: int) -> int:
+    """Puntuar los hashtags ya detectados en el mensaje. Devuelve los puntos otorgados"""
     message_text = update.message.text
     user = update.effective_user
     chat = update.effective_chat
     
-    print(f"[DEBUG] 🔍 === INICIANDO PROCESAMIENTO ===")
-    print(f"[DEBUG] 👤 Usuario: {user.username or user.first_name} (ID: {user.id})")
-    print(f"[DEBUG] 📝 Mensaje: '{message_text}'")
-    print(f"[DEBUG] 💬 Chat: {chat.id}")
-    
-    # 🎯 DETECCIÓN MEJORADA DE HASHTAGS
-    found_hashtags = find_hashtags_in_message(message_text)
+    logger.debug("🔍 === INICIANDO PROCESAMIENTO ===")
+    logger.debug("👤 Usuario: %s (ID: %s)", user.username or user.first_name, user.id)
+    logger.debug("📝 Mensaje: '%s'", message_text)
+    logger.debug("💬 Chat: %s", chat.id)
     
     if not found_hashtags:
-        print(f"[DEBUG] ❌ No se encontraron hashtags válidos")
-        return
+        logger.debug("❌ No se encontraron hashtags válidos")
+        return 0
     
-    print(f"[DEBUG] ✅ Hashtags detectados: {found_hashtags}")
+    logger.debug("✅ Hashtags detectados: %s", found_hashtags)
     
     # Verificar spam y calcular puntos
     valid_hashtags = []
     total_points = 0
     warnings = []
-    
+
     for hashtag, points in found_hashtags:
         hashtag_word = hashtag[1:].lower()  # Remover # y convertir a minúsculas
         
-        print(f"[DEBUG] 🔄 Procesando: {hashtag} ({points} pts)")
+        logger.debug("🔄 Procesando: %s (%s pts)", hashtag, points)
         
         # Verificar spam
         if is_spam(user.id, hashtag):
             warnings.append(f"⚠️ {hashtag}: Detectado spam. Usa hashtags con moderación.")
-            print(f"[DEBUG] 🚫 Spam detectado para {hashtag}")
+            logger.debug("🚫 Spam detectado para %s", hashtag)
             continue
         
         # Validaciones especiales
-        word_count = count_words(message_text)
         original_points = points
         
         if hashtag_word == "critica" and word_count < 25:
@@ -220,27 +198,28 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
         valid_hashtags.append((hashtag, points))
         total_points += points
         
-        print(f"[DEBUG] ✅ {hashtag}: {original_points} -> {points} puntos")
+        logger.debug("✅ %s: %s -> %s puntos", hashtag, original_points, points)
     
     if total_points <= 0:
-        print(f"[DEBUG] ❌ Total de puntos = 0, no procesar")
-        return
+        logger.debug("❌ Total de puntos = 0, no procesar")
+        return 0
     
     # Bonus por mensaje detallado
     bonus_text = ""
     if len(message_text) > 150:
         total_points += 2
         bonus_text = " (+2 bonus detalle)"
-        print(f"[DEBUG] 💎 Bonus por detalle: +2 puntos")
+        logger.debug("💎 Bonus por detalle: +2 puntos")
     
-    print(f"[DEBUG] 💰 Total final: {total_points} puntos")
+    logger.debug("💰 Total final: %s puntos", total_points)
     
+    awarded = 0
     try:
         # Guardar en base de datos
         primary_hashtag = valid_hashtags[0][0] if valid_hashtags else "#aporte"
         
-        print(f"[DEBUG] 💾 Guardando en BD...")
-        add_points(
+        logger.debug("💾 Guardando en BD...")
+        await add_points_async(
             user_id=user.id,
             username=user.username or user.first_name,
             points=total_points,
@@ -251,7 +230,8 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context=context
         )
         
-        print(f"[DEBUG] ✅ Datos guardados exitosamente")
+        awarded = total_points
+        logger.debug("✅ Datos guardados exitosamente")
         
         # Crear respuesta - FORMATEO CORREGIDO
         hashtags_list = ", ".join([h[0] for h, p in valid_hashtags])
@@ -280,25 +260,35 @@ async def handle_hashtags(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if warnings:
             response += f"\n\n⚠️ <b>Notas:</b>\n" + "\n".join(warnings)
         
-        await update.message.reply_text(
-            response, 
+        send_single = lambda: outbox.reply(
+            update.message,
+            response,
             parse_mode='HTML',
             reply_to_message_id=update.message.message_id
         )
+        if hashtag_confirmations.enabled:
+            hashtag_confirmations.submit(context.bot, chat.id, user.id, {
+                "mention": user.mention_html(),
+                "points": total_points,
+                "messages": 1,
+                "hashtags": [h for h, _ in valid_hashtags],
+                "warnings": warnings,
+            }, send_single)
+        else:
+            send_single()
         
-        print(f"[DEBUG] ✅ Respuesta enviada correctamente")
-        logger.info(f"Usuario {user.id} ganó {total_points} puntos con: {hashtags_list}")
+        logger.debug("✅ Respuesta encolada")
+        logger.info("Usuario %s ganó %s puntos con: %s", user.id, total_points, hashtags_list)
         
     except Exception as e:
-        logger.error(f"❌ ERROR en handle_hashtags: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ ERROR en handle_hashtags: %s", e)
         
         # Respuesta de emergencia - TAMBIÉN CORREGIDA
         try:
-            await update.message.reply_text(f"✅ ¡Puntos ganados! +{total_points} pts 🎬")
-            print(f"[DEBUG] 🆘 Respuesta de emergencia enviada")
+            outbox.reply(update.message, f"✅ ¡Puntos ganados! +{total_points} pts 🎬")
+            logger.debug("🆘 Respuesta de emergencia enviada")
         except Exception as e2:
-            print(f"[DEBUG] ❌ Error crítico: No se pudo enviar respuesta: {e2}")
+            logger.debug("❌ Error crítico: No se pudo enviar respuesta: %s", e2)
 
-    print(f"[DEBUG] 🏁 === PROCESAMIENTO TERMINADO ===\n")
+    logger.debug("🏁 === PROCESAMIENTO TERMINADO ===")
+    return awarded
@@ -1,164 +1,84 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import random
-import asyncio
-import json
+import os
+import logging
 from typing import Dict, List, Optional, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from db import add_points, get_connection
-
-# Sistema de almacenamiento de juegos activos (en memoria)
-active_games: Dict[int, Dict] = {}
-
-# Base de datos de películas para los juegos
-MOVIES_DB = [
-    {
-        "title": "El Padrino", "year": 1972, "genre": "Drama",
-        "director": "Francis Ford Coppola", "difficulty": 2,
-        "hints": ["Mafia italiana", "Marlon Brando", "Oscar a mejor película"],
-        "emojis": "👨‍👨‍👦 🔫 🍷 💰"
-    },
-    {
-        "title": "Pulp Fiction", "year": 1994, "genre": "Crime",
-        "director": "Quentin Tarantino", "difficulty": 3,
-        "hints": ["Narrativa no lineal", "John Travolta", "Vincent Vega"],
-        "emojis": "🍔 💉 🕺 🎯"
-    },
-    {
-        "title": "Forrest Gump", "year": 1994, "genre": "Drama",
-        "director": "Robert Zemeckis", "difficulty": 2,
-        "hints": ["Tom Hanks", "Chocolates", "Ping pong"],
-        "emojis": "🏃‍♂️ 🍫 🏓 🪶"
-    },
-    {
-        "title": "Matrix", "year": 1999, "genre": "Sci-Fi",
-        "director": "Las Wachowski", "difficulty": 2,
-        "hints": ["Realidad virtual", "Keanu Reeves", "Píldora roja"],
-        "emojis": "💊 🕶️ 💻 🔌"
-    },
-    {
-        "title": "Titanic", "year": 1997, "genre": "Romance",
-        "director": "James Cameron", "difficulty": 1,
-        "hints": ["Barco hundido", "Leonardo DiCaprio", "Iceberg"],
-        "emojis": "🚢 ❄️ 💎 💔"
-    },
-    {
-        "title": "El Señor de los Anillos", "year": 2001, "genre": "Fantasy",
-        "director": "Peter Jackson", "difficulty": 3,
-        "hints": ["Hobbit", "Anillo de poder", "Tierra Media"],
-        "emojis": "💍 🧙‍♂️ 🗡️ 🏔️"
-    },
-    {
-        "title": "Jurassic Park", "year": 1993, "genre": "Adventure",
-        "director": "Steven Spielberg", "difficulty": 2,
-        "hints": ["Dinosaurios", "Isla", "ADN"],
-        "emojis": "🦕 🧬 🏝️ 🚁"
-    },
-    {
-        "title": "Star Wars", "year": 1977, "genre": "Sci-Fi",
-        "director": "George Lucas", "difficulty": 1,
-        "hints": ["Galaxia lejana", "Luke Skywalker", "Fuerza"],
-        "emojis": "⭐ 🗡️ 🤖 🚀"
-    },
-    {
-        "title": "Casablanca", "year": 1942, "genre": "Romance",
-        "director": "Michael Curtiz", "difficulty": 4,
-        "hints": ["Humphrey Bogart", "Marruecos", "Segunda Guerra"],
-        "emojis": "✈️ 🎹 💔 🌍"
-    },
-    {
-        "title": "El Rey León", "year": 1994, "genre": "Animation",
-        "director": "Roger Allers", "difficulty": 1,
-        "hints": ["Simba", "Hakuna Matata", "África"],
-        "emojis": "🦁 👑 🌅 🎵"
-    }
-]
-
-# Preguntas de trivia
-TRIVIA_QUESTIONS = [
-    {
-        "question": "¿Quién dirigió la película 'Inception'?",
-        "options": ["Christopher Nolan", "David Fincher", "Denis Villeneuve", "Ridley Scott"],
-        "correct": 0,
-        "points": 10
-    },
-    {
-        "question": "¿En qué año se estrenó 'Pulp Fiction'?",
-        "options": ["1992", "1994", "1996", "1998"],
-        "correct": 1,
-        "points": 8
-    },
-    {
-        "question": "¿Cuál de estos actores no aparece en 'El Padrino'?",
-        "options": ["Al Pacino", "Robert De Niro", "Marlon Brando", "Jack Nicholson"],
-        "correct": 3,
-        "points": 12
-    },
-    {
-        "question": "¿Qué película ganó el Oscar a Mejor Película en 2020?",
-        "options": ["1917", "Joker", "Parásitos", "Érase una vez en Hollywood"],
-        "correct": 2,
-        "points": 15
-    },
-    {
-        "question": "¿Quién compuso la música de 'Star Wars'?",
-        "options": ["Hans Zimmer", "John Williams", "Danny Elfman", "Alan Silvestri"],
-        "correct": 1,
-        "points": 10
-    }
-]
+from db import add_points_async, get_connection, run_db, BatchBuffer, flush_points
+from game_store import GameStore, GameExpiryScheduler, create_game_store_table
+from catalogue import catalogue
+from outbox import outbox, HIGH
+from decks import create_decks_table
+
+logger = logging.getLogger(__name__)
+
+# Juegos activos: en memoria y persistidos en SQLite (sobreviven a reinicios)
+active_games = GameStore()
+
+# Un juego sin resolver vence a los GAME_TIMEOUT_MINUTES de empezar
+GAME_TIMEOUT_MINUTES = int(os.getenv("GAME_TIMEOUT_MINUTES", "30"))
+GAME_TIMEOUT_ANNOUNCE = os.getenv("GAME_TIMEOUT_ANNOUNCE", "1") == "1"
+game_expiry = GameExpiryScheduler(active_games, GAME_TIMEOUT_MINUTES * 60)
+
+# Películas y preguntas: data/movies.jsonl y data/trivia.json (ver catalogue.py)
 
 def initialize_games_system():
     """Inicializar el sistema de juegos"""
     create_games_tables()
-    print("[INFO] ✅ Sistema de juegos inicializado")
+    catalogue.load()
+    restored = active_games.restore(GAME_TIMEOUT_MINUTES)
+    if restored:
+        logger.info("Juegos activos restaurados: %s", restored)
+    logger.info("✅ Sistema de juegos inicializado")
 
 def create_games_tables():
     """Crear tablas para estadísticas de juegos"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS game_stats (
-            user_id INTEGER,
-            username TEXT,
-            game_type TEXT,
-            games_played INTEGER DEFAULT 0,
-            games_won INTEGER DEFAULT 0,
-            total_points INTEGER DEFAULT 0,
-            best_streak INTEGER DEFAULT 0,
-            current_streak INTEGER DEFAULT 0,
-            last_played TEXT DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (user_id, game_type)
-        )
-    """)
+    try:
+        cursor = conn.cursor()
+    
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS game_stats (
+                user_id INTEGER,
+                username TEXT,
+                game_type TEXT,
+                games_played INTEGER DEFAULT 0,
+                games_won INTEGER DEFAULT 0,
+                total_points INTEGER DEFAULT 0,
+                best_streak INTEGER DEFAULT 0,
+                current_streak INTEGER DEFAULT 0,
+                last_played TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, game_type)
+            )
+        """)
+        create_game_store_table(cursor)
+        create_decks_table(cursor)
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+    finally:
+        conn.close()
 
-async def cleanup_games_periodically():
-    """Limpiar juegos inactivos cada 30 minutos"""
-    while True:
-        try:
-            await asyncio.sleep(1800)  # 30 minutos
-            current_time = datetime.now()
-            
-            to_remove = []
-            for chat_id, game in active_games.items():
-                if current_time - game.get('started_at', current_time) > timedelta(minutes=30):
-                    to_remove.append(chat_id)
-            
-            for chat_id in to_remove:
-                del active_games[chat_id]
-                
-            if to_remove:
-                print(f"[INFO] Limpieza de juegos: {len(to_remove)} juegos inactivos eliminados")
-                
-        except Exception as e:
-            print(f"[ERROR] Error en limpieza de juegos: {e}")
+def start_game_expiry(application):
+    """Arrancar el vencimiento de juegos (llamar desde post_init, dentro del loop)"""
+    async def on_expire(chat_id, game):
+        if GAME_TIMEOUT_ANNOUNCE:
+            await announce_game_timeout(application.bot, chat_id, game)
+
+    game_expiry.start(on_expire)
+
+async def announce_game_timeout(bot, chat_id: int, game: Dict):
+    """Avisar al chat de que el juego venció y revelar la respuesta"""
+    if game['type'] == 'trivia':
+        question = game['question']
+        answer = question['options'][question['correct']]
+        text = f"⏰ **¡Se acabó el tiempo!**\n\n✅ **Respuesta correcta:** {answer}"
+    else:
+        movie = game['movie']
+        text = f"⏰ **¡Se acabó el tiempo!**\n\n🎬 **La película era:** {movie['title']} ({movie['year']})"
+    outbox.send_message(bot, chat_id, text, priority=HIGH, parse_mode='Markdown')
 
 # COMANDOS DE JUEGOS
 
@@ -166,23 +86,26 @@ async def cmd_cinematrivia(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Iniciar trivia de películas"""
     chat_id = update.effective_chat.id
     
-    if chat_id in active_games:
+    if await active_games.contains_async(chat_id):
         await update.message.reply_text(
             "🎮 Ya hay un juego activo en este chat.\n"
             "Usa /rendirse para abandonarlo y empezar uno nuevo."
         )
         return
     
-    # Seleccionar pregunta aleatoria
-    question_data = random.choice(TRIVIA_QUESTIONS)
+    # Siguiente pregunta del mazo del chat (no se repiten hasta agotarlas)
+    question_data = await run_db(catalogue.draw_trivia, chat_id)
+    if question_data is None:
+        await update.message.reply_text("😅 Juego temporalmente no disponible.")
+        return
     
     # Crear juego
-    active_games[chat_id] = {
+    await active_games.set_async(chat_id, {
         'type': 'trivia',
         'question': question_data,
         'started_at': datetime.now(),
         'participants': []
-    }
+    })
     
     # Crear teclado con opciones
     keyboard = []
@@ -214,24 +137,27 @@ async def cmd_adivinapelicula(update: Update, context: ContextTypes.DEFAULT_TYPE
     """Juego de adivinar película por pistas"""
     chat_id = update.effective_chat.id
     
-    if chat_id in active_games:
+    if await active_games.contains_async(chat_id):
         await update.message.reply_text(
             "🎮 Ya hay un juego activo en este chat.\n"
             "Usa /rendirse para abandonarlo y empezar uno nuevo."
         )
         return
     
-    # Seleccionar película aleatoria
-    movie = random.choice(MOVIES_DB)
+    # Siguiente película del mazo del chat
+    movie = await run_db(catalogue.draw_movie, chat_id)
+    if movie is None:
+        await update.message.reply_text("😅 Juego temporalmente no disponible.")
+        return
     
     # Crear juego
-    active_games[chat_id] = {
+    await active_games.set_async(chat_id, {
         'type': 'guess_movie',
         'movie': movie,
         'hints_used': 0,
         'started_at': datetime.now(),
         'participants': []
-    }
+    })
     
     points = 20 - (movie['difficulty'] * 3)
     
@@ -257,28 +183,26 @@ async def cmd_emojipelicula(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Juego de adivinar película por emojis"""
     chat_id = update.effective_chat.id
     
-    if chat_id in active_games:
+    if await active_games.contains_async(chat_id):
         await update.message.reply_text(
             "🎮 Ya hay un juego activo en este chat.\n"
             "Usa /rendirse para abandonarlo y empezar uno nuevo."
         )
         return
     
-    # Seleccionar película con emojis
-    movies_with_emojis = [m for m in MOVIES_DB if m.get('emojis')]
-    if not movies_with_emojis:
+    # Siguiente película con emojis del mazo del chat
+    movie = await run_db(catalogue.draw_movie, chat_id, with_emojis=True)
+    if movie is None:
         await update.message.reply_text("😅 Juego temporalmente no disponible.")
         return
     
-    movie = random.choice(movies_with_emojis)
-    
     # Crear juego
-    active_games[chat_id] = {
+    await active_games.set_async(chat_id, {
         'type': 'emoji_movie',
         'movie': movie,
         'started_at': datetime.now(),
         'participants': []
-    }
+    })
     
     points = 15 + (movie['difficulty'] * 2)
     
@@ -304,15 +228,14 @@ async def cmd_pista(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Pedir pista en juego activo"""
     chat_id = update.effective_chat.id
     
-    if chat_id not in active_games:
+    game = await active_games.get_async(chat_id)
+    if game is None:
         await update.message.reply_text(
             "🚫 No hay juegos activos en este chat.\n"
             "Inicia uno con /cinematrivia, /adivinapelicula o /emojipelicula"
         )
         return
     
-    game = active_games[chat_id]
-    
     if game['type'] == 'trivia':
         await update.message.reply_text(
             "💡 En trivia no hay pistas adicionales.\n"
@@ -334,6 +257,7 @@ async def cmd_pista(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Mostrar siguiente pista
         hints_used += 1
         game['hints_used'] = hints_used
+        await active_games.set_async(chat_id, game)
         
         next_hint = movie['hints'][hints_used]
         penalty = 5 if game['type'] == 'guess_movie' else 3
@@ -364,12 +288,11 @@ async def cmd_rendirse(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     user = update.effective_user
     
-    if chat_id not in active_games:
+    game = await active_games.get_async(chat_id)
+    if game is None:
         await update.message.reply_text("🚫 No hay juegos activos para abandonar.")
         return
     
-    game = active_games[chat_id]
-    
     if game['type'] == 'trivia':
         question = game['question']
         correct_answer = question['options'][question['correct']]
@@ -393,18 +316,19 @@ async def cmd_rendirse(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ¡Mejor suerte la próxima vez! 🍿
         """
     
-    # Actualizar estadísticas (juego jugado pero no ganado)
-    update_game_stats(user.id, user.username or user.first_name, game['type'], won=False)
+    # Eliminar juego antes de esperar a la base de datos
+    if await active_games.pop_async(chat_id) is None:
+        return  # Ya terminado (por otro mensaje u otro proceso)
     
-    # Eliminar juego
-    del active_games[chat_id]
+    # Actualizar estadísticas (juego jugado pero no ganado)
+    await update_game_stats_async(user.id, user.username or user.first_name, game['type'], won=False)
     
     await update.message.reply_text(surrender_text, parse_mode='Markdown')
 
 async def cmd_estadisticasjuegos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ver estadísticas de juegos del usuario"""
     user = update.effective_user
-    stats = get_user_game_stats(user.id)
+    stats = await get_user_game_stats_async(user.id)
     
     if not stats:
         await update.message.reply_text(
@@ -445,7 +369,7 @@ async def cmd_estadisticasjuegos(update: Update, context: ContextTypes.DEFAULT_T
 
 async def cmd_top_jugadores(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ranking de mejores jugadores"""
-    top_players = get_top_game_players()
+    top_players = await get_top_game_players_async()
     
     if not top_players:
         await update.message.reply_text("🎮 Aún no hay jugadores en el ranking.")
@@ -480,11 +404,11 @@ async def handle_trivia_callback(update: Update, context: ContextTypes.DEFAULT_T
         selected_answer = int(parts[1])
         chat_id = int(parts[2])
         
-        if chat_id not in active_games or active_games[chat_id]['type'] != 'trivia':
+        game = await active_games.get_async(chat_id)
+        if game is None or game['type'] != 'trivia':
             await query.edit_message_text("❌ Este juego ya no está activo.")
             return
         
-        game = active_games[chat_id]
         question = game['question']
         user = query.from_user
         
@@ -495,13 +419,18 @@ async def handle_trivia_callback(update: Update, context: ContextTypes.DEFAULT_T
         
         game['participants'].append(user.id)
         
+        # Eliminar juego después de primera respuesta (antes de cualquier await)
+        if await active_games.pop_async(chat_id) is None:
+            await query.edit_message_text("❌ Este juego ya no está activo.")
+            return
+        
         is_correct = selected_answer == question['correct']
         correct_answer = question['options'][question['correct']]
         
         if is_correct:
             # Ganar puntos
             points = question['points']
-            add_points(
+            await add_points_async(
                 user_id=user.id,
                 username=user.username or user.first_name,
                 points=points,
@@ -512,7 +441,7 @@ async def handle_trivia_callback(update: Update, context: ContextTypes.DEFAULT_T
             )
             
             # Actualizar estadísticas
-            update_game_stats(user.id, user.username or user.first_name, 'trivia', won=True, points=points)
+            await update_game_stats_async(user.id, user.username or user.first_name, 'trivia', won=True, points=points)
             
             result_text = f"""
 ✅ **¡CORRECTO!** 🎉
@@ -525,7 +454,7 @@ async def handle_trivia_callback(update: Update, context: ContextTypes.DEFAULT_T
             """
         else:
             # Actualizar estadísticas (participó pero no ganó)
-            update_game_stats(user.id, user.username or user.first_name, 'trivia', won=False)
+            await update_game_stats_async(user.id, user.username or user.first_name, 'trivia', won=False)
             
             result_text = f"""
 ❌ **Incorrecto** 😅
@@ -536,43 +465,46 @@ async def handle_trivia_callback(update: Update, context: ContextTypes.DEFAULT_T
 ¡Sigue intentando! 💪
             """
         
-        # Eliminar juego después de primera respuesta
-        del active_games[chat_id]
-        
         await query.edit_message_text(result_text, parse_mode='HTML')
         
     except Exception as e:
-        print(f"[ERROR] handle_trivia_callback: {e}")
+        logger.error("handle_trivia_callback: %s", e)
         await query.edit_message_text("❌ Error procesando respuesta.")
 
 async def handle_game_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manejar mensajes durante juegos activos"""
     if not update.message or not update.message.text:
         return
-    
+    await check_game_guess(update, context)
+
+async def check_game_guess(update: Update, context: ContextTypes.DEFAULT_TYPE, normalized: Optional[str] = None):
+    """Comprobar si el mensaje acierta el juego activo del chat.
+
+    normalized: el texto ya pasado por normalize_title (pipeline de texto)
+    """
     chat_id = update.effective_chat.id
     
-    if chat_id not in active_games:
+    game = await active_games.get_async(chat_id)
+    if game is None:
         return  # No hay juego activo
     
-    game = active_games[chat_id]
     user = update.effective_user
-    message_text = update.message.text.lower().strip()
     
     # Solo procesar juegos de adivinanza
     if game['type'] not in ['guess_movie', 'emoji_movie']:
         return
     
     movie = game['movie']
-    correct_titles = [
-        movie['title'].lower(),
-        movie['title'].lower().replace('el ', '').replace('la ', '').replace('los ', '').replace('las ', '')
-    ]
     
-    # Verificar si la respuesta es correcta
-    is_correct = any(title in message_text or message_text in title for title in correct_titles)
+    # Verificar si la respuesta es correcta (sin tildes ni artículos, con alias
+    # y tolerando errores de tipeo)
+    is_correct = catalogue.is_correct_guess(movie, update.message.text, normalized)
     
     if is_correct:
+        # Eliminar juego antes de esperar a la base de datos
+        if await active_games.pop_async(chat_id) is None:
+            return  # Otro mensaje (u otro proceso) acertó antes
+        
         # Calcular puntos
         base_points = 20 if game['type'] == 'guess_movie' else 15
         difficulty_bonus = movie['difficulty'] * (3 if game['type'] == 'guess_movie' else 2)
@@ -581,7 +513,7 @@ async def handle_game_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         total_points = max(5, base_points - (movie['difficulty'] * 2) + difficulty_bonus - hints_penalty)
         
         # Agregar puntos
-        add_points(
+        await add_points_async(
             user_id=user.id,
             username=user.username or user.first_name,
             points=total_points,
@@ -592,7 +524,7 @@ async def handle_game_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         
         # Actualizar estadísticas
-        update_game_stats(user.id, user.username or user.first_name, game['type'], won=True, points=total_points)
+        await update_game_stats_async(user.id, user.username or user.first_name, game['type'], won=True, points=total_points)
         
         # Respuesta de victoria
         victory_text = f"""
@@ -606,63 +538,48 @@ async def handle_game_message(update: Update, context: ContextTypes.DEFAULT_TYPE
 ¡Excelente! 🍿 ¡Juega de nuevo cuando quieras!
         """
         
-        # Eliminar juego
-        del active_games[chat_id]
-        
-        await update.message.reply_text(victory_text, parse_mode='HTML')
+        outbox.reply(update.message, victory_text, priority=HIGH, parse_mode='HTML')
 
 # FUNCIONES DE BASE DE DATOS
 
+def _apply_game_stats(cursor, results):
+    """UPSERT de cada resultado, en orden: las rachas se calculan en SQL.
+
+    En el SET de un UPSERT las columnas valen lo que tenía la fila antes del
+    cambio, así que current_streak + 1 es la racha que queda tras ganar.
+    """
+    cursor.executemany(
+        """INSERT INTO game_stats
+               (user_id, username, game_type, games_played, games_won, total_points,
+                best_streak, current_streak, last_played)
+           VALUES (?1, ?2, ?3, 1, ?4, ?5, ?4, ?4, CURRENT_TIMESTAMP)
+           ON CONFLICT(user_id, game_type) DO UPDATE SET
+               username = excluded.username,
+               games_played = games_played + 1,
+               games_won = games_won + ?4,
+               total_points = total_points + ?5,
+               current_streak = CASE WHEN ?4 THEN current_streak + 1 ELSE 0 END,
+               best_streak = MAX(best_streak, CASE WHEN ?4 THEN current_streak + 1 ELSE 0 END),
+               last_played = CURRENT_TIMESTAMP""",
+        results
+    )
+
+# Resultados de partidas: se confirman junto con el siguiente lote de puntos y
+# van al mismo journal, así que tras una caída no se separan de sus puntos
+game_stats_buffer = BatchBuffer("game_stats", _apply_game_stats, journaled=True)
+
 def update_game_stats(user_id: int, username: str, game_type: str, won: bool = False, points: int = 0):
-    """Actualizar estadísticas de juegos del usuario"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Obtener estadísticas actuales
-        cursor.execute(
-            "SELECT games_played, games_won, total_points, best_streak, current_streak FROM game_stats WHERE user_id = ? AND game_type = ?",
-            (user_id, game_type)
-        )
-        current = cursor.fetchone()
-        
-        if current:
-            games_played, games_won, total_points, best_streak, current_streak = current
-            games_played += 1
-            total_points += points
-            
-            if won:
-                games_won += 1
-                current_streak += 1
-                best_streak = max(best_streak, current_streak)
-            else:
-                current_streak = 0
-            
-            cursor.execute(
-                """UPDATE game_stats 
-                   SET games_played = ?, games_won = ?, total_points = ?, 
-                       best_streak = ?, current_streak = ?, last_played = CURRENT_TIMESTAMP
-                   WHERE user_id = ? AND game_type = ?""",
-                (games_played, games_won, total_points, best_streak, current_streak, user_id, game_type)
-            )
-        else:
-            # Crear nueva entrada
-            cursor.execute(
-                """INSERT INTO game_stats 
-                   (user_id, username, game_type, games_played, games_won, total_points, best_streak, current_streak)
-                   VALUES (?, ?, ?, 1, ?, ?, ?, ?)""",
-                (user_id, username, game_type, 1 if won else 0, points, 1 if won else 0, 1 if won else 0)
-            )
-        
-        conn.commit()
-        
-    except Exception as e:
-        print(f"[ERROR] update_game_stats: {e}")
-    finally:
-        conn.close()
+    """Registrar el resultado de una partida (se escribe en el siguiente flush)"""
+    game_stats_buffer.add((user_id, username, game_type, int(won), points))
+
+def _flush_game_stats():
+    """Confirmar los resultados pendientes antes de leer estadísticas"""
+    if len(game_stats_buffer):
+        flush_points()
 
 def get_user_game_stats(user_id: int) -> Dict:
     """Obtener estadísticas de juegos del usuario"""
+    _flush_game_stats()
     conn = get_connection()
     cursor = conn.cursor()
     
@@ -686,13 +603,14 @@ def get_user_game_stats(user_id: int) -> Dict:
         return stats
         
     except Exception as e:
-        print(f"[ERROR] get_user_game_stats: {e}")
+        logger.error("get_user_game_stats: %s", e)
         return {}
     finally:
         conn.close()
 
 def get_top_game_players(limit: int = 10) -> List[Tuple]:
     """Obtener ranking de mejores jugadores"""
+    _flush_game_stats()
     conn = get_connection()
     cursor = conn.cursor()
     
@@ -710,7 +628,17 @@ def get_top_game_players(limit: int = 10) -> List[Tuple]:
         return cursor.fetchall()
         
     except Exception as e:
-        print(f"[ERROR] get_top_game_players: {e}")
+        logger.error("get_top_game_players: %s", e)
         return []
     finally:
         conn.close()
+
+async def update_game_stats_async(user_id: int, username: str, game_type: str, won: bool = False, points: int = 0):
+    # Solo encola: no hace falta pasar por el executor
+    update_game_stats(user_id, username, game_type, won=won, points=points)
+
+async def get_user_game_stats_async(user_id: int) -> Dict:
+    return await run_db(get_user_game_stats, user_id)
+
+async def get_top_game_players_async(limit: int = 10) -> List[Tuple]:
+    return await run_db(get_top_game_players, limit)
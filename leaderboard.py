@@ -0,0 +1,91 @@
+# leaderboard.py - Ranking en memoria con consultas en tiempo logarítmico
+import threading
+from typing import Dict, List, Optional, Tuple
+from sortedcontainers import SortedList
+
+class Leaderboard:
+    """Ranking ordenado por puntos.
+
+    Cada usuario ocupa una entrada (-puntos, user_id) en una SortedList, así
+    que actualizar, pedir el top-K, la posición de un usuario o sus vecinos
+    cuesta O(log n) (más K elementos devueltos).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[int, str]] = {}   # user_id -> (puntos, username)
+        self._order = SortedList()                       # (-puntos, user_id)
+        self.total = 0                                   # suma de los puntos del ranking
+        self.warmed = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, rows):
+        """Cargar de golpe filas (user_id, username, puntos)"""
+        with self._lock:
+            self._entries = {}
+            keys = []
+            for user_id, username, points in rows:
+                if not points or points <= 0:
+                    continue
+                self._entries[user_id] = (points, username)
+                keys.append((-points, user_id))
+            self._order = SortedList(keys)
+            self.total = sum(points for points, _ in self._entries.values())
+            self.warmed = True
+
+    def update(self, user_id: int, username: str, points: int):
+        """Fijar el total de un usuario"""
+        with self._lock:
+            previous = self._entries.get(user_id)
+            if previous is not None:
+                if previous[0] == points:
+                    if previous[1] != username:
+                        self._entries[user_id] = (points, username)
+                    return
+                self._order.remove((-previous[0], user_id))
+                self.total -= previous[0]
+
+            if points > 0:
+                self._entries[user_id] = (points, username)
+                self._order.add((-points, user_id))
+                self.total += points
+            else:
+                self._entries.pop(user_id, None)
+
+    def top(self, k: int = 10) -> List[Tuple[int, str, int]]:
+        """Los k primeros como (user_id, username, puntos)"""
+        with self._lock:
+            return [
+                (user_id, self._entries[user_id][1], -neg_points)
+                for neg_points, user_id in self._order.islice(0, k)
+            ]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Posición (desde 1) del usuario, o None si no tiene puntos"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            return self._order.index((-entry[0], user_id)) + 1
+
+    def neighbors(self, user_id: int, n: int = 2) -> List[Tuple[int, int, str, int]]:
+        """Hasta n usuarios por encima y por debajo: (posición, user_id, username, puntos)"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return []
+            position = self._order.index((-entry[0], user_id))
+            start = max(0, position - n)
+            return [
+                (start + offset + 1, other_id, self._entries[other_id][1], -neg_points)
+                for offset, (neg_points, other_id) in enumerate(
+                    self._order.islice(start, position + n + 1)
+                )
+            ]
+
+    def points(self, user_id: int) -> int:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return entry[0] if entry else 0
@@ -0,0 +1,129 @@
+# log_config.py - Logging del bot: niveles por módulo, cola sin bloqueo y muestreo
+#
+# Variables de entorno:
+#   LOG_LEVEL                nivel raíz (INFO por defecto)
+#   LOG_LEVELS               niveles por módulo, p. ej. "hashtags=DEBUG,db=WARNING"
+#   LOG_FORMAT               "text" (por defecto) o "json" (una línea JSON por registro)
+#   LOG_DEBUG_SAMPLE_EVERY   con N > 1, solo se emite 1 de cada N registros DEBUG
+#                            por plantilla de mensaje
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Bibliotecas muy habladoras (httpx registra cada petición a Telegram en INFO)
+DEFAULT_MODULE_LEVELS = {
+    "httpx": "WARNING",
+}
+
+# Atributos estándar de LogRecord; el resto vienen de extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea con los campos de extra={...}"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DebugSamplingFilter(logging.Filter):
+    """Dejar pasar 1 de cada N registros DEBUG por (logger, plantilla).
+
+    Se evalúa antes de formatear, así que los descartados no cuestan nada más.
+    """
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = every
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG or self.every <= 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % self.every == 0
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler que solo resuelve el mensaje en el hilo que registra.
+
+    La fecha, el formato y los tracebacks se generan en el hilo escritor.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def parse_module_levels(spec: str) -> dict:
+    """"a=DEBUG,b=WARNING" -> {"a": "DEBUG", "b": "WARNING"}"""
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging():
+    """Configurar el logging del proceso (llamar una vez, al arrancar)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    # La escritura a stdout ocurre en el hilo del listener, no en el event loop
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(int(os.getenv("LOG_DEBUG_SAMPLE_EVERY", "1"))))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    module_levels = dict(DEFAULT_MODULE_LEVELS)
+    module_levels.update(parse_module_levels(os.getenv("LOG_LEVELS", "")))
+    for name, level in module_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Vaciar la cola y detener el hilo escritor"""
+    global _listener
+    listener = _listener
+    _listener = None
+    if listener is not None:
+        listener.stop()
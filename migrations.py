@@ -0,0 +1,181 @@
+# migrations.py - Migraciones versionadas del esquema de puntum.db
+import sqlite3
+import logging
+import db
+from db import get_connection, _level_sql
+from sistema_autorizacion import AUTHORIZED_CHAT_SQL, PENDING_REQUEST_SQL
+from decks import create_decks_table
+
+logger = logging.getLogger(__name__)
+
+def _rebuild_user_totals(cursor):
+    """Recalcular users desde points (users pasa a ser el acumulado autoritativo)"""
+    cursor.execute(
+        """UPDATE users SET
+                points = COALESCE((SELECT SUM(points) FROM points WHERE user_id = users.id), 0),
+                count = (SELECT COUNT(*) FROM points WHERE user_id = users.id)"""
+    )
+    cursor.execute(
+        """INSERT INTO users (id, username, points, count, created_at)
+           SELECT user_id, MAX(username), SUM(points), COUNT(*), MIN(timestamp)
+           FROM points
+           WHERE user_id NOT IN (SELECT id FROM users)
+           GROUP BY user_id"""
+    )
+    cursor.execute(f"UPDATE users SET level = {_level_sql('points')}")
+
+def _rebuild_chat_users(cursor):
+    """Recalcular chat_users desde points"""
+    cursor.execute("DELETE FROM chat_users")
+    cursor.execute(
+        """INSERT INTO chat_users (chat_id, user_id, username, points, count)
+           SELECT chat_id, user_id, username, total_points, total_count
+           FROM (
+               -- Con MAX(), SQLite toma username de la fila más reciente del grupo
+               SELECT chat_id, user_id, username, MAX(rowid),
+                      SUM(points) AS total_points, COUNT(*) AS total_count
+               FROM points
+               WHERE chat_id IS NOT NULL
+               GROUP BY chat_id, user_id
+           )"""
+    )
+
+def _rebuild_points_daily(cursor):
+    """Recalcular points_daily desde points"""
+    cursor.execute("DELETE FROM points_daily")
+    cursor.execute(
+        """INSERT INTO points_daily (chat_id, day, user_id, username, points, count)
+           SELECT chat_id, day, user_id, username, total_points, total_count
+           FROM (
+               SELECT COALESCE(chat_id, 0) AS chat_id, DATE(timestamp) AS day, user_id,
+                      username, MAX(rowid), SUM(points) AS total_points, COUNT(*) AS total_count
+               FROM points
+               GROUP BY 1, 2, 3
+           )"""
+    )
+
+def _recreate_game_decks(cursor):
+    """Mazos con semilla en vez de permutación afín (el estado de los mazos es desechable)"""
+    cursor.execute("DROP TABLE IF EXISTS game_decks")
+    create_decks_table(cursor)
+
+# (versión, descripción, pasos). Cada paso es SQL o una función que recibe el cursor.
+# Nunca modificar una migración ya publicada: añadir una nueva al final.
+MIGRATIONS = [
+    (1, "Índices de points para consultas por usuario y chat", [
+        "CREATE INDEX IF NOT EXISTS idx_points_user_time ON points (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_points_user_hashtag ON points (user_id, hashtag)",
+        "CREATE INDEX IF NOT EXISTS idx_points_user_challenge ON points (user_id, is_challenge_bonus, hashtag, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_points_chat_time ON points (chat_id, timestamp)",
+    ]),
+    (2, "Índice de users para el ranking", [
+        "CREATE INDEX IF NOT EXISTS idx_users_points ON users (points DESC)",
+    ]),
+    (3, "Índices de solicitudes de autorización", [
+        "CREATE INDEX IF NOT EXISTS idx_auth_requests_chat_status ON auth_requests (chat_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_auth_requests_status ON auth_requests (status, requested_at)",
+    ]),
+    (4, "Reconstruir los totales de users desde points", [
+        _rebuild_user_totals,
+    ]),
+    (5, "Acumulados por chat para los rankings de grupo", [
+        _rebuild_chat_users,
+    ]),
+    (6, "Cubetas diarias para los rankings por periodo", [
+        _rebuild_points_daily,
+        "CREATE INDEX IF NOT EXISTS idx_points_daily_day ON points_daily (day, user_id)",
+    ]),
+    (7, "Mazos barajados con semilla", [
+        _recreate_game_decks,
+    ]),
+]
+
+def get_schema_version(cursor) -> int:
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def run_migrations():
+    """Aplicar en orden las migraciones pendientes, cada una en su transacción"""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        current = get_schema_version(cursor)
+        conn.commit()
+
+        applied = 0
+        for version, description, steps in MIGRATIONS:
+            if version <= current:
+                continue
+
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error("Migración %s (%s) fallida: %s", version, description, e)
+                raise
+
+            applied += 1
+            logger.info("Migración %s aplicada: %s", version, description)
+
+        if applied:
+            cursor.execute("PRAGMA optimize")
+        logger.info("✅ Esquema en versión %s (%s migraciones aplicadas)", max(current, MIGRATIONS[-1][0]), applied)
+    finally:
+        conn.close()
+
+# Consultas calientes con parámetros de ejemplo para EXPLAIN QUERY PLAN. El SQL
+# es el mismo objeto que ejecutan db.py y sistema_autorizacion.py: si una
+# consulta cambia, el plan que se comprueba cambia con ella.
+HOT_QUERIES = [
+    ("get_user_total_points", db.USER_TOTAL_SQL, (1,)),
+    *((f"get_user_stats: {name}", sql, (1,)) for name, sql in db.USER_STATS_SQL.items()),
+    ("get_top10", db.TOP10_SQL, ()),
+    ("ranking del chat", db.CHAT_RANKING_SQL, (-1,)),
+    ("total del usuario en el chat", db.CHAT_USER_POINTS_SQL, (-1, 1)),
+    ("ranking del periodo en el chat", db.window_top_sql(by_chat=True), (-1, "2024-01-01", "2024-01-07", 10)),
+    ("ranking global del periodo", db.window_top_sql(by_chat=False), ("2024-01-01", "2024-01-07", 10)),
+    ("is_chat_authorized", AUTHORIZED_CHAT_SQL, (-1,)),
+    ("solicitud pendiente", PENDING_REQUEST_SQL, (-1,)),
+]
+
+def check_query_plans() -> list:
+    """Devolver las consultas calientes que recorren una tabla completa"""
+    # Conexión propia: los planes cacheados del pool pueden ser previos a los índices
+    conn = sqlite3.connect(db.DB_PATH)
+    full_scans = []
+    try:
+        for name, sql, params in HOT_QUERIES:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            subqueries = set()
+            for row in plan:
+                detail = row[-1]
+                # Recorrer el resultado de una subconsulta no toca ninguna tabla
+                if detail.startswith(("CO-ROUTINE ", "MATERIALIZE ")):
+                    subqueries.add(detail.split(" ", 1)[1])
+                # "SCAN tabla" sin índice es un recorrido completo
+                elif (detail.startswith("SCAN ") and " USING " not in detail
+                      and detail.split(" ")[1] not in subqueries):
+                    full_scans.append((name, detail))
+    finally:
+        conn.close()
+
+    for name, detail in full_scans:
+        logger.warning("Consulta sin índice (%s): %s", name, detail)
+    return full_scans
@@ -0,0 +1,271 @@
+# outbox.py - Cola de mensajes salientes respetando los límites de Telegram
+#
+# Los handlers encolan y siguen: el envío (y sus reintentos) ocurre en una
+# tarea aparte. Límites (GCRA, como handlers/rate_limiter.py):
+#   global            25 mensajes/s, ráfagas de 5 (nunca más de 30 en un segundo)
+#   chat privado      1 mensaje/s, ráfagas de 3
+#   grupo             1 mensaje cada 3 s, ráfagas de 3 (~20/min)
+# Tres carriles de prioridad; dentro de un chat el orden se mantiene.
+import time
+import asyncio
+import logging
+from collections import deque
+from itertools import islice
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from handlers.rate_limiter import MemoryBackend
+
+logger = logging.getLogger(__name__)
+
+HIGH, NORMAL, LOW = 0, 1, 2   # resultados de juegos y logros / respuestas / avisos programados
+
+# (intervalo en segundos, ráfaga)
+GLOBAL_RATE = (1 / 25, 5)
+PRIVATE_CHAT_RATE = (1.0, 3)
+GROUP_CHAT_RATE = (3.0, 3)
+
+OUTBOX_LANE_SIZE = 1000   # por carril; al llenarse se descarta el más antiguo
+OUTBOX_SCAN_LIMIT = 64    # mensajes mirados por carril buscando un chat libre
+OUTBOX_MAX_RETRIES = 3
+
+def _gcra_params(rate):
+    interval, burst = rate
+    return interval, (burst - 1) * interval
+
+class _Outgoing:
+    __slots__ = ("chat_id", "send", "future", "priority", "attempts")
+
+    def __init__(self, chat_id, send, future, priority):
+        self.chat_id = chat_id
+        self.send = send
+        self.future = future
+        self.priority = priority
+        self.attempts = 0
+
+class OutboundDispatcher:
+    """Envía los mensajes encolados en orden de prioridad y sin pasar los límites.
+
+    send_message()/reply() devuelven un Future con el Message enviado (o None
+    si el envío falló; el error queda en el log). No hace falta esperarlo.
+    """
+
+    def __init__(self):
+        self._lanes = [deque(), deque(), deque()]
+        self._limits = MemoryBackend()
+        self._hold = {}        # chat_id -> monotonic hasta el que no se envía (RetryAfter)
+        self._inflight = set() # chats con un envío en curso (mantiene el orden)
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return sum(len(lane) for lane in self._lanes)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Arrancar el envío en el loop actual (desde post_init)"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """Intentar vaciar la cola durante timeout segundos y detener la tarea"""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (len(self) or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        self._task = None
+        if len(self):
+            logger.warning("Cola de salida detenida con %s mensajes sin enviar", len(self))
+
+    # Encolar
+
+    def submit(self, chat_id: int, send, priority: int = NORMAL) -> asyncio.Future:
+        """send: función sin argumentos que devuelve la corrutina de envío"""
+        if self._task is None:
+            # Sin dispatcher (scripts, pruebas): enviar directamente. Nadie
+            # espera el Future, así que el error se registra aquí
+            future = asyncio.ensure_future(send())
+            future.add_done_callback(lambda done: self._log_direct_failure(chat_id, done))
+            return future
+
+        future = self._loop.create_future()
+        lane = self._lanes[priority]
+        if len(lane) >= OUTBOX_LANE_SIZE:
+            dropped = lane.popleft()
+            dropped.future.cancel()
+            logger.warning("Cola de salida llena (prioridad %s): descartado un mensaje para %s", priority, dropped.chat_id)
+        lane.append(_Outgoing(chat_id, send, future, priority))
+        self._wakeup.set()
+        return future
+
+    @staticmethod
+    def _log_direct_failure(chat_id: int, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Envío directo al chat %s fallido: %s", chat_id, future.exception())
+
+    def send_message(self, bot, chat_id: int, text: str, priority: int = NORMAL, **kwargs) -> asyncio.Future:
+        return self.submit(chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), priority)
+
+    def reply(self, message, text: str, priority: int = NORMAL, **kwargs) -> asyncio.Future:
+        return self.submit(message.chat_id, lambda: message.reply_text(text, **kwargs), priority)
+
+    # Envío
+
+    def _chat_rate(self, chat_id: int):
+        return _gcra_params(GROUP_CHAT_RATE if chat_id < 0 else PRIVATE_CHAT_RATE)
+
+    def _next(self, now: float):
+        """(siguiente mensaje enviable, o None y segundos hasta reintentar)"""
+        wait = None
+        for lane in self._lanes:
+            blocked = set()
+            for index, item in enumerate(islice(lane, OUTBOX_SCAN_LIMIT)):
+                chat_id = item.chat_id
+                if chat_id in blocked or chat_id in self._inflight:
+                    continue
+                hold = self._hold.get(chat_id)
+                if hold is not None:
+                    if hold > now:
+                        blocked.add(chat_id)
+                        wait = hold - now if wait is None else min(wait, hold - now)
+                        continue
+                    del self._hold[chat_id]
+
+                # Consultar el chat sin consumir: su cupo solo se gasta si el
+                # límite global también deja enviar
+                chat_rate = self._chat_rate(chat_id)
+                allowed, chat_wait = self._limits.peek(("chat", chat_id), now, *chat_rate)
+                if not allowed:
+                    blocked.add(chat_id)
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+                    continue
+
+                allowed, global_wait = self._limits.acquire("global", now, *_gcra_params(GLOBAL_RATE))
+                if not allowed:
+                    return None, global_wait
+                self._limits.acquire(("chat", chat_id), now, *chat_rate)
+                del lane[index]
+                return item, 0.0
+        return None, wait
+
+    async def _run(self):
+        while True:
+            try:
+                item, wait = self._next(time.monotonic())
+            except Exception:
+                logger.exception("Error en la cola de salida")
+                item, wait = None, 1.0
+            if item is not None:
+                self._inflight.add(item.chat_id)
+                asyncio.create_task(self._deliver(item))
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, item: _Outgoing):
+        try:
+            result = await item.send()
+            if not item.future.done():
+                item.future.set_result(result)
+        except RetryAfter as e:
+            # Telegram pide esperar: se pausa ese chat y el mensaje vuelve al frente
+            retry_after = e.retry_after
+            if hasattr(retry_after, "total_seconds"):   # timedelta en versiones recientes de PTB
+                retry_after = retry_after.total_seconds()
+            logger.warning("RetryAfter %ss en el chat %s", retry_after, item.chat_id)
+            self._hold[item.chat_id] = time.monotonic() + float(retry_after)
+            self._lanes[item.priority].appendleft(item)
+        except (BadRequest, Forbidden) as e:
+            # BadRequest hereda de NetworkError, pero reintentar no lo arregla
+            # (chat inexistente, bot expulsado, texto inválido): se descarta
+            logger.error("Envío al chat %s rechazado: %s", item.chat_id, e)
+            if not item.future.done():
+                item.future.set_result(None)
+        except TimedOut as e:
+            # Puede haberse entregado igualmente: no se reintenta para no duplicar
+            logger.error("Envío al chat %s sin confirmar: %s", item.chat_id, e)
+            if not item.future.done():
+                item.future.set_result(None)
+        except NetworkError as e:
+            item.attempts += 1
+            if item.attempts < OUTBOX_MAX_RETRIES:
+                self._hold[item.chat_id] = time.monotonic() + 2 ** item.attempts
+                self._lanes[item.priority].appendleft(item)
+            else:
+                logger.error("Envío al chat %s fallido tras %s intentos: %s", item.chat_id, item.attempts, e)
+                if not item.future.done():
+                    item.future.set_result(None)
+        except Exception as e:
+            logger.error("Envío al chat %s fallido: %s", item.chat_id, e)
+            if not item.future.done():
+                item.future.set_result(None)
+        finally:
+            self._inflight.discard(item.chat_id)
+            self._wakeup.set()
+
+outbox = OutboundDispatcher()
+
+class ReplyCoalescer:
+    """Junta en un solo mensaje por chat las respuestas que llegan en ráfaga.
+
+    La primera respuesta en un chat tranquilo sale enseguida (send_single).
+    Si llega otra antes de window segundos, a partir de ahí se acumulan por
+    clave (merge) y al cerrar la ventana se envía un único resumen (render).
+    Con max_items claves distintas el resumen sale antes de tiempo.
+    """
+
+    def __init__(self, window: float, merge, render, max_items: int = 25,
+                 priority: int = NORMAL, dispatcher: OutboundDispatcher = None):
+        self.window = window
+        self.merge = merge
+        self.render = render
+        self.max_items = max_items
+        self.priority = priority
+        self.dispatcher = dispatcher or outbox
+        self._last_sent = {}   # chat_id -> monotonic de la última respuesta enviada
+        self._pending = {}     # chat_id -> (bot, {clave: entrada}, timer)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def submit(self, bot, chat_id: int, key, entry, send_single):
+        now = time.monotonic()
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            if now - self._last_sent.get(chat_id, float("-inf")) >= self.window:
+                self._last_sent[chat_id] = now
+                send_single()
+                return
+            timer = asyncio.get_running_loop().call_later(self.window, self._flush, chat_id)
+            pending = self._pending[chat_id] = (bot, {}, timer)
+
+        entries = pending[1]
+        entries[key] = self.merge(entries.get(key), entry)
+        if len(entries) >= self.max_items:
+            pending[2].cancel()
+            self._flush(chat_id)
+
+    def _flush(self, chat_id: int):
+        pending = self._pending.pop(chat_id, None)
+        if pending is None:
+            return
+        bot, entries, _ = pending
+        now = time.monotonic()
+        self._last_sent[chat_id] = now
+        # Olvidar chats tranquilos para que el dict no crezca sin límite
+        if len(self._last_sent) > 10_000:
+            self._last_sent = {c: t for c, t in self._last_sent.items() if now - t < self.window}
+        self.dispatcher.send_message(bot, chat_id, self.render(list(entries.values())),
+                                     priority=self.priority, parse_mode='HTML')
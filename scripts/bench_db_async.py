@@ -0,0 +1,76 @@
+# scripts/bench_db_async.py - Actualizaciones por segundo y bloqueos del event loop
+#
+# Simula CHATS chats que a la vez suman puntos y piden /mistats, primero con
+# las funciones síncronas de db.py llamadas desde el loop (como hacían los
+# handlers antes) y después con las versiones async. Una tarea sonda mide
+# cuánto tarda el loop en despertar de un sleep de 1 ms.
+#
+#   python scripts/bench_db_async.py [chats] [mensajes por chat]
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+USERS = 500
+REPLY_LATENCY = 0.002   # respuesta de Telegram simulada
+
+async def probe(stalls, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(time.perf_counter() - start - 0.001)
+
+async def chat_sync(chat, messages):
+    for i in range(messages):
+        user_id = (chat * 7 + i) % USERS
+        db.add_points(user_id, f"u{user_id}", 3, "#cine", chat_id=-chat)
+        db.get_user_stats(user_id)
+        await asyncio.sleep(REPLY_LATENCY)
+
+async def chat_async(chat, messages):
+    for i in range(messages):
+        user_id = (chat * 7 + i) % USERS
+        await db.add_points_async(user_id, f"u{user_id}", 3, "#cine", chat_id=-chat)
+        await db.get_user_stats_async(user_id)
+        await asyncio.sleep(REPLY_LATENCY)
+
+async def run(chat, chats, messages):
+    stalls = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(stalls, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(c, messages) for c in range(chats)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+
+    stalls.sort()
+    print(f"  {chat.__name__:10} {chats * messages / elapsed:7.0f} actualizaciones/s   "
+          f"loop bloqueado p50 {stalls[len(stalls) // 2] * 1000:.2f} ms  "
+          f"p99 {stalls[int(len(stalls) * 0.99)] * 1000:.2f} ms  máx {stalls[-1] * 1000:.1f} ms")
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "puntum.db")
+        db.create_tables()
+        # Historial previo: las estadísticas tienen filas que leer
+        for user_id in range(USERS):
+            for _ in range(40):
+                db.add_points(user_id, f"u{user_id}", 3, "#cine", chat_id=-(user_id % 20))
+        db.flush_points()
+
+        print(f"{chats} chats x {messages} mensajes")
+        asyncio.run(run(chat_sync, chats, messages))
+        asyncio.run(run(chat_async, chats, messages))
+        db.close_connections()
+
+if __name__ == "__main__":
+    main()
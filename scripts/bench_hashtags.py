@@ -0,0 +1,79 @@
+# scripts/bench_hashtags.py - Microbenchmark de hashtags.find_hashtags_in_message
+#
+# Compara el matcher de una sola pasada con la versión anterior (tres regex y
+# unicodedata por cada hashtag; sin sus print, que la harían aún más lenta)
+# sobre un corpus de mensajes parecidos a los de los grupos.
+#
+#   python scripts/bench_hashtags.py [mensajes]
+import os
+import re
+import sys
+import time
+import random
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hashtags import VALID_HASHTAGS, find_hashtags_in_message
+
+LEGACY_PATTERNS = [
+    r'#([\w\u00C0-\u024F\u1E00-\u1EFF]+)',
+    r'#\s+([\w\u00C0-\u024F\u1E00-\u1EFF]+)',
+    r'#([\w\u00C0-\u024F\u1E00-\u1EFF]+)(?=\s|$|[.,;:!?])',
+]
+
+def legacy_normalize(text):
+    normalized = unicodedata.normalize('NFD', text)
+    return ''.join(c for c in normalized if unicodedata.category(c) != 'Mn').lower()
+
+def legacy_find_hashtags(text):
+    found = []
+    for pattern in LEGACY_PATTERNS:
+        for word in re.findall(pattern, text, re.IGNORECASE | re.UNICODE):
+            word = word.strip()
+            normalized = legacy_normalize(word)
+            if normalized in VALID_HASHTAGS:
+                found.append((f"#{word}", VALID_HASHTAGS[normalized]))
+            else:
+                # Sugerencias de depuración que la versión anterior calculaba siempre
+                [h for h in VALID_HASHTAGS if h.startswith(normalized[:3])]
+    unique, seen = [], set()
+    for hashtag, points in found:
+        key = legacy_normalize(hashtag)
+        if key not in seen:
+            unique.append((hashtag, points))
+            seen.add(key)
+    return unique
+
+WORDS = ("la película me pareció una obra maestra del cine argentino de los ochenta, "
+         "gran dirección y fotografía; la recomiendo sin dudar aunque el final es flojo").split()
+TAGS = list(VALID_HASHTAGS) + ["Reseña", "CRÍTICA", "recomendación", "noexiste", "cine2024"]
+
+def corpus(n, seed=7):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(n):
+        words = rng.choices(WORDS, k=rng.randint(3, 60))
+        for _ in range(rng.choice((0, 1, 1, 2, 3))):
+            tag = rng.choice(TAGS)
+            words.insert(rng.randrange(len(words) + 1), rng.choice(("#", "# ")) + tag)
+        messages.append(" ".join(words))
+    return messages
+
+def measure(find, messages):
+    start = time.perf_counter()
+    for text in messages:
+        find(text)
+    return (time.perf_counter() - start) / len(messages)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    messages = corpus(n)
+    legacy = measure(legacy_find_hashtags, messages)
+    current = measure(find_hashtags_in_message, messages)
+    print(f"{n} mensajes")
+    print(f"  versión anterior   {legacy * 1e6:7.2f} us/mensaje")
+    print(f"  una sola pasada    {current * 1e6:7.2f} us/mensaje  (x{legacy / current:.1f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# scripts/bench_rate_limiter.py - Comprobaciones por segundo con 100k usuarios activos
+#
+# Compara el limitador GCRA de SecurityManager (backend en memoria y SQLite)
+# con la versión anterior, que guardaba una lista de timestamps por usuario y
+# acción y la reconstruía en cada llamada. También mide la memoria de cada uno.
+#
+#   python scripts/bench_rate_limiter.py [usuarios]
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from handlers.rate_limiter import MemoryBackend, SQLiteBackend
+from handlers.security import SecurityManager
+
+class LegacyLimiter:
+    """Ventana deslizante con una lista por (usuario, acción), como antes"""
+
+    def __init__(self, action_limits):
+        self.action_limits = action_limits
+        self.rate_limits = {}
+
+    def is_rate_limited(self, user_id: int, action: str) -> bool:
+        current_time = time.time()
+        user_actions = self.rate_limits.setdefault(user_id, {}).setdefault(action, [])
+        max_count, window = self.action_limits.get(action, (10, 60))
+        cutoff = current_time - window
+        user_actions[:] = [t for t in user_actions if t > cutoff]
+        if len(user_actions) >= max_count:
+            return True
+        user_actions.append(current_time)
+        return False
+
+def checks_per_second(check, users, ids):
+    for user_id in range(users):   # todos los usuarios activos antes de medir
+        check(user_id)
+    start = time.perf_counter()
+    for user_id in ids:
+        check(user_id)
+    return len(ids) / (time.perf_counter() - start)
+
+def memory_mb(make, users, uses=3):
+    tracemalloc.start()
+    limiter = make()
+    for user_id in range(users):
+        for _ in range(uses):
+            limiter.is_rate_limited(user_id, 'message_send')
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return current / 1024 / 1024
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    logging.disable(logging.WARNING)
+    rng = random.Random(7)
+    ids = [rng.randrange(users) for _ in range(300_000)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        limit = SecurityManager().action_limits
+        candidates = [
+            ("versión anterior (listas)", LegacyLimiter(limit), ids),
+            ("GCRA en memoria", SecurityManager(rate_limit_backend=MemoryBackend()), ids),
+            ("GCRA en SQLite", SecurityManager(rate_limit_backend=SQLiteBackend(os.path.join(tmp, "rl.db"))),
+             ids[:100_000]),
+        ]
+        print(f"{users:,} usuarios activos")
+        for name, limiter, sample in candidates:
+            rate = checks_per_second(lambda u: limiter.is_rate_limited(u, 'message_send'), users, sample)
+            print(f"  {name:27} {rate:12,.0f} comprobaciones/s")
+
+        # Usuarios al límite: la lista llena se recorre entera en cada llamada
+        hot = [user_id for _ in range(100) for user_id in range(1000)]
+        for name, limiter, _ in candidates[:2]:
+            rate = checks_per_second(lambda u: limiter.is_rate_limited(u, 'message_send'), 0, hot)
+            print(f"  {name:27} {rate:12,.0f} comprobaciones/s (1000 usuarios al límite)")
+
+        memory = SecurityManager(rate_limit_backend=MemoryBackend())
+        checks_per_second(lambda u: memory.is_rate_limited(u, 'message_send'), users, [])
+        swept = memory.rate_limiter.sweep(time.time() + 61)
+        print(f"  claves tras 61 s sin uso: {len(memory.rate_limiter.backend)} ({swept} barridas)")
+
+    print(f"memoria, {users:,} usuarios x 3 usos")
+    print(f"  versión anterior {memory_mb(lambda: LegacyLimiter(limit), users):6.1f} MB")
+    print(f"  GCRA             {memory_mb(lambda: SecurityManager(rate_limit_backend=MemoryBackend()), users):6.1f} MB")
+
+if __name__ == "__main__":
+    main()
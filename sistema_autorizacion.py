@@ -1,112 +1,236 @@
+import re
 import sqlite3
+import time
 import logging
 from functools import wraps
 from telegram import Update
 from telegram.ext import ContextTypes
-from db import get_connection
+from outbox import outbox
+from db import get_connection, get_read_connection, run_db, reconcile_user_totals_async
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuración - ID del administrador principal
 ADMIN_USER_ID = 5548909327  # Cambiar por tu user_id de Telegram
 
+# Caché de autorización: chat_id -> (autorizado, expira_en)
+AUTH_CACHE_TTL = 300            # segundos para chats autorizados
+AUTH_CACHE_NEGATIVE_TTL = 60    # segundos para chats no autorizados
+_auth_cache = {}
+
+# Consultas calientes: migrations.check_query_plans comprueba que usen índices
+AUTHORIZED_CHAT_SQL = "SELECT 1 FROM authorized_chats WHERE chat_id = ? AND status = 'active'"
+PENDING_REQUEST_SQL = "SELECT 1 FROM auth_requests WHERE chat_id = ? AND status = 'pending'"
+
 def create_auth_tables():
     """Crear tablas para el sistema de autorización"""
     conn = get_connection()
-    cursor = conn.cursor()
+    try:
+        cursor = conn.cursor()
     
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS authorized_chats (
-            chat_id INTEGER PRIMARY KEY,
-            chat_title TEXT,
-            authorized_by INTEGER,
-            authorized_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'active'
-        )
-    """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS authorized_chats (
+                chat_id INTEGER PRIMARY KEY,
+                chat_title TEXT,
+                authorized_by INTEGER,
+                authorized_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                status TEXT DEFAULT 'active'
+            )
+        """)
     
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS auth_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER,
-            chat_title TEXT,
-            requested_by INTEGER,
-            requester_username TEXT,
-            requested_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'pending'
-        )
-    """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS auth_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                chat_title TEXT,
+                requested_by INTEGER,
+                requester_username TEXT,
+                requested_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                status TEXT DEFAULT 'pending'
+            )
+        """)
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+    finally:
+        conn.close()
     logger.info("✅ Tablas de autorización creadas")
 
+def _cache_authorization(chat_id: int, authorized: bool):
+    ttl = AUTH_CACHE_TTL if authorized else AUTH_CACHE_NEGATIVE_TTL
+    _auth_cache[chat_id] = (authorized, time.monotonic() + ttl)
+
+def _cached_authorization(chat_id: int):
+    """True/False si hay una entrada vigente en caché, None si no"""
+    entry = _auth_cache.get(chat_id)
+    if entry is None:
+        return None
+    authorized, expires_at = entry
+    if time.monotonic() >= expires_at:
+        _auth_cache.pop(chat_id, None)
+        return None
+    return authorized
+
+def invalidate_auth_cache(chat_id: int = None):
+    """Olvidar la autorización cacheada de un chat (o de todos)"""
+    if chat_id is None:
+        _auth_cache.clear()
+    else:
+        _auth_cache.pop(chat_id, None)
+
+def warm_auth_cache():
+    """Cargar de una vez los chats autorizados (al iniciar el bot)"""
+    conn = get_read_connection()
+    try:
+        rows = conn.execute(
+            "SELECT chat_id FROM authorized_chats WHERE status = 'active'"
+        ).fetchall()
+    finally:
+        conn.close()
+    for (chat_id,) in rows:
+        _cache_authorization(chat_id, True)
+    logger.info("✅ Caché de autorización cargada (%s chats)", len(rows))
+
 def is_chat_authorized(chat_id: int) -> bool:
     """Verificar si un chat está autorizado"""
     # Permitir chats privados siempre
     if chat_id > 0:
         return True
-        
+
+    cached = _cached_authorization(chat_id)
+    if cached is not None:
+        return cached
+
     try:
-        conn = get_connection()
+        conn = get_read_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM authorized_chats WHERE chat_id = ? AND status = 'active'",
-            (chat_id,)
-        )
+        cursor.execute(AUTHORIZED_CHAT_SQL, (chat_id,))
         result = cursor.fetchone()
         conn.close()
-        
+
+        _cache_authorization(chat_id, bool(result))
         return bool(result)
     except Exception as e:
-        logger.error(f"Error verificando autorización: {e}")
+        # Los errores no se cachean: se reintenta en el siguiente mensaje
+        logger.error("Error verificando autorización: %s", e)
         return False
 
+async def is_chat_authorized_async(chat_id: int) -> bool:
+    """Versión awaitable de is_chat_authorized (sin hilo si está en caché)"""
+    if chat_id > 0:
+        return True
+    cached = _cached_authorization(chat_id)
+    if cached is not None:
+        return cached
+    return await run_db(is_chat_authorized, chat_id)
+
 def authorize_chat(chat_id: int, chat_title: str, authorized_by: int):
     """Autorizar un chat"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO authorized_chats 
-            (chat_id, chat_title, authorized_by, authorized_at, status)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP, 'active')
-        """, (chat_id, chat_title, authorized_by))
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO authorized_chats 
+                (chat_id, chat_title, authorized_by, authorized_at, status)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP, 'active')
+            """, (chat_id, chat_title, authorized_by))
         
-        # Marcar solicitud como aprobada
-        cursor.execute("""
-            UPDATE auth_requests 
-            SET status = 'approved' 
-            WHERE chat_id = ? AND status = 'pending'
-        """, (chat_id,))
+            # Marcar solicitud como aprobada
+            cursor.execute("""
+                UPDATE auth_requests 
+                SET status = 'approved' 
+                WHERE chat_id = ? AND status = 'pending'
+            """, (chat_id,))
         
+            conn.commit()
+        finally:
+            conn.close()
+        _cache_authorization(chat_id, True)
+        logger.info("Chat %s autorizado exitosamente", chat_id)
+    except Exception as e:
+        invalidate_auth_cache(chat_id)
+        logger.error("Error autorizando chat: %s", e)
+
+def create_auth_request(chat_id: int, chat_title: str, requested_by: int, requester: str) -> bool:
+    """Registrar una solicitud; False si ya hay una pendiente para el chat"""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(PENDING_REQUEST_SQL, (chat_id,))
+        if cursor.fetchone():
+            return False
+        cursor.execute("""
+            INSERT INTO auth_requests 
+            (chat_id, chat_title, requested_by, requester_username)
+            VALUES (?, ?, ?, ?)
+        """, (chat_id, chat_title, requested_by, requester))
         conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def get_pending_request(chat_id: int):
+    """(chat_title, requester_username) de la solicitud pendiente, o None"""
+    conn = get_read_connection()
+    try:
+        return conn.execute("""
+            SELECT chat_title, requester_username 
+            FROM auth_requests 
+            WHERE chat_id = ? AND status = 'pending'
+        """, (chat_id,)).fetchone()
+    finally:
+        conn.close()
+
+def get_pending_requests():
+    conn = get_read_connection()
+    try:
+        return conn.execute("""
+            SELECT chat_id, chat_title, requester_username, requested_at
+            FROM auth_requests 
+            WHERE status = 'pending'
+            ORDER BY requested_at ASC
+        """).fetchall()
+    finally:
+        conn.close()
+
+def get_auth_counts():
+    """(grupos autorizados, solicitudes pendientes)"""
+    conn = get_read_connection()
+    try:
+        authorized_count = conn.execute(
+            "SELECT COUNT(*) FROM authorized_chats WHERE status = 'active'"
+        ).fetchone()[0]
+        pending_count = conn.execute(
+            "SELECT COUNT(*) FROM auth_requests WHERE status = 'pending'"
+        ).fetchone()[0]
+        return authorized_count, pending_count
+    finally:
         conn.close()
-        logger.info(f"Chat {chat_id} autorizado exitosamente")
-    except Exception as e:
-        logger.error(f"Error autorizando chat: {e}")
+
+async def check_authorized(update: Update) -> bool:
+    """True si el chat puede usar el bot; si es un grupo sin autorizar, lo avisa"""
+    chat_id = update.effective_chat.id
+    
+    if not await is_chat_authorized_async(chat_id):
+        if chat_id < 0:  # Es un grupo
+            try:
+                await update.message.reply_text(
+                    "❌ Este grupo no está autorizado para usar el bot.\n"
+                    "📝 Usa /solicitar para pedir autorización."
+                )
+            except Exception as e:
+                logger.error("Error enviando mensaje de no autorización: %s", e)
+            return False
+        else:  # Chat privado - siempre permitido
+            pass
+    return True
 
 def auth_required(func):
     """Decorador para requerir autorización en comandos"""
     @wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        chat_id = update.effective_chat.id
-        
-        if not is_chat_authorized(chat_id):
-            if chat_id < 0:  # Es un grupo
-                try:
-                    await update.message.reply_text(
-                        "❌ Este grupo no está autorizado para usar el bot.\n"
-                        "📝 Usa /solicitar para pedir autorización."
-                    )
-                except Exception as e:
-                    logger.error(f"Error enviando mensaje de no autorización: {e}")
-                return
-            else:  # Chat privado - siempre permitido
-                pass
-        
+        if not await check_authorized(update):
+            return
         return await func(update, context)
     return wrapper
 
@@ -115,7 +239,7 @@ async def cmd_solicitar_autorizacion(update: Update, context: ContextTypes.DEFAU
     chat = update.effective_chat
     user = update.effective_user
     
-    logger.info(f"Solicitud de autorización iniciada por {user.id} en chat {chat.id}")
+    logger.info("Solicitud de autorización iniciada por %s en chat %s", user.id, chat.id)
     
     # Solo funciona en grupos
     if chat.type == 'private':
@@ -125,45 +249,31 @@ async def cmd_solicitar_autorizacion(update: Update, context: ContextTypes.DEFAU
                 "Este comando solo funciona en grupos."
             )
         except Exception as e:
-            logger.error(f"Error enviando mensaje de chat privado: {e}")
+            logger.error("Error enviando mensaje de chat privado: %s", e)
         return
     
     # Verificar si ya está autorizado
-    if is_chat_authorized(chat.id):
+    if await is_chat_authorized_async(chat.id):
         try:
             await update.message.reply_text("✅ Este grupo ya está autorizado.")
         except Exception as e:
-            logger.error(f"Error enviando mensaje de ya autorizado: {e}")
+            logger.error("Error enviando mensaje de ya autorizado: %s", e)
         return
     
     try:
-        # Verificar si ya hay una solicitud pendiente
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM auth_requests WHERE chat_id = ? AND status = 'pending'",
-            (chat.id,)
+        # Crear la solicitud salvo que ya haya una pendiente
+        created = await run_db(
+            create_auth_request, chat.id, chat.title or "Sin título",
+            user.id, user.username or user.first_name or "Sin nombre"
         )
-        
-        if cursor.fetchone():
-            conn.close()
+        if not created:
             await update.message.reply_text(
                 "⏳ Ya hay una solicitud pendiente para este grupo.\n"
                 "Por favor espera a que sea revisada."
             )
-            logger.info(f"Solicitud duplicada rechazada para chat {chat.id}")
+            logger.info("Solicitud duplicada rechazada para chat %s", chat.id)
             return
         
-        # Crear nueva solicitud
-        cursor.execute("""
-            INSERT INTO auth_requests 
-            (chat_id, chat_title, requested_by, requester_username)
-            VALUES (?, ?, ?, ?)
-        """, (chat.id, chat.title or "Sin título", user.id, user.username or user.first_name or "Sin nombre"))
-        
-        conn.commit()
-        conn.close()
-        
         # Enviar mensaje de confirmación
         mensaje_confirmacion = (
             "✅ Solicitud de autorización enviada.\n"
@@ -173,12 +283,13 @@ async def cmd_solicitar_autorizacion(update: Update, context: ContextTypes.DEFAU
             "⏳ Espera a que un administrador la revise."
         )
         
-        await update.message.reply_text(
+        outbox.reply(
+            update.message,
             mensaje_confirmacion,
             parse_mode='HTML'
         )
         
-        logger.info(f"Solicitud creada exitosamente para chat {chat.id}")
+        logger.info("Solicitud creada exitosamente para chat %s", chat.id)
         
         # Notificar al administrador si está configurado
         if ADMIN_USER_ID:
@@ -191,22 +302,19 @@ async def cmd_solicitar_autorizacion(update: Update, context: ContextTypes.DEFAU
                     f"▫️ Para aprobar: /aprobar {chat.id}"
                 )
                 
-                await context.bot.send_message(
-                    chat_id=ADMIN_USER_ID,
-                    text=mensaje_admin
-                )
-                logger.info(f"Notificación enviada al administrador {ADMIN_USER_ID}")
+                outbox.send_message(context.bot, ADMIN_USER_ID, mensaje_admin)
+                logger.info("Notificación encolada para el administrador %s", ADMIN_USER_ID)
             except Exception as e:
-                logger.error(f"Error notificando al administrador: {e}")
+                logger.error("Error notificando al administrador: %s", e)
         
     except Exception as e:
-        logger.error(f"Error procesando solicitud de autorización: {e}")
+        logger.error("Error procesando solicitud de autorización: %s", e)
         try:
             await update.message.reply_text(
                 "❌ Error procesando la solicitud. Inténtalo de nuevo."
             )
         except Exception as e2:
-            logger.error(f"Error enviando mensaje de error: {e2}")
+            logger.error("Error enviando mensaje de error: %s", e2)
 
 async def cmd_aprobar_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Aprobar un grupo (solo administradores)"""
@@ -240,25 +348,15 @@ async def cmd_aprobar_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # Buscar la solicitud
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT chat_title, requester_username 
-            FROM auth_requests 
-            WHERE chat_id = ? AND status = 'pending'
-        """, (chat_id_to_approve,))
-        
-        request = cursor.fetchone()
+        request = await run_db(get_pending_request, chat_id_to_approve)
         if not request:
-            conn.close()
             await update.message.reply_text("❌ No hay solicitud pendiente para ese chat.")
             return
         
         chat_title, requester = request
         
         # Aprobar el grupo
-        authorize_chat(chat_id_to_approve, chat_title, user.id)
-        conn.close()
+        await run_db(authorize_chat, chat_id_to_approve, chat_title, user.id)
         
         await update.message.reply_text(
             f"✅ Grupo aprobado exitosamente:\n"
@@ -275,10 +373,10 @@ async def cmd_aprobar_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                      "Ya pueden usar todos los comandos del bot."
             )
         except Exception as e:
-            logger.warning(f"No se pudo notificar al grupo {chat_id_to_approve}: {e}")
+            logger.warning("No se pudo notificar al grupo %s: %s", chat_id_to_approve, e)
             
     except Exception as e:
-        logger.error(f"Error aprobando grupo: {e}")
+        logger.error("Error aprobando grupo: %s", e)
         await update.message.reply_text("❌ Error procesando la aprobación.")
 
 async def cmd_ver_solicitudes(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -290,17 +388,7 @@ async def cmd_ver_solicitudes(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT chat_id, chat_title, requester_username, requested_at
-            FROM auth_requests 
-            WHERE status = 'pending'
-            ORDER BY requested_at ASC
-        """)
-        
-        requests = cursor.fetchall()
-        conn.close()
+        requests = await run_db(get_pending_requests)
         
         if not requests:
             await update.message.reply_text("✅ No hay solicitudes pendientes.")
@@ -317,7 +405,7 @@ async def cmd_ver_solicitudes(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(message, parse_mode='Markdown')
         
     except Exception as e:
-        logger.error(f"Error viendo solicitudes: {e}")
+        logger.error("Error viendo solicitudes: %s", e)
         await update.message.reply_text("❌ Error obteniendo las solicitudes.")
 
 # Función auxiliar para configurar administrador
@@ -325,7 +413,7 @@ def set_admin_user_id(admin_id: int):
     """Configurar ID del administrador principal"""
     global ADMIN_USER_ID
     ADMIN_USER_ID = admin_id
-    logger.info(f"Administrador configurado: {admin_id}")
+    logger.info("Administrador configurado: %s", admin_id)
 
 # Función para verificar el estado del sistema
 async def cmd_status_auth(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -337,18 +425,7 @@ async def cmd_status_auth(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Contar grupos autorizados
-        cursor.execute("SELECT COUNT(*) FROM authorized_chats WHERE status = 'active'")
-        authorized_count = cursor.fetchone()[0]
-        
-        # Contar solicitudes pendientes
-        cursor.execute("SELECT COUNT(*) FROM auth_requests WHERE status = 'pending'")
-        pending_count = cursor.fetchone()[0]
-        
-        conn.close()
+        authorized_count, pending_count = await run_db(get_auth_counts)
         
         status_message = (
             "📊 **Estado del Sistema de Autorización:**\n\n"
@@ -361,5 +438,116 @@ async def cmd_status_auth(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(status_message, parse_mode='Markdown')
         
     except Exception as e:
-        logger.error(f"Error obteniendo status: {e}")
+        logger.error("Error obteniendo status: %s", e)
         await update.message.reply_text("❌ Error obteniendo el estado del sistema.")
+
+async def cmd_reconciliar_puntos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reconstruir los totales de users desde points e informar diferencias (solo administradores)"""
+    user = update.effective_user
+    
+    if ADMIN_USER_ID is None or user.id != ADMIN_USER_ID:
+        await update.message.reply_text("❌ Solo los administradores pueden usar este comando.")
+        return
+    
+    # "/reconciliar revisar" solo informa, sin corregir
+    apply = not (context.args and context.args[0].lower() == "revisar")
+    
+    try:
+        report = await reconcile_user_totals_async(apply=apply)
+        drift = report["drift"]
+        
+        message = (
+            "🧮 Reconciliación de puntos:\n\n"
+            f"👥 Usuarios revisados: {report['checked']}\n"
+            f"⚠️ Con diferencias: {len(drift)}\n"
+            f"🛠️ Corregidos: {'sí' if apply else 'no (solo revisión)'}"
+        )
+        for entry in drift[:10]:
+            message += (
+                f"\n▫️ {entry['username'] or entry['user_id']}: "
+                f"{entry['stored_points']} → {entry['actual_points']} pts"
+            )
+        if len(drift) > 10:
+            message += f"\n… y {len(drift) - 10} más"
+        
+        await update.message.reply_text(message)
+        logger.info("Reconciliación de puntos: %s usuarios con diferencias (aplicado=%s)", len(drift), apply)
+        
+    except Exception as e:
+        logger.error("Error reconciliando puntos: %s", e)
+        await update.message.reply_text("❌ Error reconciliando los puntos.")
+
+async def cmd_recalcular_logros(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Evaluar las reglas de logros para todos los usuarios (solo administradores)"""
+    user = update.effective_user
+    
+    if ADMIN_USER_ID is None or user.id != ADMIN_USER_ID:
+        await update.message.reply_text("❌ Solo los administradores pueden usar este comando.")
+        return
+    
+    try:
+        from handlers.achievements import backfill_achievements_async
+        report = await backfill_achievements_async()
+        await update.message.reply_text(
+            "🏅 Recálculo de logros:\n\n"
+            f"👥 Usuarios revisados: {report['checked']}\n"
+            f"🎉 Logros otorgados: {report['granted']}"
+        )
+    except Exception as e:
+        logger.error("Error recalculando logros: %s", e)
+        await update.message.reply_text("❌ Error recalculando los logros.")
+
+async def cmd_spam(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Configurar en caliente los patrones de spam (solo administradores)
+
+    /spam                                   ver patrones y umbral de mayúsculas
+    /spam agregar <nombre> <severo|aviso> <regex>
+    /spam quitar <nombre>
+    /spam mayusculas <0.0-1.0>
+    /spam probar <texto>
+    """
+    user = update.effective_user
+
+    if ADMIN_USER_ID is None or user.id != ADMIN_USER_ID:
+        await update.message.reply_text("❌ Solo los administradores pueden usar este comando.")
+        return
+
+    from handlers.security import security_manager
+
+    args = context.args or []
+    action = args[0].lower() if args else "listar"
+
+    try:
+        if action == "agregar" and len(args) >= 4 and args[2].lower() in ("severo", "aviso"):
+            name, severe = args[1].lower(), args[2].lower() == "severo"
+            regex = " ".join(args[3:])
+            security_manager.set_spam_pattern(name, regex, severe)
+            await update.message.reply_text(f"✅ Patrón {name} guardado")
+        elif action == "quitar" and len(args) == 2:
+            removed = security_manager.remove_spam_pattern(args[1].lower())
+            await update.message.reply_text("✅ Patrón eliminado" if removed else "❓ No existe ese patrón")
+        elif action == "mayusculas" and len(args) == 2:
+            ratio = float(args[1])
+            if not 0 < ratio <= 1:
+                raise ValueError("el umbral debe estar entre 0 y 1")
+            security_manager.caps_ratio = ratio
+            await update.message.reply_text(f"✅ Umbral de mayúsculas: {ratio:.0%}")
+        elif action == "probar" and len(args) >= 2:
+            spam = security_manager.classify_spam(" ".join(args[1:]))
+            if spam:
+                await update.message.reply_text(f"🚫 {spam[0]} ({'severo' if spam[1] else 'aviso'})")
+            else:
+                await update.message.reply_text("✅ Sin indicios de spam")
+        elif action == "listar":
+            message = "🛡️ Patrones de spam:\n\n"
+            for name, (regex, severe) in security_manager.spam_patterns.items():
+                message += f"▫️ {name} [{'severo' if severe else 'aviso'}]: {regex}\n"
+            message += f"\n🔠 Umbral de mayúsculas: {security_manager.caps_ratio:.0%}"
+            await update.message.reply_text(message)
+        else:
+            await update.message.reply_text(
+                "Uso: /spam [agregar <nombre> <severo|aviso> <regex> | quitar <nombre> | "
+                "mayusculas <0-1> | probar <texto>]"
+            )
+    except (ValueError, re.error) as e:
+        await update.message.reply_text(f"❌ Configuración no válida: {e}")
@@ -0,0 +1,21 @@
+# tests/conftest.py - Base de datos temporal para cada prueba
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import migrations
+import sistema_autorizacion
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """puntum.db vacía en tmp_path, con todas las tablas y migraciones"""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "puntum.db"))
+    db.create_tables()
+    sistema_autorizacion.create_auth_tables()
+    migrations.run_migrations()
+    yield db
+    db.close_connections()
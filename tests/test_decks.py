@@ -0,0 +1,50 @@
+# tests/test_decks.py - Mazos barajados: sin repetir y con cualquier orden posible
+import itertools
+
+import decks
+
+def deck_conn(db):
+    conn = db.get_connection()
+    try:
+        decks.create_decks_table(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+
+def test_each_pass_is_a_permutation_without_repeats_at_the_seam(fresh_db):
+    deck_conn(fresh_db)
+    shuffled = decks.ShuffledDecks()
+    size = 10
+    passes = [[shuffled.draw(-1, "movies", size) for _ in range(size)] for _ in range(30)]
+    for cards in passes:
+        assert sorted(cards) == list(range(size))
+    for previous, current in zip(passes, passes[1:]):
+        assert previous[-1] != current[0]
+
+def test_orders_are_not_arithmetic_progressions(fresh_db):
+    deck_conn(fresh_db)
+    shuffled = decks.ShuffledDecks()
+    size = 10
+    orders = set()
+    for chat_id in range(200):
+        orders.add(tuple(shuffled.draw(chat_id, "movies", size) for _ in range(size)))
+
+    def affine(order):
+        step = (order[1] - order[0]) % size
+        return all((b - a) % size == step for a, b in zip(order, order[1:]))
+
+    # Con una permutación afín solo hay 40 órdenes posibles, todos progresiones
+    assert len(orders) > 190
+    assert sum(map(affine, orders)) <= 2
+
+def test_resized_deck_reshuffles(fresh_db):
+    deck_conn(fresh_db)
+    shuffled = decks.ShuffledDecks()
+    first = [shuffled.draw(-1, "trivia", 5) for _ in range(3)]
+    resized = [shuffled.draw(-1, "trivia", 8) for _ in range(8)]
+    assert len(set(first)) == 3
+    assert sorted(resized) == list(range(8))
+
+def test_small_decks_cover_every_order():
+    orders = {decks.deck_order(4, seed) for seed in range(2000)}
+    assert orders == set(itertools.permutations(range(4)))
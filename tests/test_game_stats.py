@@ -0,0 +1,118 @@
+# tests/test_game_stats.py - Estadísticas de juegos exactas bajo concurrencia
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import juegos
+
+N_USERS = 40
+N_RESULTS = 4000
+
+@pytest.fixture
+def plays():
+    rng = random.Random(7)
+    return [
+        (rng.randrange(N_USERS), rng.choice(["trivia", "guess_movie", "emoji_movie"]),
+         rng.random() < 0.5, rng.randint(1, 20))
+        for _ in range(N_RESULTS)
+    ]
+
+def expected_stats(plays):
+    """(user_id, game_type) -> [jugadas, ganadas, puntos, mejor racha, racha actual]"""
+    stats = {}
+    for user_id, game_type, won, points in plays:
+        row = stats.setdefault((user_id, game_type), [0, 0, 0, 0, 0])
+        row[0] += 1
+        if won:
+            row[1] += 1
+            row[2] += points
+            row[4] += 1
+            row[3] = max(row[3], row[4])
+        else:
+            row[4] = 0
+    return stats
+
+def stored_stats(db):
+    db.flush_points()
+    conn = db.get_read_connection()
+    try:
+        rows = conn.execute(
+            """SELECT user_id, game_type, games_played, games_won, total_points, best_streak, current_streak
+               FROM game_stats"""
+        ).fetchall()
+    finally:
+        conn.close()
+    return {(user_id, game_type): list(values) for user_id, game_type, *values in rows}
+
+def by_user(plays):
+    # Las rachas dependen del orden: cada usuario juega sus partidas en orden
+    per_user = {}
+    for play in plays:
+        per_user.setdefault(play[0], []).append(play)
+    return list(per_user.values())
+
+def test_concurrent_tasks_keep_exact_counters(fresh_db, plays):
+    juegos.create_games_tables()
+
+    async def player(results):
+        for user_id, game_type, won, points in results:
+            await juegos.update_game_stats_async(user_id, f"u{user_id}", game_type,
+                                                 won=won, points=points if won else 0)
+            await asyncio.sleep(0)
+
+    async def hammer():
+        await asyncio.gather(*(player(results) for results in by_user(plays)))
+
+    # Flushes a la vez que se encolan resultados
+    done = threading.Event()
+    def flusher():
+        while not done.is_set():
+            fresh_db.flush_points()
+
+    thread = threading.Thread(target=flusher)
+    thread.start()
+    try:
+        asyncio.run(hammer())
+    finally:
+        done.set()
+        thread.join()
+
+    assert stored_stats(fresh_db) == expected_stats(plays)
+
+def test_concurrent_threads_keep_exact_counters(fresh_db, plays):
+    juegos.create_games_tables()
+
+    def player(results):
+        for user_id, game_type, won, points in results:
+            juegos.update_game_stats(user_id, f"u{user_id}", game_type, won=won, points=points if won else 0)
+
+    with ThreadPoolExecutor(16) as executor:
+        list(executor.map(player, by_user(plays)))
+
+    assert stored_stats(fresh_db) == expected_stats(plays)
+
+def test_results_replay_with_their_points_after_a_crash(fresh_db, monkeypatch):
+    juegos.create_games_tables()
+    # Escritor que no confirma nada por su cuenta hasta la "caída"
+    crashed = fresh_db.PointsWriteBehind(flush_interval_ms=3_600_000, max_events=10**6,
+                                         journal_path=f"{fresh_db.DB_PATH}-points.journal")
+    crashed.start()
+    monkeypatch.setattr(fresh_db, "_points_writer", crashed)
+    fresh_db.add_points(1, "u1", 5, "#trivia", chat_id=-1)
+    juegos.update_game_stats(1, "u1", "trivia", won=True, points=5)
+
+    # Caída: lo que estaba en memoria se pierde, el journal queda en disco
+    with crashed._lock:
+        crashed._events = []
+        juegos.game_stats_buffer.drain()
+        crashed._journal.close()
+        crashed._journal = None
+    monkeypatch.setattr(fresh_db, "_points_writer", None)
+
+    fresh_db.start_points_writer()
+    assert fresh_db.get_user_total_points(1) == 5
+    assert stored_stats(fresh_db) == {(1, "trivia"): [1, 1, 5, 1, 1]}
+    crashed.stop()
@@ -0,0 +1,59 @@
+# tests/test_game_store.py - Juegos activos: escritura inmediata y restauración
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from game_store import GameStore, create_game_store_table
+
+@pytest.fixture
+def store_db(fresh_db):
+    conn = fresh_db.get_connection()
+    try:
+        create_game_store_table(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+    return fresh_db
+
+def game(**extra):
+    return {"type": "trivia", "started_at": datetime.now(), **extra}
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_written_games_survive_a_restart_without_any_flush(store_db, shared):
+    store = GameStore(shared=shared)
+
+    async def play():
+        await store.set_async(1, game(hints_used=0))
+        await store.set_async(2, game())
+        await store.set_async(1, game(hints_used=1))
+        assert await store.pop_async(2) is not None
+        assert await store.pop_async(2) is None
+
+    asyncio.run(play())
+    # Un proceso nuevo solo tiene lo que está en SQLite
+    restarted = GameStore(shared=shared)
+    assert restarted.restore(30) == 1
+    assert restarted[1]["hints_used"] == 1
+
+def test_restore_drops_old_games(store_db):
+    store = GameStore()
+    store[1] = game()
+    store[2] = game(started_at=datetime.now() - timedelta(minutes=31))
+    restarted = GameStore()
+    assert restarted.restore(30) == 1
+    assert 1 in restarted and 2 not in restarted
+
+def test_local_writes_land_in_call_order(store_db):
+    store = GameStore()
+
+    async def burst():
+        # set y pop del mismo chat sin esperar: el DELETE no puede adelantar al UPSERT
+        await asyncio.gather(*(
+            coro for chat_id in range(50)
+            for coro in (store.set_async(chat_id, game()), store.pop_async(chat_id))
+        ))
+
+    asyncio.run(burst())
+    assert len(store) == 0
+    assert GameStore().restore(30) == 0
@@ -0,0 +1,12 @@
+# tests/test_query_plans.py - Las consultas calientes usan índices
+import migrations
+
+def test_hot_queries_use_indexes(fresh_db):
+    assert migrations.check_query_plans() == []
+
+def test_full_scan_is_reported(fresh_db, monkeypatch):
+    # Sin índice en username, el detector tiene que verlo
+    monkeypatch.setattr(migrations, "HOT_QUERIES", [
+        ("por nombre", "SELECT id FROM users WHERE username = ?", ("x",)),
+    ])
+    assert migrations.check_query_plans() == [("por nombre", "SCAN users")]
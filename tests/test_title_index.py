@@ -0,0 +1,16 @@
+# tests/test_title_index.py - Respuestas de los juegos contra el índice de títulos
+from title_index import TitleEntry
+
+def test_short_titles_only_match_exactly():
+    up = TitleEntry("Up")
+    assert up.matches("Up")
+    assert up.matches("¡UP!")
+    # Demasiado corto para buscarlo dentro de una frase o con errores
+    assert not up.matches("creo que es up")
+    assert not up.matches("Us")
+
+def test_long_titles_allow_typos_inside_a_sentence():
+    matrix = TitleEntry("The Matrix", ["Matrix"])
+    assert matrix.matches("creo que es matriz")
+    assert matrix.matches("the matrix")
+    assert not matrix.matches("ma")
@@ -0,0 +1,18 @@
+# text_norm.py - Plegado de tildes compartido por hashtags y títulos (sin dependencias)
+import unicodedata
+
+def _build_accent_fold_table():
+    """Tabla para str.translate: letra latina acentuada -> letra base"""
+    table = {}
+    for start, end in ((0x00C0, 0x0250), (0x1E00, 0x1F00)):
+        for code in range(start, end):
+            char = chr(code)
+            folded = ''.join(c for c in unicodedata.normalize('NFD', char) if unicodedata.category(c) != 'Mn')
+            if folded != char and len(folded) == 1:
+                table[code] = folded
+    # Marcas combinantes sueltas (texto ya en NFD)
+    for code in range(0x0300, 0x0370):
+        table[code] = None
+    return table
+
+ACCENT_FOLD_TABLE = _build_accent_fold_table()
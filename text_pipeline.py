@@ -0,0 +1,148 @@
+# text_pipeline.py - Un único handler para los mensajes de texto
+#
+# Antes había dos MessageHandler (hashtags y juegos), cada uno con su
+# auth_required y su propio análisis del texto, y PTB solo ejecuta el primero
+# que coincide: un mensaje con hashtags nunca contaba como respuesta al juego.
+# Ahora cada mensaje pasa por todas las etapas:
+#   auth        una sola comprobación de autorización
+#   parse       hashtags y palabras una sola vez (el texto normalizado para
+#               títulos solo si hay juego activo)
+#   hashtags    puntos por hashtags
+#   challenges  bonos de retos (solo si el mensaje dio puntos)
+#   games       respuesta al juego activo del chat
+# Cada etapa se cronometra; un fallo en una no impide las siguientes.
+import time
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes
+from sistema_autorizacion import check_authorized
+from hashtags import find_hashtags_in_message, count_words, score_hashtags, normalize_text
+from handlers.retos import check_challenges_async
+from juegos import active_games, check_game_guess
+from title_index import normalize_title
+from outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_STAGES = ("auth", "parse", "hashtags", "challenges", "games")
+
+# Resumen de tiempos en el log cada tantos mensajes
+PIPELINE_LOG_EVERY = 1000
+# Mensajes más lentos que esto se registran con el desglose por etapa
+PIPELINE_SLOW_MS = 500
+
+class ParsedMessage:
+    """El texto de un mensaje, analizado una vez para todas las etapas"""
+
+    __slots__ = ("text", "hashtags", "word_count", "_folded", "_normalized")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.hashtags = find_hashtags_in_message(text)
+        self.word_count = count_words(text) if self.hashtags else 0
+        self._folded = None
+        self._normalized = None
+
+    @property
+    def folded(self) -> str:
+        """Texto sin tildes y en minúsculas (solo para los retos)"""
+        if self._folded is None:
+            self._folded = normalize_text(self.text)
+        return self._folded
+
+    @property
+    def normalized(self) -> str:
+        """Texto para comparar con títulos (solo hace falta con un juego activo)"""
+        if self._normalized is None:
+            self._normalized = normalize_title(self.text)
+        return self._normalized
+
+class StageTimings:
+    """Veces, tiempo total y máximo por etapa"""
+
+    def __init__(self):
+        self.messages = 0
+        self._stats = {stage: [0, 0.0, 0.0] for stage in PIPELINE_STAGES}
+
+    def record(self, stage: str, seconds: float):
+        stats = self._stats[stage]
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds > stats[2]:
+            stats[2] = seconds
+
+    def snapshot(self):
+        """{etapa: (veces, media en ms, máximo en ms)}"""
+        return {
+            stage: (count, total / count * 1000 if count else 0.0, peak * 1000)
+            for stage, (count, total, peak) in self._stats.items()
+        }
+
+    def reset(self):
+        self.messages = 0
+        for stats in self._stats.values():
+            stats[:] = [0, 0.0, 0.0]
+
+    def log_summary(self):
+        logger.info("Pipeline de texto (%s mensajes): %s", self.messages, ", ".join(
+            f"{stage} {avg:.2f}/{peak:.1f} ms ×{count}"
+            for stage, (count, avg, peak) in self.snapshot().items()
+        ))
+
+stage_timings = StageTimings()
+
+async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler de todos los mensajes de texto que no son comandos"""
+    if not update.message or not update.message.text:
+        return
+
+    spent = {}
+    clock = time.perf_counter()
+
+    def mark(stage):
+        nonlocal clock
+        now = time.perf_counter()
+        spent[stage] = now - clock
+        stage_timings.record(stage, spent[stage])
+        clock = now
+
+    allowed = await check_authorized(update)
+    mark("auth")
+    if not allowed:
+        return
+
+    parsed = ParsedMessage(update.message.text)
+    mark("parse")
+
+    if parsed.hashtags:
+        points = 0
+        try:
+            points = await score_hashtags(update, context, parsed.hashtags, parsed.word_count)
+        except Exception as e:
+            logger.exception("Error puntuando hashtags: %s", e)
+        mark("hashtags")
+
+        if points:
+            try:
+                for notice in await check_challenges_async(update, context, parsed.text, parsed.folded):
+                    outbox.reply(update.message, notice)
+            except Exception as e:
+                logger.exception("Error comprobando retos: %s", e)
+            mark("challenges")
+
+    if await active_games.contains_async(update.effective_chat.id):
+        try:
+            await check_game_guess(update, context, parsed.normalized)
+        except Exception as e:
+            logger.exception("Error comprobando respuesta de juego: %s", e)
+        mark("games")
+
+    total_ms = sum(spent.values()) * 1000
+    if total_ms > PIPELINE_SLOW_MS:
+        logger.warning("Mensaje lento (%.0f ms) en el chat %s: %s", total_ms, update.effective_chat.id,
+                       ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in spent.items()))
+
+    stage_timings.messages += 1
+    if stage_timings.messages >= PIPELINE_LOG_EVERY:
+        stage_timings.log_summary()
+        stage_timings.reset()
@@ -0,0 +1,141 @@
+# title_index.py - Índice de títulos para comprobar respuestas de los juegos
+import re
+from typing import Dict, List
+from text_norm import ACCENT_FOLD_TABLE
+
+# Artículos que se pueden omitir al principio del título
+LEADING_ARTICLES = ("el", "la", "los", "las", "lo", "un", "una", "the", "a", "an")
+
+# Por debajo de este largo (sin espacios) una respuesta no cuenta
+MIN_GUESS_LENGTH = 3
+
+# Mensajes más largos se cortan: nadie escribe el título después de 30 palabras
+MAX_GUESS_TOKENS = 30
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+def normalize_title(text: str) -> str:
+    """Minúsculas, sin tildes ni signos, espacios simples"""
+    return _NON_WORD.sub(" ", text.translate(ACCENT_FOLD_TABLE).lower()).strip()
+
+def strip_article(normalized: str) -> str:
+    first, _, rest = normalized.partition(" ")
+    if rest and first in LEADING_ARTICLES:
+        return rest
+    return normalized
+
+def bigrams(text: str) -> frozenset:
+    return frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+def max_typos(length: int) -> int:
+    """Errores de tipeo tolerados según el largo de la variante"""
+    if length < 5:
+        return 0
+    if length < 9:
+        return 1
+    return 2
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """Distancia de edición, o limit + 1 en cuanto se sabe que la supera"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if limit == 0:
+        return 0 if a == b else 1
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            cost = previous[j - 1] + (char_a != char_b)
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current.append(cost)
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class TitleEntry:
+    """Variantes precalculadas de un título.
+
+    Cada variante es (texto, nº de palabras, errores tolerados, bigramas).
+    Un error de tipeo rompe como mucho dos bigramas, así que si al mensaje le
+    faltan más de 2 * errores bigramas de la variante, no hace falta calcular
+    ninguna distancia de edición.
+    """
+
+    __slots__ = ("title", "variants", "exact")
+
+    def __init__(self, title: str, aliases: List[str] = ()):
+        exact = set()
+        variants = {}
+        for name in (title, *aliases):
+            normalized = normalize_title(name)
+            for variant in (normalized, strip_article(normalized)):
+                if variant:
+                    exact.add(variant)
+                # Un título corto ("Up") solo acierta escrito tal cual, no dentro
+                # de una frase ni con errores
+                if len(variant.replace(" ", "")) >= MIN_GUESS_LENGTH:
+                    variants[variant] = (variant, variant.count(" ") + 1,
+                                         max_typos(len(variant)), bigrams(variant))
+        self.title = title
+        self.variants = tuple(variants.values())
+        self.exact = frozenset(exact)
+
+    def matches(self, guess: str, normalized: str = None) -> bool:
+        """True si el mensaje contiene el título (o algo a pocos errores de tipeo).
+
+        normalized: normalize_title(guess) si ya se calculó
+        """
+        if normalized is None:
+            normalized = normalize_title(guess)
+        if normalized in self.exact:
+            return True
+        if len(normalized.replace(" ", "")) < MIN_GUESS_LENGTH:
+            return False
+
+        tokens = normalized.split(" ")[:MAX_GUESS_TOKENS]
+        guess_bigrams = bigrams(" ".join(tokens))
+        for variant, word_count, typos, variant_bigrams in self.variants:
+            if len(variant_bigrams - guess_bigrams) > 2 * typos:
+                continue
+            # Ventanas de palabras del mensaje con el mismo número de palabras
+            # que la variante ("creo que es matriz" -> "matriz")
+            for start in range(len(tokens) - word_count + 1):
+                window = " ".join(tokens[start:start + word_count])
+                if window == variant:
+                    return True
+                if typos and bounded_levenshtein(window, variant, typos) <= typos:
+                    return True
+        return False
+
+class TitleIndex:
+    """Títulos del catálogo ya normalizados, por título original"""
+
+    def __init__(self, movies: List[Dict] = ()):
+        self._entries = {}
+        for movie in movies:
+            self.add(movie)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, movie: Dict) -> TitleEntry:
+        entry = TitleEntry(movie["title"], movie.get("aliases", ()))
+        self._entries[movie["title"]] = entry
+        return entry
+
+    def get(self, movie: Dict) -> TitleEntry:
+        entry = self._entries.get(movie["title"])
+        if entry is None:
+            entry = self.add(movie)
+        return entry
+
+    def is_correct_guess(self, movie: Dict, guess: str, normalized: str = None) -> bool:
+        return self.get(movie).matches(guess, normalized)
@@ -1,7 +1,7 @@
 
 from telegram import Update
 from telegram.ext import ContextTypes
-from db import get_user_stats
+from db import get_user_stats_async, get_user_rank_async
 
 def get_user_level(points):
     if points < 50:
@@ -16,7 +16,7 @@ def get_user_level(points):
 async def cmd_mipuntaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username or update.effective_user.first_name
-    stats = get_user_stats(user_id)
+    stats = await get_user_stats_async(user_id)
 
     if not stats:
         await update.message.reply_text("❌ Aún no tienes puntos.")
@@ -32,7 +32,7 @@ async def cmd_mipuntaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_miperfil(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    stats = get_user_stats(user_id)
+    stats = await get_user_stats_async(user_id)
 
     if not stats:
         await update.message.reply_text("❌ No tienes actividad registrada.")
@@ -48,8 +48,15 @@ async def cmd_miperfil(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_mirank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    rank = get_user_stats(user_id).get("rank", "No disponible")
+    info = await get_user_rank_async(user_id)
 
-    await update.message.reply_text(
-        f"📈 Estás en la posición #{rank} del ranking."
-    )
+    if not info:
+        await update.message.reply_text("📈 Aún no estás en el ranking. ¡Usa hashtags para entrar!")
+        return
+
+    text = f"📈 Estás en la posición #{info['rank']} de {info['total_users']} con {info['points']} puntos.\n"
+    for position, other_id, username, points in info["neighbors"]:
+        marker = "👉" if other_id == user_id else "▫️"
+        text += f"\n{marker} {position}. {username} - {points} pts"
+
+    await update.message.reply_text(text)